@@ -0,0 +1,85 @@
+"""
+Times populate_dispatch_features_table against the original build with one features_prejoin
+table per feature, built by threads of 5 features, and one UPDATE of the features table per feature.
+Both run on copies of features.<dispatch_feature_table_name> and the resulting tables are compared.
+
+Example:
+    python -m benchmarks.benchmark_dispatch_features --config dispatch_config.yaml
+"""
+import argparse
+import datetime
+import threading
+import time
+
+from eis import populate_features
+from eis import setup_environment
+from eis import utils
+from eis.features import class_map
+
+
+def prejoin_dispatch_features_table(config, table_name, engine):
+    # original implementation of populate_features.populate_dispatch_features_table
+    feature_list = [feat for feat, is_set_true in config['dispatch_features'].items() if is_set_true]
+
+    def run_thread(feature_sublist, engine):
+        db_conn = engine.connect()
+        for feature_name in feature_sublist:
+            feature_obj = class_map.lookup(feature_name,
+                                           unit='dispatch',
+                                           from_date=config['raw_data_from_date'],
+                                           to_date=config['raw_data_to_date'],
+                                           fake_today=datetime.datetime.today(),
+                                           table_name=table_name)
+            feature_obj.build_and_insert(db_conn)
+        db_conn.close()
+
+    feature_threads = []
+    for i in range(0, len(feature_list), 5):
+        t = threading.Thread(target=run_thread, args=(feature_list[i:i + 5], engine,))
+        feature_threads.append(t)
+        t.start()
+    for thread in feature_threads:
+        thread.join()
+
+    for feature_name in feature_list:
+        engine.execute("UPDATE features.{table_name} AS feature_table "
+                       "SET {feature} = prejoin_table.{feature} "
+                       "FROM features_prejoin.{feature} AS prejoin_table "
+                       "WHERE feature_table.dispatch_id = prejoin_table.dispatch_id "
+                       .format(table_name=table_name, feature=feature_name))
+
+
+def main(config_file):
+    config = utils.read_yaml(config_file)
+    engine = setup_environment.get_database()
+    table_name = config['dispatch_feature_table_name']
+    feature_list = [feat for feat, is_set_true in config['dispatch_features'].items() if is_set_true]
+
+    seconds = {}
+    for name, build in [('prejoin', prejoin_dispatch_features_table),
+                        ('grouped', populate_features.populate_dispatch_features_table)]:
+        copy_name = '{}_{}'.format(table_name, name)
+        engine.execute('DROP TABLE IF EXISTS features."{0}"; CREATE TABLE features."{0}" AS '
+                       'SELECT * FROM features."{1}"'.format(copy_name, table_name))
+        start = time.time()
+        build(config, copy_name, engine)
+        seconds[name] = time.time() - start
+
+    columns = ", ".join(['dispatch_id'] + feature_list)
+    differences = engine.execute('SELECT count(*) FROM ((SELECT {columns} FROM features."{table}_prejoin" '
+                                 'EXCEPT SELECT {columns} FROM features."{table}_grouped") UNION ALL '
+                                 '(SELECT {columns} FROM features."{table}_grouped" '
+                                 'EXCEPT SELECT {columns} FROM features."{table}_prejoin")) d'
+                                 .format(columns=columns, table=table_name)).scalar()
+
+    print('{} features, {} rows different'.format(len(feature_list), differences))
+    print('grouped CREATE TABLE AS   {:>8.1f}s'.format(seconds['grouped']))
+    print('prejoin tables and UPDATE {:>8.1f}s  ({:.1f}x)'.format(seconds['prejoin'],
+                                                                 seconds['prejoin'] / seconds['grouped']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", help="dispatch config file", default='dispatch_config.yaml')
+    args = parser.parse_args()
+    main(args.config)
@@ -0,0 +1,87 @@
+"""
+Compares the ways FeatureLoader.get_dataset can assemble a matrix.
+
+Every assembly mode is run in its own child process so the peak RSS
+reported for one mode is not inflated by the other.
+
+Example:
+    python -m benchmarks.benchmark_matrix_loading --config default.yaml --labels labels.yaml \
+        --as_of_dates 2015-01-01 2015-02-01 --assembly merge copy
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+from eis import setup_environment
+from eis import utils
+from eis.feature_loader import FeatureLoader
+
+
+def build_feature_loader(config, labels_config, db_engine, **matrix_options):
+    labels_config = {label: labels_config[label] for and_labels in config['labels'] for label in and_labels}
+    temporal_info = config['temporal_info']
+    return FeatureLoader(config['feature_blocks'],
+                         config['schema_feature_blocks'],
+                         config['officer_features'],
+                         labels_config,
+                         config['labels'],
+                         config['officer_label_table_name'],
+                         temporal_info['prediction_window'][0],
+                         temporal_info['officer_past_activity_window'][0],
+                         temporal_info['timegated_feature_lookback_duration'],
+                         db_engine,
+                         **matrix_options)
+
+
+def _run_mode(config_file, labels_file, as_of_dates, assembly, results):
+    config = utils.read_yaml(config_file)
+    labels_config = utils.read_yaml(labels_file)
+    db_engine = setup_environment.get_database()
+
+    feature_loader = build_feature_loader(config, labels_config, db_engine, assembly=assembly)
+    # resolve the feature columns before timing so only the loading is measured
+    feature_loader.features_list()
+
+    start = time.time()
+    df = feature_loader.get_dataset(as_of_dates)
+    elapsed = time.time() - start
+
+    results[assembly] = {'rows': len(df),
+                         'columns': len(df.columns),
+                         'seconds': elapsed,
+                         'rows_per_second': len(df) / elapsed if elapsed else float('inf'),
+                         # ru_maxrss is reported in kilobytes on linux
+                         'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+
+def main(config_file, labels_file, as_of_dates, assemblies):
+    manager = multiprocessing.Manager()
+    results = manager.dict()
+    for assembly in assemblies:
+        process = multiprocessing.Process(target=_run_mode,
+                                          args=(config_file, labels_file, as_of_dates, assembly, results))
+        process.start()
+        process.join()
+
+    print('{:<10} {:>10} {:>8} {:>10} {:>12} {:>14}'.format('assembly', 'rows', 'columns', 'seconds',
+                                                          'rows/sec', 'peak RSS (MB)'))
+    for assembly in assemblies:
+        if assembly not in results:
+            print('{:<10} failed'.format(assembly))
+            continue
+        r = results[assembly]
+        print('{:<10} {:>10} {:>8} {:>10.2f} {:>12.0f} {:>14.1f}'.format(assembly, r['rows'], r['columns'],
+                                                                      r['seconds'], r['rows_per_second'],
+                                                                      r['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, help="pass your config", default="default.yaml")
+    parser.add_argument("--labels", type=str, help="pass your labels config", default="labels.yaml")
+    parser.add_argument("--as_of_dates", type=str, nargs='+', help="as of dates of the matrix", required=True)
+    parser.add_argument("--assembly", type=str, nargs='+', help="assembly modes to compare",
+                        default=['merge', 'copy', 'join'])
+    args = parser.parse_args()
+    main(args.config, args.labels, args.as_of_dates, args.assembly)
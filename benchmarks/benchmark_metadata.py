@@ -0,0 +1,39 @@
+"""
+Times the canonical form of the matrix metadata against the original selection sort.
+
+Example:
+    python -m benchmarks.benchmark_metadata --n_features 5000
+"""
+import argparse
+import random
+import time
+
+from eis.metadata import _selection_sort, sort_multiple_types
+
+
+def main(n_features, n_dates):
+    feature_names = ['feature_{}'.format(i) for i in range(n_features)]
+    as_of_dates = ['2015-{:02d}-01'.format(i % 12 + 1) for i in range(n_dates)]
+
+    for name, values in [('feature_names', feature_names), ('feature_as_of_dates', as_of_dates)]:
+        random.shuffle(values)
+
+        start = time.time()
+        expected = _selection_sort(list(values))
+        selection_seconds = time.time() - start
+
+        start = time.time()
+        result = sort_multiple_types(list(values))
+        sort_seconds = time.time() - start
+
+        assert result == expected
+        print('{:<20} {:>8} elements  selection sort {:>8.3f}s  sort {:>8.4f}s'.format(
+            name, len(values), selection_seconds, sort_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_features", type=int, help="number of feature names", default=5000)
+    parser.add_argument("--n_dates", type=int, help="number of as of dates", default=365)
+    args = parser.parse_args()
+    main(args.n_features, args.n_dates)
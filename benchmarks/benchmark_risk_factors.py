@@ -0,0 +1,53 @@
+"""
+Times the top 5 risk factors of individual_feature_ranking against the original
+loop of nlargest and concat over every officer.
+
+Example:
+    python -m benchmarks.benchmark_risk_factors --n_officers 10000 --n_features 200
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from eis.risk_factors import rank_distances, top_risk_factors
+
+
+def nlargest_loop(test_matrix):
+    distances = pd.DataFrame(rank_distances(test_matrix.values), columns=test_matrix.columns)
+    matrix_transposed = distances.T
+    result = pd.DataFrame(np.zeros((0, 5)), columns=['risk_1', 'risk_2', 'risk_3', 'risk_4', 'risk_5'])
+    for i in matrix_transposed.columns:
+        df1row = pd.DataFrame(matrix_transposed.nlargest(5, i).index.tolist(),
+                              index=['risk_1', 'risk_2', 'risk_3', 'risk_4', 'risk_5']).T
+        result = pd.concat([result, df1row], axis=0)
+    return result.reset_index(drop=True)
+
+
+def main(n_officers, n_features, skip_loop):
+    np.random.seed(0)
+    # count like features with many ties
+    test_matrix = pd.DataFrame(np.random.poisson(2, size=(n_officers, n_features)).astype(np.float32),
+                               columns=['feature_{}'.format(i) for i in range(n_features)])
+
+    start = time.time()
+    result = top_risk_factors(test_matrix)
+    vectorized_seconds = time.time() - start
+    print('vectorized       {:>10.3f}s'.format(vectorized_seconds))
+
+    if not skip_loop:
+        start = time.time()
+        expected = nlargest_loop(test_matrix)
+        loop_seconds = time.time() - start
+        assert (result.values == expected.values).all()
+        print('nlargest loop    {:>10.3f}s  ({:.0f}x)'.format(loop_seconds, loop_seconds / vectorized_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_officers", type=int, help="rows of the test matrix", default=10000)
+    parser.add_argument("--n_features", type=int, help="features ranked", default=200)
+    parser.add_argument("--skip_loop", help="only time the vectorized version", action='store_true')
+    args = parser.parse_args()
+    main(args.n_officers, args.n_features, args.skip_loop)
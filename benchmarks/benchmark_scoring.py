@@ -0,0 +1,61 @@
+"""
+Times the threshold metrics of calculate_all_evaluation_metrics against the original
+computation with sorted lists, binary lists and sklearn at every cutoff.
+
+Example:
+    python -m benchmarks.benchmark_scoring --n_rows 50000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from eis import scoring
+from eis.threshold_metrics import ThresholdMetrics
+
+PARAMETERS = {'pct': [0.01, 0.10, 0.25, 0.50, 1.0, 5.0, 10.0, 25.0, 50.0, 75.0, 100.0],
+              'abs': [10, 50, 100, 200, 500, 1000]}
+
+
+def sorted_lists_metrics(test_label, test_predictions):
+    all_metrics = dict()
+    test_predictions_sorted, test_label_sorted = zip(*sorted(zip(test_predictions, test_label),
+                                                             key=lambda pair: pair[0], reverse=True))
+    for x_type, x_values in PARAMETERS.items():
+        for x_value in x_values:
+            binary = scoring.generate_binary_at_x(test_predictions_sorted, x_value, unit=x_type)
+            suffix = "{}_{}".format(str(x_value), x_type)
+            all_metrics["precision@|" + suffix] = scoring.precision_at_x(test_label_sorted, binary)
+            all_metrics["recall@|" + suffix] = scoring.recall_at_x(test_label_sorted, binary)
+            TP, TN, FP, FN = scoring.confusion_matrix_at_x(test_label_sorted, binary)
+            all_metrics["true positives@|" + suffix] = TP
+            all_metrics["true negatives@|" + suffix] = TN
+            all_metrics["false positives@|" + suffix] = FP
+            all_metrics["false negatives@|" + suffix] = FN
+    return all_metrics
+
+
+def main(n_rows):
+    np.random.seed(0)
+    test_label = (np.random.rand(n_rows) < 0.1).astype(int).tolist()
+    test_predictions = np.random.rand(n_rows).round(3).tolist()
+
+    start = time.time()
+    result = ThresholdMetrics(test_label, test_predictions).metrics(PARAMETERS)
+    vectorized_seconds = time.time() - start
+
+    start = time.time()
+    expected = sorted_lists_metrics(test_label, test_predictions)
+    lists_seconds = time.time() - start
+
+    assert result == expected
+    print('{} rows, {} metrics'.format(n_rows, len(result)))
+    print('cumulative true positives {:>8.3f}s'.format(vectorized_seconds))
+    print('sorted lists and sklearn  {:>8.3f}s  ({:.0f}x)'.format(lists_seconds, lists_seconds / vectorized_seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_rows", type=int, help="rows of the test matrix", default=50000)
+    args = parser.parse_args()
+    main(args.n_rows)
@@ -0,0 +1,174 @@
+"""
+Cohort of officers used for each as_of_date: officers that are sworn and have any
+logged activity in staging.events_hub within the officer_past_activity_window.
+
+Instead of probing events_hub and officer_roles for every (officer, as_of_date) pair,
+the activity of each officer is stored once as non overlapping time ranges
+(an event at t makes the officer active on [t, t + window)) and the sworn period as
+[first sworn job_start_date, infinity). Both tables have GiST indexes so the cohort
+for any list of dates is an interval join.
+"""
+
+import logging
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+ACTIVITY_TABLE = 'features.officer_activity_intervals'
+SWORN_TABLE = 'features.officer_sworn_intervals'
+BUILDS_TABLE = 'features.officer_cohort_builds'
+
+
+def _create_tables(cur):
+    cur.execute(""" CREATE TABLE IF NOT EXISTS {activity_table} (
+                        officer_id        int,
+                        activity_window   text,
+                        active_range      tsrange);
+                    CREATE INDEX IF NOT EXISTS officer_activity_intervals_range_idx
+                        ON {activity_table} USING gist (active_range);
+                    CREATE INDEX IF NOT EXISTS officer_activity_intervals_window_idx
+                        ON {activity_table} (activity_window, officer_id);
+                    CREATE TABLE IF NOT EXISTS {sworn_table} (
+                        officer_id        int PRIMARY KEY,
+                        sworn_range       tsrange);
+                    CREATE INDEX IF NOT EXISTS officer_sworn_intervals_range_idx
+                        ON {sworn_table} USING gist (sworn_range);
+                    CREATE TABLE IF NOT EXISTS {builds_table} (
+                        activity_window   text PRIMARY KEY,
+                        built_at          timestamp); """
+                .format(activity_table=ACTIVITY_TABLE,
+                        sworn_table=SWORN_TABLE,
+                        builds_table=BUILDS_TABLE))
+
+
+def _build_activity_intervals(cur, window):
+    # gaps and islands: an event starts a new interval when it begins after the end
+    # of every previous interval of the officer
+    cur.execute(""" DELETE FROM {activity_table} WHERE activity_window = '{window}';
+                    INSERT INTO {activity_table} (officer_id, activity_window, active_range)
+                    WITH events AS (
+                        SELECT e.officer_id,
+                               e.event_datetime AS range_start,
+                               e.event_datetime + INTERVAL '{window}' AS range_end
+                        FROM staging.events_hub e
+                        JOIN staging.officers_hub o USING (officer_id)
+                        WHERE e.event_datetime IS NOT NULL
+                    ), flagged AS (
+                        SELECT officer_id,
+                               range_start,
+                               range_end,
+                               CASE WHEN range_start <= max(range_end) OVER (PARTITION BY officer_id
+                                                                          ORDER BY range_start, range_end
+                                                                          ROWS BETWEEN UNBOUNDED PRECEDING
+                                                                                   AND 1 PRECEDING)
+                                    THEN 0 ELSE 1 END AS new_island
+                        FROM events
+                    ), islands AS (
+                        SELECT officer_id,
+                               range_start,
+                               range_end,
+                               sum(new_island) OVER (PARTITION BY officer_id
+                                                     ORDER BY range_start, range_end
+                                                     ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS island
+                        FROM flagged
+                    )
+                    SELECT officer_id,
+                           '{window}',
+                           tsrange(min(range_start), max(range_end), '[)')
+                    FROM islands
+                    GROUP BY officer_id, island; """
+                .format(activity_table=ACTIVITY_TABLE, window=window))
+
+
+def _build_sworn_intervals(cur):
+    cur.execute(""" TRUNCATE {sworn_table};
+                    INSERT INTO {sworn_table} (officer_id, sworn_range)
+                    SELECT r.officer_id,
+                           tsrange(min(r.job_start_date)::timestamp, NULL, '[)')
+                    FROM staging.officer_roles r
+                    JOIN staging.officers_hub o USING (officer_id)
+                    WHERE r.sworn_flag = 1
+                      AND r.job_start_date IS NOT NULL
+                    GROUP BY r.officer_id; """
+                .format(sworn_table=SWORN_TABLE))
+
+
+def build_cohort_tables(db_engine, windows, rebuild=True):
+    """
+    Computes the activity intervals for every window and the sworn intervals
+    Args:
+        db_engine: engine to connect to db
+        windows (list): officer_past_activity_window values, e.g. ['1y']
+        rebuild (bool): recompute windows that were already built, needed when staging changed
+    """
+    db_conn = db_engine.raw_connection()
+    try:
+        cur = db_conn.cursor()
+        # serialize workers building the cohort
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('{}'))".format(BUILDS_TABLE))
+        _create_tables(cur)
+
+        cur.execute("SELECT activity_window FROM {builds_table}".format(builds_table=BUILDS_TABLE))
+        built_windows = set(row[0] for row in cur.fetchall())
+        windows_to_build = [window for window in set(windows) if rebuild or window not in built_windows]
+
+        if windows_to_build:
+            if rebuild or not built_windows:
+                log.info('Building officer sworn intervals')
+                _build_sworn_intervals(cur)
+
+            for window in windows_to_build:
+                log.info('Building officer activity intervals for window: {}'.format(window))
+                _build_activity_intervals(cur, window)
+                cur.execute(""" DELETE FROM {builds_table} WHERE activity_window = '{window}';
+                                INSERT INTO {builds_table} VALUES ('{window}', now()); """
+                            .format(builds_table=BUILDS_TABLE, window=window))
+
+            cur.execute("ANALYZE {activity_table}; ANALYZE {sworn_table};"
+                        .format(activity_table=ACTIVITY_TABLE, sworn_table=SWORN_TABLE))
+        db_conn.commit()
+    finally:
+        db_conn.close()
+    return None
+
+
+def get_query_active(window):
+    """
+    Returns the 'active' subquery with the officers active and sworn on each date of
+    the as_of_dates subquery, it replaces the LATERAL probes into events_hub and officer_roles.
+    The activity intervals of an officer do not overlap so each (officer, date) matches once.
+    """
+    query = (" active AS ( "
+             "       SELECT a.officer_id, d.as_of_date "
+             "       FROM as_of_dates as d "
+             "       JOIN {activity_table} a "
+             "         ON a.active_range @> d.as_of_date "
+             "        AND a.activity_window = '{window}' "
+             "       JOIN {sworn_table} s "
+             "         ON s.officer_id = a.officer_id "
+             "        AND s.sworn_range @> d.as_of_date )"
+             .format(activity_table=ACTIVITY_TABLE,
+                     sworn_table=SWORN_TABLE,
+                     window=window))
+    return query
+
+
+def get_cohort(db_engine, as_of_dates, window):
+    """
+    Returns the officers active on each of the as_of_dates in one query
+    Args:
+        db_engine: engine to connect to db
+        as_of_dates (list): dates as 'YYYY-MM-DD' strings
+        window (str): officer_past_activity_window, e.g. '1y'
+    Returns:
+        DataFrame with officer_id and as_of_date
+    """
+    build_cohort_tables(db_engine, [window], rebuild=False)
+    query = (" WITH as_of_dates as ( "
+             "      select unnest(ARRAY{as_of_dates}::timestamp[]) as as_of_date), "
+             " {active_subquery} "
+             " SELECT officer_id, as_of_date FROM active "
+             .format(as_of_dates=list(as_of_dates),
+                     active_subquery=get_query_active(window)))
+    return pd.read_sql(query, db_engine)
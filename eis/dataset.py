@@ -1,3 +1,4 @@
+import collections
 import numpy as np
 import pandas as pd
 import yaml
@@ -10,6 +11,7 @@ import pdb
 import uuid
 import metta
 
+from . import results_writer
 from . import setup_environment
 from .features import class_map
 
@@ -122,7 +124,7 @@ def store_feature_importances( timestamp, to_save):
                                             "feature": to_save["feature_importances_names"],
                                             "feature_importance": to_save["feature_importances"] })
     # Insert
-    dataframe_for_insert.to_sql( "feature_importances", engine, if_exists="append", schema="results", index=False )
+    results_writer.write_dataframe(engine, "results.feature_importances", dataframe_for_insert)
 
     return None
 
@@ -151,7 +153,7 @@ def store_individual_feature_importances(timestamp, to_save):
     df_risks.columns = ["risk_1", "risk_2","risk_3","risk_4","risk_5","unit_id"]
     df_risks["model_id"] = this_model_id
 
-    df_risks.to_sql( "individual_importances", engine, if_exists="append", schema="results", index=False )
+    results_writer.write_dataframe(engine, "results.individual_importances", df_risks)
 
 def store_prediction_info( timestamp, unit_id_train, unit_id_test, unit_predictions, unit_labels, my_exp_config ):
     """ Write the model predictions (officer or dispatch risk scores) to the results schema.
@@ -176,8 +178,7 @@ def store_prediction_info( timestamp, unit_id_train, unit_id_test, unit_predicti
     unit_id_test  = [int(unit_id) for unit_id in unit_id_test]
     unit_labels   = [int(unit_id) for unit_id in unit_labels]
 
-    # append data into predictions table. there is probably a faster way to do this than put it into a
-    # dataframe and then use .to_sql but this works for now.
+    # append data into predictions table
     dataframe_for_insert = pd.DataFrame( {  "model_id": this_model_id,
                                             "entity_id": unit_id_test,
                                             "score": unit_predictions,
@@ -188,7 +189,7 @@ def store_prediction_info( timestamp, unit_id_train, unit_id_test, unit_predicti
     dataframe_for_insert['rank_abs'] = dataframe_for_insert['score'].rank(method='dense', ascending=False)
     dataframe_for_insert['rank_pct'] = dataframe_for_insert['score'].rank(method='dense', ascending=False, pct=True)
 
-    dataframe_for_insert.to_sql( "predictions", engine, if_exists="append", schema="results", index=False )
+    results_writer.write_dataframe(engine, "results.predictions", dataframe_for_insert)
 
     return None
 
@@ -229,6 +230,69 @@ def store_evaluation_metrics( model_id, evaluation, metric, test_date, db_conn,
     return None
 
 
+class EvaluationSink():
+    def __init__(self, db_engine, flush_size=1):
+        '''
+        Collects the evaluation metrics of every (model_id, test_date) and writes them with
+        one DELETE and one COPY in a single transaction, instead of a commit per metric
+        Args:
+            db_engine: engine to connect to db
+            flush_size (int): number of (model_id, test_date) evaluations collected before writing,
+                              above 1 the writes of several models are coalesced
+        '''
+        self.db_engine = db_engine
+        self.flush_size = flush_size
+        # (model_id, test_date) -> rows of results.evaluations, a new evaluation replaces a pending one
+        self.evaluations = collections.OrderedDict()
+
+    def add(self, model_id, test_date, all_metrics):
+        """
+        Adds the metrics of a model for a test date, keys are formatted as 'metric|parameter|comment'
+        """
+        rows = []
+        for key, evaluation in all_metrics.items():
+            key_parts = key.split('|')
+            metric = key_parts[0]
+            # same values as store_evaluation_metrics: a missing parameter is stored
+            # as the text 'Null' and a missing comment as NULL
+            parameter = key_parts[1] if len(key_parts) > 1 and key_parts[1] != '' else 'Null'
+            comment = str(key_parts[2]) if len(key_parts) > 2 else None
+            # round to 10 digits to avoid underflow errors
+            rows.append((model_id, metric, parameter, round(float(evaluation), 10), comment,
+                         test_date, test_date))
+        self.evaluations[(model_id, test_date)] = rows
+
+        if len(self.evaluations) >= self.flush_size:
+            self.flush()
+        return None
+
+    def flush(self):
+        """
+        Writes the collected evaluations, replacing the existing ones of the same model and test date
+        """
+        if not self.evaluations:
+            return None
+
+        # remove all existing evaluations before re-writing
+        delete_query = (""" DELETE FROM results.evaluations
+                            WHERE (model_id, evaluation_start_time) IN (VALUES {}) """
+                        .format(", ".join("({}, '{}'::TIMESTAMP)".format(model_id, test_date)
+                                          for model_id, test_date in self.evaluations)))
+        db_conn = self.db_engine.raw_connection()
+        try:
+            results_writer.copy_rows(db_conn,
+                                     'results.evaluations',
+                                     ['model_id', 'metric', 'parameter', 'value', 'comment',
+                                      'evaluation_start_time', 'evaluation_end_time'],
+                                     (row for rows in self.evaluations.values() for row in rows),
+                                     delete_query=delete_query)
+        finally:
+            db_conn.close()
+
+        self.evaluations.clear()
+        return None
+
+
 def format_officer_ids(ids):
     formatted = ["{}".format(each_id) for each_id in ids]
     formatted = ", ".join(formatted)
@@ -356,7 +420,7 @@ class FeatureLoader():
         self.labels_table = labels_table
         self.prediction_window = prediction_window
         self.officer_past_activity_window = officer_past_activity_window
-        self.db_con = db_engine.connect()
+        self.db_engine = db_engine
         self.flatten_label_keys = [item for sublist in self.labels for item in sublist]
 
     def _tree_conditions(self, nested_dict, parent=[], conditions=[]):
@@ -0,0 +1,251 @@
+"""
+Incremental builds of the collate tables of the feature blocks.
+
+Every (prefix, as_of_date, lookback) built for a block is recorded in {schema}.feature_build_log,
+together with a checksum of the staging rows of the block for every month. A build only computes
+the as_of_dates that are not recorded, or that come after a month whose staging rows changed,
+into a scratch schema of the block and appends them to its tables. When the columns of a table differ
+(new features, lookbacks or lookup values) the whole block is rebuilt.
+"""
+import hashlib
+import logging
+
+from . import results_writer
+
+log = logging.getLogger(__name__)
+
+BUILD_LOG_TABLE = 'feature_build_log'
+CHECKSUMS_TABLE = 'feature_staging_checksums'
+# lookback recorded for the space-time tables, aggregated over the whole history
+ALL_LOOKBACK = 'all'
+
+
+def create_tables(engine, schema):
+    """
+    Creates the build log and checksums tables, before the blocks are built at the same time:
+    concurrent CREATE TABLE IF NOT EXISTS can fail in postgres
+    """
+    engine.execute(""" CREATE TABLE IF NOT EXISTS {schema}.{build_log} (
+                           block text,
+                           prefix text,
+                           as_of_date date,
+                           lookback text,
+                           features_hash text,
+                           built_at timestamp DEFAULT now(),
+                           PRIMARY KEY (block, prefix, as_of_date, lookback));
+                       CREATE TABLE IF NOT EXISTS {schema}.{checksums} (
+                           block text,
+                           month date,
+                           checksum text,
+                           PRIMARY KEY (block, month)); """
+                   .format(schema=schema, build_log=BUILD_LOG_TABLE, checksums=CHECKSUMS_TABLE))
+
+
+def _features_hash(feature_list):
+    return hashlib.md5(','.join(sorted(feature_list)).encode('utf-8')).hexdigest()
+
+
+def _lookbacks(block):
+    if isinstance(block.lookback_durations, dict):
+        return sorted({lookback for lookbacks in block.lookback_durations.values() for lookback in lookbacks})
+    return list(block.lookback_durations)
+
+
+def _prefix_lookbacks(block, prefix):
+    if prefix == block.prefix_space_time:
+        return [ALL_LOOKBACK]
+    return _lookbacks(block)
+
+
+def _dated_prefixes(block):
+    # tables without as_of_date (named with ND) are rebuilt every time, post features are
+    # recomputed from the tables of the block
+    return [prefix for prefix in block.prefix if 'ND' not in prefix and prefix != block.prefix_post]
+
+
+def dates_built(block, build_log_rows):
+    """
+    Returns the as_of_dates recorded for every prefix and current lookback of the block
+    Args:
+        block (FeaturesBlock): block of the rows
+        build_log_rows (list): (prefix, as_of_date, lookback) recorded with the current features
+    """
+    recorded = {}
+    for prefix, as_of_date, lookback in build_log_rows:
+        recorded.setdefault(prefix, {}).setdefault(as_of_date, set()).add(lookback)
+
+    dates = None
+    for prefix, lookbacks_by_date in recorded.items():
+        expected = set(_prefix_lookbacks(block, prefix))
+        prefix_dates = {as_of_date for as_of_date, lookbacks in lookbacks_by_date.items() if expected <= lookbacks}
+        dates = prefix_dates if dates is None else dates & prefix_dates
+    return dates or set()
+
+
+def first_changed_month(stored, current):
+    """
+    Returns the first month (str 'YYYY-MM-DD') whose checksum is new, removed or different, None if none changed
+    """
+    changed = [month for month in set(stored) | set(current) if stored.get(month) != current.get(month)]
+    return min(changed) if changed else None
+
+
+def staging_checksums(engine, block):
+    """
+    Returns a dict of month to md5 of the staging rows of the block with a date in that month
+    """
+    if not block.from_obj or not block.date_column:
+        return {}
+    query = (""" SELECT month::text, md5(string_agg(row_md5, '' ORDER BY row_md5))
+                 FROM (SELECT date_trunc('month', checksum_date)::date AS month, md5(t::text) AS row_md5
+                       FROM (SELECT {date_column} AS checksum_date, * FROM {from_obj}) t
+                       WHERE checksum_date IS NOT NULL) hashed
+                 GROUP BY month """
+             .format(date_column=block.date_column, from_obj=str(block.from_obj)))
+    return {month: checksum for month, checksum in engine.execute(query)}
+
+
+def _table_columns(engine, schema, table):
+    query = (""" SELECT column_name FROM information_schema.columns
+                 WHERE table_schema = '{schema}' AND table_name = '{table}' """
+             .format(schema=schema, table=table))
+    return {row[0] for row in engine.execute(query)}
+
+
+def _record_build(engine, schema, block_name, block, as_of_dates, features_hash, checksums, replace_all):
+    db_conn = engine.raw_connection()
+    try:
+        if replace_all:
+            condition = ''
+        else:
+            condition = "AND as_of_date = ANY('{{{dates}}}'::date[])".format(dates=','.join(as_of_dates))
+        results_writer.copy_rows(db_conn,
+                                 '{}.{}'.format(schema, BUILD_LOG_TABLE),
+                                 ['block', 'prefix', 'as_of_date', 'lookback', 'features_hash'],
+                                 [(block_name, prefix, as_of_date, lookback, features_hash)
+                                  for prefix in _dated_prefixes(block)
+                                  for lookback in _prefix_lookbacks(block, prefix)
+                                  for as_of_date in as_of_dates],
+                                 delete_query="DELETE FROM {schema}.{table} WHERE block = '{block}' {condition}"
+                                 .format(schema=schema, table=BUILD_LOG_TABLE, block=block_name, condition=condition))
+        results_writer.copy_rows(db_conn,
+                                 '{}.{}'.format(schema, CHECKSUMS_TABLE),
+                                 ['block', 'month', 'checksum'],
+                                 [(block_name, month, checksum) for month, checksum in checksums.items()],
+                                 delete_query="DELETE FROM {schema}.{table} WHERE block = '{block}'"
+                                 .format(schema=schema, table=CHECKSUMS_TABLE, block=block_name))
+    finally:
+        db_conn.close()
+
+
+def _full_build(engine, block, as_of_dates, feature_list, schema):
+    block.prefix = []
+    block.build_collate(engine, as_of_dates, feature_list, schema)
+    block.build_post_features(engine, feature_list, schema)
+    return list(block.prefix)
+
+
+def scratch_schema(schema, block_name):
+    """
+    Returns the schema where the missing as_of_dates of a block are built, one per block so the
+    blocks built at the same time, or by two runs, never drop the tables of another block.
+    Unquoted, postgres folds it to lower case
+    """
+    return '{}_incremental_{}'.format(schema, block_name).lower()
+
+
+def _append_build(engine, block, block_name, missing_dates, feature_list, schema):
+    """
+    Builds missing_dates into the scratch schema of the block and moves them into the block tables
+    Returns the prefixes of the tables created, None when the columns differ from the existing tables
+    """
+    scratch = scratch_schema(schema, block_name)
+    engine.execute('DROP SCHEMA IF EXISTS {scratch} CASCADE; CREATE SCHEMA {scratch};'.format(scratch=scratch))
+    try:
+        block.prefix = []
+        block.build_collate(engine, missing_dates, feature_list, scratch)
+        dated = _dated_prefixes(block)
+        for prefix in dated:
+            table = '{}_aggregation'.format(prefix)
+            if _table_columns(engine, scratch, table) != _table_columns(engine, schema, table):
+                log.info('Columns of {}.{} changed'.format(schema, table))
+                return None
+
+        created = [prefix for prefix in block.prefix if prefix not in dated]
+        db_conn = engine.raw_connection()
+        try:
+            cur = db_conn.cursor()
+            for prefix in dated:
+                table = '{}_aggregation'.format(prefix)
+                columns = ", ".join('"{}"'.format(column) for column in sorted(_table_columns(engine, scratch, table)))
+                cur.execute(""" DELETE FROM {schema}."{table}" WHERE as_of_date::date = ANY('{{{dates}}}'::date[]);
+                                INSERT INTO {schema}."{table}" ({columns})
+                                SELECT {columns} FROM {scratch}."{table}"; """
+                            .format(schema=schema, scratch=scratch, table=table, columns=columns,
+                                    dates=','.join(missing_dates)))
+            for prefix in created:
+                cur.execute(""" DROP TABLE IF EXISTS {schema}."{table}";
+                                ALTER TABLE {scratch}."{table}" SET SCHEMA {schema}; """
+                            .format(schema=schema, scratch=scratch, table='{}_aggregation'.format(prefix)))
+            db_conn.commit()
+        finally:
+            db_conn.close()
+    finally:
+        engine.execute('DROP SCHEMA IF EXISTS {scratch} CASCADE'.format(scratch=scratch))
+
+    block.build_post_features(engine, feature_list, schema)
+    if block.prefix_post in block.prefix:
+        created.append(block.prefix_post)
+    return created
+
+
+def build_block(engine, block, block_name, as_of_dates, feature_list, schema):
+    """
+    Builds the as_of_dates of the block that are not in its tables yet, or whose staging data changed
+    Args:
+        engine: engine to connect to db
+        block (FeaturesBlock): block class from officers_collate
+        block_name (str): name of the block in the config file
+        as_of_dates (list): str 'YYYY-MM-DD' of every as_of_date the tables should have
+        feature_list (list): features of the block to build
+        schema (str): schema of the collate tables
+    Returns:
+        list of the prefixes of the tables created, which need their primary key
+    """
+    create_tables(engine, schema)
+    features_hash = _features_hash(feature_list)
+    build_log_rows = engine.execute(""" SELECT prefix, as_of_date::text, lookback
+                                        FROM {schema}.{table}
+                                        WHERE block = '{block}' AND features_hash = '{features_hash}' """
+                                    .format(schema=schema, table=BUILD_LOG_TABLE, block=block_name,
+                                            features_hash=features_hash)).fetchall()
+    stored_checksums = {month: checksum for month, checksum in engine.execute(
+        """ SELECT month::text, checksum FROM {schema}.{table} WHERE block = '{block}' """
+        .format(schema=schema, table=CHECKSUMS_TABLE, block=block_name))}
+    checksums = staging_checksums(engine, block)
+
+    built = dates_built(block, build_log_rows)
+    changed_month = first_changed_month(stored_checksums, checksums)
+    if changed_month:
+        # rows dated in changed_month or later are counted by the as_of_dates after it
+        log.info('Staging data of {} changed since {}'.format(block_name, changed_month))
+        built = {as_of_date for as_of_date in built if as_of_date <= changed_month}
+    missing_dates = sorted(set(as_of_dates) - built)
+
+    if not missing_dates:
+        log.info('{} is up to date for {} as_of_dates'.format(block_name, len(as_of_dates)))
+        return []
+
+    created = None
+    if built:
+        log.info('Building {} missing as_of_dates of {}'.format(len(missing_dates), block_name))
+        created = _append_build(engine, block, block_name, missing_dates, feature_list, schema)
+    full_build = created is None
+    if full_build:
+        log.info('Building all the as_of_dates of {}'.format(block_name))
+        created = _full_build(engine, block, as_of_dates, feature_list, schema)
+        missing_dates = sorted(set(as_of_dates))
+
+    _record_build(engine, schema, block_name, block, missing_dates, features_hash, checksums,
+                  replace_all=full_build)
+    return created
@@ -0,0 +1,137 @@
+"""
+Catalog of the feature columns available in the feature block tables.
+
+It resolves the columns of the active features of every block table with one query to
+information_schema, instead of one call to the stored procedure get_active_block_features
+per block table, and keeps the result for the process until populate_features rebuilds
+the tables.
+"""
+import collections
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# _id_<time window or 'all'>_<Feature>_ in the names of the collate columns,
+# same expression as get_active_block_features
+COLUMN_PATTERN = re.compile(r'_id_(P\d+\w|all)?[_]?([A-Z][A-Za-z0-9]+)_')
+
+# (schema_name, blocks, lookback durations) -> features_in_blocks
+_catalog = {}
+
+
+def _created_features(columns):
+    """
+    Yields (column_name, created feature, time window) of the columns named after a feature,
+    the created feature is prefixed by its time window when the column has one
+    """
+    for column in columns:
+        match = COLUMN_PATTERN.search(column)
+        if match:
+            window, feature = match.groups()
+            yield column, window + '_' + feature if window else feature, window
+
+
+def resolve_table_features(columns, features, timegated_feature_lookback_duration):
+    """
+    Python version of get_active_block_features for the columns of one block table
+    Args:
+        columns (list): column names of the block table
+        features (list): active features that are still missing
+        timegated_feature_lookback_duration (list): time windows of the features
+    Returns:
+        col_available (list): columns of the table for the features, sorted
+        col_missing (list): features without any column in the table, sorted
+    """
+    created = list(_created_features(columns))
+    features = set(features)
+    non_timewindow = {feature for _, feature, window in created if window is None}
+    all_columns = {feature.replace('all_', '') for _, feature, window in created if window == 'all'}
+
+    # features requested for every time window, except the ones created without
+    # a time window or for the whole history ('all'), which are requested as they are
+    requested = {(feature, window + '_' + feature)
+                 for window in timegated_feature_lookback_duration for feature in features}
+    requested -= {(feature, window + '_' + feature)
+                  for window in timegated_feature_lookback_duration for feature in non_timewindow}
+    requested -= {(feature, window + '_' + feature)
+                  for window in timegated_feature_lookback_duration for feature in all_columns}
+    requested |= {(feature, feature) for feature in non_timewindow & features}
+    requested |= {('all_' + feature, 'all_' + feature) for feature in all_columns & features}
+
+    columns_by_feature = collections.defaultdict(list)
+    for column, feature, _ in created:
+        columns_by_feature[feature].append(column)
+
+    col_available = sorted(column for _, requested_column in requested
+                           for column in columns_by_feature.get(requested_column, []))
+    col_missing = sorted({feature for feature, requested_column in requested
+                          if requested_column not in columns_by_feature})
+    return col_available, col_missing
+
+
+def _table_columns(db_engine, schema_name, table_names):
+    query = (""" SELECT table_name, column_name
+                 FROM information_schema.columns
+                 WHERE table_schema = '{schema_name}'
+                   AND table_name = ANY(ARRAY{table_names}::text[])
+                 ORDER BY table_name, ordinal_position """
+             .format(schema_name=schema_name, table_names=list(table_names)))
+    table_columns = collections.defaultdict(list)
+    for table_name, column_name in db_engine.execute(query):
+        table_columns[table_name].append(column_name)
+    return table_columns
+
+
+def features_in_blocks(db_engine, schema_name, blocks, timegated_feature_lookback_duration):
+    """
+    Returns the columns of the active features in every block table. The tables of a block are
+    searched in order, a feature found in one table is not searched in the next ones
+    Args:
+        db_engine: engine to connect to db
+        schema_name (str): schema of the feature block tables
+        blocks (list): (block name, block table names, active features) of every block
+        timegated_feature_lookback_duration (list): time windows of the features
+    Returns:
+        OrderedDict of block table name to list of columns
+    """
+    key = (schema_name,
+           tuple((block, tuple(block_tables), tuple(sorted(active_features)))
+                 for block, block_tables, active_features in blocks),
+           tuple(timegated_feature_lookback_duration))
+    if key in _catalog:
+        return _catalog[key]
+
+    table_columns = _table_columns(db_engine, schema_name,
+                                   [block_table for _, block_tables, _ in blocks for block_table in block_tables])
+
+    result = collections.OrderedDict()
+    features_missing = []
+    for block, block_tables, active_features in blocks:
+        for block_table in block_tables:
+            if not active_features:
+                break
+            col_available, active_features = resolve_table_features(table_columns.get(block_table, []),
+                                                                    active_features,
+                                                                    timegated_feature_lookback_duration)
+            if col_available:
+                result[block_table] = col_available
+        features_missing += active_features
+
+    if not features_missing:
+        log.debug('No features are missing')
+    else:
+        log.debug('These features are missing: {}'.format(features_missing))
+
+    _catalog[key] = result
+    return result
+
+
+def invalidate(schema_name=None):
+    """
+    Forgets the resolved features of schema_name, or of every schema, after the tables are rebuilt
+    """
+    for key in list(_catalog):
+        if schema_name is None or key[0] == schema_name:
+            del _catalog[key]
+    return None
@@ -1,11 +1,23 @@
+import csv
+import hashlib
+import json
+import tempfile
+import numpy as np
 import pandas as pd
 import logging
-import pdb
+from . import cohort
+from . import feature_catalog
 from .features import class_map
 from .features import officers_collate
+from .matrix_builder import MatrixBuilder, column_name
 
 log = logging.getLogger(__name__)
 
+# postgres allows at most 1664 entries in a select list
+MAX_JOIN_COLUMNS = 1600
+# rows parsed at a time when streaming a COPY into a matrix
+COPY_CHUNK_ROWS = 50000
+
 
 class FeatureLoader():
 
@@ -18,7 +30,10 @@ class FeatureLoader():
                        prediction_window, 
                        officer_past_activity_window,
                        timegated_feature_lookback_duration,
-                       db_engine):
+                       db_engine,
+                       assembly='merge',
+                       materialize_labels=False,
+                       cohort_intervals=False):
         '''
         Args:
             feature_blocks (dict): dictionary of feature blocks and list of features to use for the matrix
@@ -28,6 +43,14 @@ class FeatureLoader():
             labels (dict): labels dictionary to use from the config file
             prediction_window (str) : prediction window to use for the label generation
             officer_past_activity_window (str): window for conditioning which officers to use given an as_of_date
+            assembly (str): how the block tables are loaded into the matrix
+                            'merge': fetchall of every block table into tuples
+                            'copy': COPY of every block table into float32 columns
+                            'join': one LEFT JOIN of all the block tables in the database
+            materialize_labels (bool): read the labels from an indexed table that is only filled
+                                       for the as_of_dates missing, instead of recomputing them
+            cohort_intervals (bool): select the active officers with the precomputed activity and sworn
+                                     intervals (see eis/cohort.py) instead of probing events_hub for every pair
         '''
 
         self.features = features
@@ -40,6 +63,9 @@ class FeatureLoader():
         self.officer_past_activity_window = officer_past_activity_window
         self.timegated_feature_lookback_duration = timegated_feature_lookback_duration
         self.db_engine = db_engine
+        self.assembly = assembly
+        self.materialize_labels_table = materialize_labels
+        self.cohort_intervals = cohort_intervals
 
         self.flatten_label_keys = [item for sublist in self.labels for item in sublist]
 
@@ -62,38 +88,15 @@ class FeatureLoader():
         return [feature for list_features in self.features_in_blocks().values() for feature in list_features]
 
     def features_in_blocks(self):
-        
-        features_in_blocks = {}
-        features_missing = [] 
-        for block in self.blocks:
-            active_features = [key for key in self.features[block] if self.features[block][key] == True]
-            block_tables = self._block_tables_name(block)
-            for block_table in block_tables:
-                if active_features:
-                    query = (""" select * FROM public.get_active_block_features('{schema_name}',
-                                                                                '{block_table}',
-                                                                                 ARRAY{active_features},
-                                                                                 ARRAY{timegated_feature_lookback_duration});"""
-                             .format(schema_name=self.schema_name,
-                                     block_table=block_table,
-                                     active_features=active_features,
-                                     timegated_feature_lookback_duration=self.timegated_feature_lookback_duration))
-                    
-                    result = self.db_engine.connect().execute(query)
-                    result_dict = [dict(row) for row in result][0]
-                    features_in_blocks[block_table] = result_dict['col_avaliable']
-                    # keep going through the rest of features
-                    active_features = result_dict['col_missing']
-
-            if result_dict['col_missing']:
-                features_missing += result_dict['col_missing']
-        if not features_missing:
-            log.debug('No features are missing')
-        else:
-            log.debug('These features are missing: {}'.format(features_missing))
+        blocks = [(block,
+                   self._block_tables_name(block),
+                   [key for key in self.features[block] if self.features[block][key] == True])
+                  for block in self.blocks]
+        return feature_catalog.features_in_blocks(self.db_engine,
+                                                  self.schema_name,
+                                                  blocks,
+                                                  self.timegated_feature_lookback_duration)
 
-        return features_in_blocks
-         
     def _tree_conditions(self, nested_dict, parent=[], conditions=[]):
         '''
         Function that returns a list of conditions from the labels config file
@@ -207,7 +210,191 @@ class FeatureLoader():
                                                 query_select=query_select_labels))
         return query_labels
 
+    def _block_table_query(self, table_name, features, as_of_dates_to_use):
+        features_coalesce = ", ".join(['coalesce("{0}",0) as {0}'.format(feature) for feature in features])
+
+        # table with no date
+        if 'ND' in table_name:
+            query = ("""SELECT officer_id,
+                               {features_coalesce}
+                        FROM {schema}."{table_name}"
+                         WHERE officer_id is not null """
+                                        .format(features_coalesce=features_coalesce,
+                                                            schema=self.schema_name,
+                                                            table_name=table_name))
+        else:
+            query = ("""SELECT officer_id,
+                               as_of_date::timestamp,
+                              {features_coalesce}
+                        FROM {schema}."{table_name}"
+                        WHERE as_of_date in (
+                            SELECT unnest(ARRAY{as_of_dates}::DATE[]))
+                         AND officer_id is not null
+                            """.format(features_coalesce=features_coalesce,
+                                             schema=self.schema_name,
+                                             table_name=table_name,
+                                             as_of_dates=as_of_dates_to_use))
+        return query
+
+    def _fetch_to_frame(self, query):
+        """
+        Loads the result of a query through a named server side cursor,
+        building the DataFrame from the list of tuples returned by fetchall
+        """
+        db_conn = self.db_engine.raw_connection()
+        try:
+            cur = db_conn.cursor(name='cursor_for_loading_matrix')
+            cur.execute(query)
+            table = cur.fetchall()
+
+            # Get column names
+            col_names = []
+            for desc in cur.description:
+                col_names.append(desc[0])
+        finally:
+            db_conn.close()
+
+        # To pandas df
+        return pd.DataFrame(table, columns=col_names)
+
+    def _copy_to_frame(self, query, int_columns=('officer_id',), date_columns=('as_of_date',)):
+        """
+        Streams the result of a query with COPY ... TO STDOUT and parses it
+        straight into typed columns, skipping the list of tuples and the
+        Decimal object created for every numeric cell by fetchall.
+        The CSV is spooled to a temporary file so the raw text does not stay in memory.
+        Args:
+            query (str): SELECT statement without a trailing semicolon
+            int_columns (tuple): columns parsed as integers
+            date_columns (tuple): columns parsed as timestamps
+        Returns:
+            DataFrame with every other column as float32
+        """
+        db_conn = self.db_engine.raw_connection()
+        try:
+            return self._copy_to_frame_with_cursor(db_conn.cursor(), query, int_columns, date_columns)
+        finally:
+            db_conn.close()
+
+    def _copy_to_frame_with_cursor(self, cur, query, int_columns=('officer_id',), date_columns=('as_of_date',)):
+        with tempfile.TemporaryFile() as buffer:
+            cur.copy_expert("COPY ({query}) TO STDOUT WITH CSV HEADER".format(query=query), buffer)
+            buffer.seek(0)
+            col_names = next(csv.reader([buffer.readline().decode('utf-8')]))
+            buffer.seek(0)
+
+            dtypes = {col: np.float32 for col in col_names if col not in int_columns and col not in date_columns}
+            dtypes.update({col: np.int64 for col in col_names if col in int_columns})
+            table = pd.read_csv(buffer,
+                                dtype=dtypes,
+                                parse_dates=[col for col in col_names if col in date_columns])
+        return table
+
+    def _load_table(self, query):
+        if self.assembly == 'copy':
+            return self._copy_to_frame(query)
+        return self._fetch_to_frame(query)
+
+    def label_definition_hash(self):
+        """
+        Returns a hash of the label definition (labels and their conditions)
+        used to key the materialized labels
+        """
+        definition = json.dumps({'labels': self.labels, 'labels_config': self.labels_config}, sort_keys=True)
+        return hashlib.md5(definition.encode('utf-8')).hexdigest()
+
+    def materialize_labels(self, as_of_dates_to_use):
+        """
+        Stores the labels of the as_of_dates that are not yet in features.<labels_table>_materialized,
+        keyed by (officer_id, as_of_date, label definition hash, prediction_window).
+        Only the positive labels are stored, the as_of_dates already computed are kept in
+        features.<labels_table>_materialized_dates so dates without labels are not recomputed.
+        """
+        label_hash = self.label_definition_hash()
+        db_conn = self.db_engine.raw_connection()
+        try:
+            cur = db_conn.cursor()
+            # serialize workers filling the same labels table
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('features.{labels_table}_materialized'))"
+                        .format(labels_table=self.labels_table))
+
+            cur.execute(""" CREATE TABLE IF NOT EXISTS features."{labels_table}_materialized" (
+                                officer_id          int,
+                                as_of_date          timestamp,
+                                label_hash          text,
+                                prediction_window   text,
+                                PRIMARY KEY (label_hash, prediction_window, as_of_date, officer_id));
+                            CREATE TABLE IF NOT EXISTS features."{labels_table}_materialized_dates" (
+                                label_hash          text,
+                                prediction_window   text,
+                                as_of_date          timestamp,
+                                PRIMARY KEY (label_hash, prediction_window, as_of_date)); """
+                        .format(labels_table=self.labels_table))
+
+            cur.execute(""" SELECT to_char(as_of_date, 'YYYY-MM-DD')
+                            FROM (SELECT unnest(ARRAY{as_of_dates}::timestamp[]) as as_of_date
+                                  EXCEPT
+                                  SELECT as_of_date
+                                  FROM features."{labels_table}_materialized_dates"
+                                  WHERE label_hash = '{label_hash}'
+                                    AND prediction_window = '{prediction_window}') missing """
+                        .format(as_of_dates=as_of_dates_to_use,
+                                labels_table=self.labels_table,
+                                label_hash=label_hash,
+                                prediction_window=self.prediction_window))
+            missing_dates = sorted(row[0] for row in cur.fetchall())
+
+            if missing_dates:
+                log.info('Materializing labels for as of dates: {}'.format(missing_dates))
+                cur.execute(""" INSERT INTO features."{labels_table}_materialized"
+                                     (officer_id, as_of_date, label_hash, prediction_window)
+                                {labels_subquery}
+                                SELECT officer_id, as_of_date, '{label_hash}', '{prediction_window}'
+                                FROM labels """
+                            .format(labels_table=self.labels_table,
+                                    labels_subquery=self.get_query_labels(missing_dates),
+                                    label_hash=label_hash,
+                                    prediction_window=self.prediction_window))
+                cur.execute(""" INSERT INTO features."{labels_table}_materialized_dates"
+                                     (label_hash, prediction_window, as_of_date)
+                                SELECT '{label_hash}', '{prediction_window}', unnest(ARRAY{as_of_dates}::timestamp[]) """
+                            .format(labels_table=self.labels_table,
+                                    label_hash=label_hash,
+                                    prediction_window=self.prediction_window,
+                                    as_of_dates=missing_dates))
+            db_conn.commit()
+        finally:
+            db_conn.close()
+        return label_hash
+
+    def get_query_materialized_labels(self, as_of_dates_to_use):
+        """
+        Returns the same as_of_dates and labels subqueries as get_query_labels, reading the
+        labels from the materialized table after filling the as_of_dates that are missing
+        """
+        label_hash = self.materialize_labels(as_of_dates_to_use)
+        query_labels = (" WITH as_of_dates as ( "
+                        "      select unnest(ARRAY{as_of_dates}::timestamp[]) as as_of_date), "
+                        " labels as ( "
+                        "      SELECT officer_id, "
+                        "             as_of_date, "
+                        "             1 as outcome "
+                        "      FROM features.\"{labels_table}_materialized\" "
+                        "      WHERE label_hash = '{label_hash}' "
+                        "        AND prediction_window = '{prediction_window}' "
+                        "        AND as_of_date = ANY(ARRAY{as_of_dates}::timestamp[])) "
+                        .format(as_of_dates=as_of_dates_to_use,
+                                labels_table=self.labels_table,
+                                label_hash=label_hash,
+                                prediction_window=self.prediction_window))
+        return query_labels
+
     def get_dataset(self, as_of_dates_to_use):
+        if self.assembly == 'join':
+            return self.get_dataset_joined(as_of_dates_to_use)
+        if self.assembly == 'copy':
+            return self.get_dataset_copied(as_of_dates_to_use)
+
         features_in_blocks = self.features_in_blocks()
         # Read labels master 
         complete_df = self.get_master_labels(as_of_dates_to_use)
@@ -215,45 +402,11 @@ class FeatureLoader():
         #loop through every table in blocks
         for table_name, features in features_in_blocks.items():
             log.info('Joining table {}!'.format(table_name))
-            features_coalesce = ", ".join(['coalesce("{0}",0) as {0}'.format(feature) for feature in features])
-             
-            # table with no date
-            if 'ND' in table_name:
-                query = ("""SELECT officer_id,
-                                   {features_coalesce}
-                            FROM {schema}."{table_name}"
-                             WHERE officer_id is not null; """
-                                            .format(features_coalesce=features_coalesce,
-                                                                schema=self.schema_name,
-                                                                table_name=table_name))                                    
-            else:
-                query = ("""SELECT officer_id,
-                                   as_of_date::timestamp,
-                                  {features_coalesce}
-                            FROM {schema}."{table_name}"
-                            WHERE as_of_date in (
-                                SELECT unnest(ARRAY{as_of_dates}::DATE[]))
-                             AND officer_id is not null
-                                ;""".format(features_coalesce=features_coalesce,
-                                                 schema=self.schema_name,
-                                                 table_name=table_name,
-                                                 as_of_dates=as_of_dates_to_use))
-            # Get the data
-            db_conn = self.db_engine.raw_connection()
-            cur = db_conn.cursor(name='cursor_for_loading_matrix')
-            cur.execute(query)
-            table = cur.fetchall()
+            query = self._block_table_query(table_name, features, as_of_dates_to_use)
 
-            # Get column names
-            col_names = []
-            for desc in cur.description:
-                col_names.append(desc[0])  
+            # Get the data
+            table = self._load_table(query)
 
-            # To pandas df
-            table = pd.DataFrame(table)
-            table.columns = col_names
-            db_conn.close()
-            
             if 'ND' in table_name:
                  complete_df = complete_df.merge(table, on='officer_id', how='left')
             else:
@@ -275,81 +428,125 @@ class FeatureLoader():
         log.info('number of officers with adverse incident: {}'.format(complete_df['outcome'].sum() ))
         return complete_df
 
-    def get_query_features(self):
-        table_names = [x for block in self.blocks for x in  self._block_tables_name(block)]  
-
-        #[item for sublist in self.labels for item in sublist]
-        # seperate the tables by block that have a date column or not
-        table_names_no_date = [x for x in table_names if 'ND' in x]
-        table_names_with_date = [x for x in table_names if x not in set(table_names_no_date)]
-
-        # convert features to string for querying while replacing NULL values with ceros in sql
-        features_coalesce = ", ".join(['coalesce("{0}",0) as {0}'.format(feature) for feature in self.features_list()])
-
-        query = ""
-        if len(table_names) > 0:
-            if table_names_with_date:
-                query = (""" SELECT officer_id,
-                                    as_of_date,
-                                    {features_coalesce}
-                              FROM {schema}."{block_table}" """.format(features_coalesce=features_coalesce,
-                                                                       schema=self.schema_name,
-                                                                       block_table= table_names_with_date[0]))
-                if len(table_names_with_date) > 1:
-                    table_names_with_date = table_names_with_date[1:]
-                    for table_name in table_names_with_date:
-                        query += (""" FULL OUTER JOIN {schema}."{block_table}" 
-                                          USING (officer_id, as_of_date)""".format(schema=self.schema_name,
-                                                                                    block_table= table_name))
-   
-            # check if in the first loop above a table was added
-            if len(query) == 0:
-                query = (""" SELECT officer_id,
-                                    {features_coalesce}
-                            FROM {schema}."{block_table}" """.format(features_coalesce=features_coalesce,
-                                                                     schema=self.schema_name, 
-                                                                     block_table=table_names_no_date[0]))
-                if len(table_names_no_date) > 1:
-                    table_names_no_date = table_names_no_date[1:]
-                    for table_name in table_names_no_date:
-                        query += (""" FULL OUTER JOIN {schema}."{block_table}" 
-                                           USING (officer_id)""".format(schema=self.schema_name,
-                                                                        block_table= table_name)) 
-            # Filter by date
-            query += """ WHERE as_of_date in ( SELECT as_of_date from as_of_dates) """
-            subquery = """ features as ({query})""".format(query=query)
-
-            return subquery
-        
-    def get_master_labels(self, as_of_dates_to_use):
+    def _join_groups(self, features_in_blocks):
+        """
+        Splits the block tables into groups that can be joined in a single query
+        without going over the postgres limit of entries in a select list
+        """
+        groups = []
+        group = []
+        n_columns = 0
+        for table_name, features in features_in_blocks.items():
+            if not features:
+                continue
+            if group and n_columns + len(features) > MAX_JOIN_COLUMNS:
+                groups.append(group)
+                group = []
+                n_columns = 0
+            group.append((table_name, features))
+            n_columns += len(features)
+        if group:
+            groups.append(group)
+        return groups
+
+    def get_dataset_copied(self, as_of_dates_to_use):
+        """
+        Builds the matrix by copying every block table into a preallocated float32
+        matrix, each table is written in place and released before the next one
+        """
+        features_in_blocks = self.features_in_blocks()
+        labels = self.get_master_labels(as_of_dates_to_use)
+        builder = MatrixBuilder(labels, [column_name(feature) for features in features_in_blocks.values()
+                                         for feature in features])
+
+        for table_name, features in features_in_blocks.items():
+            if not features:
+                continue
+            log.info('Joining table {}!'.format(table_name))
+            table = self._copy_to_frame(self._block_table_query(table_name, features, as_of_dates_to_use))
+            builder.fill_block(table)
+            del table
+
+        complete_df = builder.to_dataframe()
+        log.info('length of data_set: {}'.format(len(complete_df)))
+        log.info('as of dates used: {}'.format(complete_df['as_of_date'].unique()))
+        log.info('number of officers with adverse incident: {}'.format(complete_df['outcome'].sum() ))
+        return complete_df
+
+    def get_query_features(self, block_tables=None):
+        """
+        Returns the query that LEFT JOINs the block tables onto the master_labels table
+        in the database, replacing missing values with zeros. Rows are ordered by
+        officer_id and as_of_date so the result of every group of block tables is aligned.
+        Args:
+            block_tables (list): list of (table_name, features) to join, defaults to all the block tables
+        """
+        if block_tables is None:
+            block_tables = list(self.features_in_blocks().items())
+
+        features_coalesce = []
+        joins = []
+        for i, (table_name, features) in enumerate(block_tables):
+            alias = 'b{}'.format(i)
+            features_coalesce += ['coalesce({alias}."{feature}",0) as {feature}'.format(alias=alias, feature=feature)
+                                  for feature in features]
+
+            # table with no date
+            if 'ND' in table_name:
+                joins.append(""" LEFT JOIN {schema}."{block_table}" {alias}
+                                     ON {alias}.officer_id = m.officer_id """
+                             .format(schema=self.schema_name, block_table=table_name, alias=alias))
+            else:
+                joins.append(""" LEFT JOIN {schema}."{block_table}" {alias}
+                                     ON {alias}.officer_id = m.officer_id
+                                    AND {alias}.as_of_date = m.as_of_date """
+                             .format(schema=self.schema_name, block_table=table_name, alias=alias))
+
+        query = (""" SELECT {features_coalesce}
+                     FROM master_labels m
+                     {joins}
+                     ORDER BY m.officer_id, m.as_of_date """
+                 .format(features_coalesce=", ".join(features_coalesce),
+                         joins=" ".join(joins)))
+        return query
+
+    def get_query_master_labels(self, as_of_dates_to_use):
         '''
-        Returns master list of labels for specific as of dates
+        Returns the query of the master list of labels for specific as of dates
         '''
+        if self.materialize_labels_table:
+            labels_subquery = self.get_query_materialized_labels(as_of_dates_to_use)
+        else:
+            labels_subquery = self.get_query_labels(as_of_dates_to_use)
 
         # We only want to train and test on officers that have been active (any logged activity in events_hub)
         # NOTE: it uses the feature_labels created in query_labels         
-        active_subquery = ( " officers AS (  "
-                         "       SELECT officer_id "
-                         "       FROM staging.officers_hub "
-                         " ), active AS ( "
-                         "       SELECT officer_id, as_of_date "
-                         "       FROM as_of_dates as d "
-                         "       CROSS JOIN officers as off, "
-                         "           LATERAL "
-                         "                (SELECT 1 "
-                         "                 FROM staging.events_hub e "
-                         "                 WHERE off.officer_id = e.officer_id "
-                         "                 AND e.event_datetime + INTERVAL '{window}' > d.as_of_date "
-                         "                 AND e.event_datetime <= d.as_of_date "
-                         "                    LIMIT 1 ) sub_activity, "
-                         "            LATERAL "
-                         "                (SELECT 1 "
-                         "                 FROM staging.officer_roles r "
-                         "                 WHERE off.officer_id = r.officer_id "
-                         "                 AND r.job_start_date <= d.as_of_date "
-                         "                 AND sworn_flag = 1 "
-                         "                 LIMIT 1) sub_sworn )"
-                         .format(window=self.officer_past_activity_window))
+        if self.cohort_intervals:
+            cohort.build_cohort_tables(self.db_engine, [self.officer_past_activity_window], rebuild=False)
+            active_subquery = cohort.get_query_active(self.officer_past_activity_window)
+        else:
+            active_subquery = ( " officers AS (  "
+                             "       SELECT officer_id "
+                             "       FROM staging.officers_hub "
+                             " ), active AS ( "
+                             "       SELECT officer_id, as_of_date "
+                             "       FROM as_of_dates as d "
+                             "       CROSS JOIN officers as off, "
+                             "           LATERAL "
+                             "                (SELECT 1 "
+                             "                 FROM staging.events_hub e "
+                             "                 WHERE off.officer_id = e.officer_id "
+                             "                 AND e.event_datetime + INTERVAL '{window}' > d.as_of_date "
+                             "                 AND e.event_datetime <= d.as_of_date "
+                             "                    LIMIT 1 ) sub_activity, "
+                             "            LATERAL "
+                             "                (SELECT 1 "
+                             "                 FROM staging.officer_roles r "
+                             "                 WHERE off.officer_id = r.officer_id "
+                             "                 AND r.job_start_date <= d.as_of_date "
+                             "                 AND sworn_flag = 1 "
+                             "                 LIMIT 1) sub_sworn )"
+                             .format(window=self.officer_past_activity_window))
 
         query_master_labels = (" {labels_subquery}, "
                                " {active_subquery} "
@@ -359,93 +556,82 @@ class FeatureLoader():
                                " FROM active "
                                " LEFT JOIN labels "
                                " USING (as_of_date, officer_id) "
-                               .format(labels_subquery=self.get_query_labels(as_of_dates_to_use),
+                               .format(labels_subquery=labels_subquery,
                                        active_subquery=active_subquery))
-        
-        db_conn = self.db_engine.raw_connection()
-        cur = db_conn.cursor(name='cursor_for_loading_matrix')
-        cur.execute(query_master_labels)
-        labels = cur.fetchall()
-
-        # Get column names
-        col_names = []
-        for desc in cur.description:
-            col_names.append(desc[0])
+        return query_master_labels
 
-        # To pandas df
-        labels = pd.DataFrame(labels)
-        labels.columns = col_names
-        db_conn.close()
-        return labels
-
-    def get_dataset_old(self, as_of_dates_to_use):
+    def get_master_labels(self, as_of_dates_to_use):
         '''
-        This function returns dataset and labels to use for training / testing
-        It is splitted in two queries:
-            - features_subquery: which joins the features table with labels table
-            - query_active: using the first table created in query_labels, and returns it only
-                            for officers that are have any activity given the officer_past_activity_window
-
+        Returns master list of labels for specific as of dates
         '''
-        labels = self.get_master_labels(as_of_dates_to_use)
-        pdb.set_trace()
-        features_list_string = ", ".join(['{}'.format(feature) for feature in self.features_list()])
-
-        # JOIN FEATURES AND LABELS
-        query_features_labels = (" {labels_subquery}, "
-                                 " {features_subquery}, " 
-                                 " features_labels AS ( "
-                                 "    SELECT officer_id, "
-                                 "           as_of_date, "
-                                 "           {features_list}, "
-                                 "           coalesce(outcome,0) as outcome "
-                                 "    FROM features "
-                                 "    LEFT JOIN labels "
-                                 "    USING (as_of_date, officer_id)) "
-                                 .format(labels_subquery=self.get_query_labels(as_of_dates_to_use),
-                                         features_subquery=self.get_query_features(),
-                                         features_list=features_list_string))
-
-        # We only want to train and test on officers that have been active (any logged activity in events_hub)
-        # NOTE: it uses the feature_labels created in query_labels
-        query_active =  (""" SELECT officer_id, as_of_date, {features}, outcome """
-                        """ FROM features_labels as f, """
-                        """        LATERAL """
-                        """          (SELECT 1 """
-                        """           FROM staging.events_hub e """
-                        """           WHERE f.officer_id = e.officer_id """
-                        """           AND e.event_datetime + INTERVAL '{window}' > f.as_of_date """
-                        """           AND e.event_datetime <= f.as_of_date """
-                        """            LIMIT 1 ) sub; """
-                        .format(features=features_list_string,
-                                window=self.officer_past_activity_window))
-
-        # join both queries together and load data
-        query = (query_features_labels + query_active)
-
-        # Get the data
-        db_conn = self.db_engine.raw_connection()
-        cur = db_conn.cursor(name='cursor_for_loading_matrix')
-        cur.execute(query)
-        matrix = cur.fetchall()
-
-        # Get column names
-        col_names = []
-        for desc in cur.description:
-            col_names.append(desc[0])  
+        query_master_labels = self.get_query_master_labels(as_of_dates_to_use)
+
+        if self.assembly in ('copy', 'join'):
+            return self._copy_to_frame(query_master_labels, int_columns=('officer_id', 'outcome'))
+        return self._fetch_to_frame(query_master_labels)
+
+    def _copy_into(self, cur, query, matrix, first_column):
+        """
+        Streams the result of a query with COPY and writes it in chunks into the
+        columns of matrix starting at first_column, the query returns a row for
+        every row of matrix in the same order
+        Returns:
+            list of the column names of the query
+        """
+        with tempfile.TemporaryFile() as buffer:
+            cur.copy_expert("COPY ({query}) TO STDOUT WITH CSV HEADER".format(query=query), buffer)
+            buffer.seek(0)
 
-        # To pandas df
-        matrix_df = pd.DataFrame(matrix)
-        matrix_df.columns = col_names
-        db_conn.close()
+            col_names = []
+            row = 0
+            for chunk in pd.read_csv(buffer, dtype=np.float32, chunksize=COPY_CHUNK_ROWS):
+                col_names = chunk.columns.tolist()
+                if row + len(chunk) > matrix.shape[0]:
+                    raise ValueError('The features query returned more than the {} rows of the master labels'
+                                     .format(matrix.shape[0]))
+                matrix[row:row + len(chunk), first_column:first_column + len(col_names)] = chunk.values
+                row += len(chunk)
+        if row != matrix.shape[0]:
+            raise ValueError('The features query returned {} rows for the {} rows of the master labels'
+                             .format(row, matrix.shape[0]))
+        return col_names
+
+    def get_dataset_joined(self, as_of_dates_to_use):
+        """
+        Builds the matrix by joining all the block tables onto the master list of labels
+        in the database. The master list is materialized once in a temporary table and
+        every group of block tables comes back through a single COPY, filling the columns
+        of a MatrixBuilder that is allocated once instead of being merged block by block.
+        """
+        groups = self._join_groups(self.features_in_blocks())
 
-        #all_data = pd.read_sql(query, con=db_conn)
+        db_conn = self.db_engine.raw_connection()
+        try:
+            cur = db_conn.cursor()
+            cur.execute("CREATE TEMP TABLE master_labels ON COMMIT DROP AS {query}"
+                        .format(query=self.get_query_master_labels(as_of_dates_to_use)))
+            # the features are copied by position, a key listed twice would shift every row after it
+            cur.execute("ALTER TABLE master_labels ADD PRIMARY KEY (officer_id, as_of_date)")
+            cur.execute("ANALYZE master_labels")
+            keys = self._copy_to_frame_with_cursor(cur, """SELECT officer_id, as_of_date, outcome
+                                                          FROM master_labels
+                                                          ORDER BY officer_id, as_of_date""",
+                                                    int_columns=('officer_id', 'outcome'))
+
+            builder = MatrixBuilder(keys, [column_name(feature) for group in groups
+                                           for _, features in group for feature in features])
+            first_column = 0
+            for group in groups:
+                log.info('Joining tables {}!'.format([table_name for table_name, _ in group]))
+                first_column += len(self._copy_into(cur, self.get_query_features(group), builder.matrix,
+                                                    first_column))
+        finally:
+            db_conn.close()
 
-        ## TODO: remove all zero value columns
-        #all_data = all_data.loc[~(all_data[features_list]==0).all(axis=1)]
+        complete_df = builder.to_dataframe()
 
-        log.info('length of data_set: {}'.format(len(matrix_df)))
-        log.info('as of dates used: {}'.format(matrix_df['as_of_date'].unique()))
-        log.info('number of officers with adverse incident: {}'.format(matrix_df['outcome'].sum() ))
-        return matrix_df
+        log.info('length of data_set: {}'.format(len(complete_df)))
+        log.info('as of dates used: {}'.format(complete_df['as_of_date'].unique()))
+        log.info('number of officers with adverse incident: {}'.format(complete_df['outcome'].sum() ))
+        return complete_df
 
@@ -0,0 +1,154 @@
+"""
+Runs the collate steps of all the feature blocks on one pool of threads.
+
+Every collate table of a block is a job, and the post features of a block are a job that
+depends on the tables of the block. Ready jobs start by longest remaining path first, as long as
+their database connections fit under a global cap, so small blocks run next to the large ones
+instead of after them.
+"""
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .features.officers_collate import FeaturesBlock
+
+log = logging.getLogger(__name__)
+
+Job = collections.namedtuple('Job', ['name', 'run', 'cost', 'connections', 'depends_on'])
+
+
+class FeatureScheduler():
+    def __init__(self, max_connections, workers=1):
+        '''
+        Args:
+            max_connections (int): database connections used by all the jobs running at the same time
+            workers (int): jobs running at the same time
+        '''
+        self.max_connections = max(1, max_connections)
+        self.workers = max(1, workers)
+        self.jobs = collections.OrderedDict()
+
+    def job_connections(self, n_jobs):
+        """
+        Connections of a job that would use n_jobs, its share of the cap when every worker is busy
+        """
+        return max(1, min(n_jobs, self.max_connections // self.workers))
+
+    def add_job(self, name, run, cost=1, connections=1, depends_on=()):
+        """
+        Args:
+            name (str): unique name of the job
+            run (function): called without arguments, its return value is the result of the job
+            cost (float): estimate of the duration of the job, only compared to the other jobs
+            connections (int): database connections the job uses while running
+            depends_on (list): names of the jobs that have to finish before this one starts
+        """
+        for dependency in depends_on:
+            if dependency not in self.jobs:
+                raise ValueError('{} depends on {}, which is not scheduled'.format(name, dependency))
+        self.jobs[name] = Job(name, run, cost, min(connections, self.max_connections), tuple(depends_on))
+        return name
+
+    def priorities(self):
+        """
+        Returns the cost of every job plus the longest chain of jobs that depend on it
+        """
+        dependents = collections.defaultdict(list)
+        for job in self.jobs.values():
+            for dependency in job.depends_on:
+                dependents[dependency].append(job.name)
+
+        priorities = {}
+        # jobs are added after their dependencies, so dependents come later
+        for name in reversed(list(self.jobs)):
+            priorities[name] = self.jobs[name].cost + max([priorities[dependent] for dependent in dependents[name]],
+                                                           default=0)
+        return priorities
+
+    def run(self):
+        """
+        Runs every job, stops starting new jobs after one fails and raises its error once the running ones finish
+        Returns:
+            dict of job name to result
+        """
+        priorities = self.priorities()
+        pending = sorted(self.jobs, key=lambda name: -priorities[name])
+        results = {}
+        running = {}
+        free_connections = self.max_connections
+        error = None
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name in list(pending):
+                        job = self.jobs[name]
+                        if len(running) == self.workers:
+                            break
+                        if job.connections > free_connections or any(d not in results for d in job.depends_on):
+                            continue
+                        log.debug('Starting {}'.format(name))
+                        running[executor.submit(job.run)] = name
+                        free_connections -= job.connections
+                        pending.remove(name)
+                elif not running:
+                    break
+                if not running:
+                    raise RuntimeError('No job can start: {}'.format(pending))
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    free_connections += self.jobs[name].connections
+                    if future.exception() is not None:
+                        log.error('{} failed: {}'.format(name, future.exception()))
+                        error = error or future.exception()
+                    else:
+                        results[name] = future.result()
+                        log.debug('Finished {} after {:.1f} seconds'.format(name, time.time() - start))
+
+        if error is not None:
+            raise error
+        log.info('Ran {} jobs in {:.1f} seconds'.format(len(results), time.time() - start))
+        return results
+
+
+def add_block(scheduler, engine, block, block_name, as_of_dates, feature_list, schema):
+    """
+    Adds the collate tables and the post features of block to scheduler, every job adds its prefix to block.prefix
+    """
+    block.n_jobs = scheduler.job_connections(block.n_jobs)
+    lookbacks = len(block.lookback_durations)
+
+    def step_cost(prefix, features):
+        cost = len(features)
+        if prefix in (block.prefix_space_time_lookback, block.prefix_sub):
+            cost *= lookbacks
+        if prefix != block.prefix_agg:
+            cost *= len(as_of_dates)
+        return cost
+
+    def run_step(prefix, build):
+        build()
+        block.prefix.append(prefix)
+
+    if type(block).build_collate is not FeaturesBlock.build_collate:
+        # blocks with their own build_collate run it as one job
+        steps = [scheduler.add_job('{}.collate'.format(block_name),
+                                   lambda: block.build_collate(engine, as_of_dates, feature_list, schema),
+                                   cost=len(feature_list) * len(as_of_dates),
+                                   connections=block.n_jobs)]
+    else:
+        steps = [scheduler.add_job('{}.{}'.format(block_name, prefix),
+                                   lambda prefix=prefix, build=build: run_step(prefix, build),
+                                   cost=step_cost(prefix, features),
+                                   connections=block.n_jobs)
+                 for prefix, features, build in block.collate_steps(engine, as_of_dates, feature_list, schema)]
+
+    if type(block).build_post_features is not FeaturesBlock.build_post_features:
+        scheduler.add_job('{}.post'.format(block_name),
+                          lambda: block.build_post_features(engine, feature_list, schema),
+                          cost=len(as_of_dates),
+                          depends_on=steps)
@@ -0,0 +1,136 @@
+"""
+Dispatch features computed together in one query, with a column per feature.
+
+The classes of eis/features/dispatches.py that only differ by a time window or a filter are
+grouped, and every group is computed with a single scan of the rows the features share instead
+of one query per feature. The ArrestsInPast windows are counted in numpy from one sorted copy of
+the arrest events.
+"""
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from .. import results_writer
+from ..windowed_counts import windowed_counts
+
+log = logging.getLogger(__name__)
+
+# ArrestsInPast1Hour, FelonyArrestsInPast6Hours, DrugsArrestsInPastWeek, ...
+ARRESTS_IN_PAST = re.compile(r'^(Felony|Drugs|StolenVehicle)?ArrestsInPast(?:(\d+)Hours?|(Week))$')
+ARREST_FLAGS = {'Felony': 'felony_flag',
+                'Drugs': 'drugs_flag',
+                'StolenVehicle': 'stolen_vehicle_flag'}
+
+
+def arrests_in_past_window(feature_name):
+    """
+    Returns (arrest flag or None, window in hours, interval) of an ArrestsInPast feature, None for any other feature
+    """
+    match = ARRESTS_IN_PAST.match(feature_name)
+    if not match:
+        return None
+    arrest_type, hours, week = match.groups()
+    if week:
+        return ARREST_FLAGS.get(arrest_type), 7 * 24, '1 week'
+    return ARREST_FLAGS.get(arrest_type), int(hours), '{} hours'.format(hours)
+
+
+def arrests_in_past_table(db_conn, feature_names, from_date, to_date):
+    """
+    Counts the arrests in the window preceding every dispatch for all the features at once (see
+    eis/windowed_counts.py) into the temporary table arrests_in_past, a column per feature named as
+    the feature class, NULL when there are none as in the query of the feature class. The table is
+    committed so it outlives the transaction, drop_tables removes it once it is joined
+    Returns:
+        query of the table
+    """
+    windows = {feature_name: arrests_in_past_window(feature_name) for feature_name in feature_names}
+    flags = sorted({flag for flag, _, _ in windows.values() if flag})
+    hours = sorted({window_hours for _, window_hours, _ in windows.values()})
+    widest = max(windows.values(), key=lambda window: window[1])[2]
+
+    cur = db_conn.cursor()
+    cur.execute(""" SELECT dispatch_id, earliest_dispatch_datetime
+                    FROM staging.earliest_dispatch_time
+                    WHERE earliest_dispatch_datetime BETWEEN '{from_date}' AND '{to_date}' """
+                .format(from_date=from_date, to_date=to_date))
+    dispatches = pd.DataFrame(cur.fetchall(), columns=['dispatch_id', 'earliest_dispatch_datetime'])
+
+    # events without arrests count once for the arrests of any type and zero for every flag
+    flag_counts = "".join(", COALESCE(arrests.{0}, 0)".format(flag) for flag in flags)
+    arrests_join = ''
+    if flags:
+        arrests_join = (""" LEFT JOIN (SELECT event_id, {counts} FROM staging.arrests GROUP BY event_id) arrests
+                              ON b.event_id = arrests.event_id """
+                        .format(counts=", ".join("count(*) FILTER (WHERE {0} = true) AS {0}".format(flag)
+                                                 for flag in flags)))
+    cur.execute(""" SELECT b.event_datetime {flag_counts}
+                    FROM staging.events_hub b {arrests_join}
+                    WHERE b.event_type_code = 3
+                      AND b.event_datetime BETWEEN timestamp '{from_date}' - interval '{widest}' AND '{to_date}' """
+                .format(flag_counts=flag_counts, arrests_join=arrests_join,
+                        from_date=from_date, to_date=to_date, widest=widest))
+    events = pd.DataFrame(cur.fetchall(), columns=['event_datetime'] + flags)
+
+    event_weights = np.column_stack([np.ones(len(events), dtype=np.int64)] +
+                                    [events[flag].values.astype(np.int64) for flag in flags])
+    counts = windowed_counts(pd.to_datetime(dispatches['earliest_dispatch_datetime']).values,
+                             pd.to_datetime(events['event_datetime']).values,
+                             [np.timedelta64(window_hours, 'h') for window_hours in hours],
+                             event_weights)
+
+    columns = [feature_name.lower() for feature_name in feature_names]
+    df = pd.DataFrame({'dispatch_id': dispatches['dispatch_id'].values})
+    for feature_name, column in zip(feature_names, columns):
+        flag, window_hours, _ = windows[feature_name]
+        df[column] = counts[:, hours.index(window_hours), flags.index(flag) + 1 if flag else 0]
+    # the counts of a dispatch_id listed more than once are added, as the GROUP BY of the feature queries
+    df = df.groupby('dispatch_id', sort=False)[columns].sum()
+    df = df[(df > 0).any(axis=1)]
+
+    cur.execute(""" DROP TABLE IF EXISTS arrests_in_past;
+                    CREATE TEMP TABLE arrests_in_past AS
+                    SELECT dispatch_id, {columns} FROM staging.earliest_dispatch_time LIMIT 0 """
+                .format(columns=", ".join("NULL::bigint AS {}".format(column) for column in columns)))
+    results_writer.copy_rows(db_conn,
+                             'arrests_in_past',
+                             ['dispatch_id'] + columns,
+                             ((dispatch_id,) + tuple(int(count) or None for count in row)
+                              for dispatch_id, row in zip(df.index, df.values)))
+    return "SELECT * FROM arrests_in_past"
+
+
+# (name, function that tells if a feature belongs to the group,
+#  function of (db_conn, features, from_date, to_date) that returns the query of the features of the group,
+#  temporary table written by that function)
+FEATURE_GROUPS = [('ArrestsInPast', arrests_in_past_window, arrests_in_past_table, 'arrests_in_past')]
+
+
+def group_features(feature_list):
+    """
+    Splits feature_list into the features of every group and the features queried by their own class
+    Returns:
+        groups (list): (query function, list of features) of every group with a feature in feature_list
+        ungrouped (list): the other features, in the order of feature_list
+    """
+    groups = []
+    grouped = set()
+    for name, belongs, query, _ in FEATURE_GROUPS:
+        features = [feature for feature in feature_list if belongs(feature)]
+        if features:
+            log.debug('{} features computed in one query: {}'.format(name, features))
+            groups.append((query, features))
+            grouped.update(features)
+    return groups, [feature for feature in feature_list if feature not in grouped]
+
+
+def drop_tables(db_conn):
+    """
+    Drops the temporary tables of every group, the session of a pooled connection outlives its use
+    """
+    db_conn.rollback()
+    cur = db_conn.cursor()
+    cur.execute("".join("DROP TABLE IF EXISTS {};".format(table) for _, _, _, table in FEATURE_GROUPS))
+    db_conn.commit()
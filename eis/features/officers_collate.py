@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import functools
 import logging
 import sys
 from enum import Enum
@@ -21,6 +22,38 @@ class AllegationOutcome(Enum):
     unknown = "final_ruling_code = 0"
 
 
+class LookupCache():
+    def __init__(self):
+        '''
+        Values of the lookup tables and categories of the staging columns used to define the
+        aggregations of the blocks, queried once per table and shared by all the blocks of a run
+        '''
+        self.lookup_tables = {}
+        self.categories = {}
+
+    def lookup_values(self, engine, lookup_table):
+        """
+        Returns the (code, value) rows of staging.lookup_table
+        """
+        if lookup_table not in self.lookup_tables:
+            query = """select code, value from staging.{0}""".format(lookup_table)
+            self.lookup_tables[lookup_table] = [tuple(row) for row in engine.execute(query)]
+        return self.lookup_tables[lookup_table]
+
+    def group_categories(self, engine, column_name, table, schema='staging'):
+        """
+        Returns the distinct values of column_name in schema.table
+        """
+        key = (schema, table, column_name)
+        if key not in self.categories:
+            query = """select {column_name} from {schema}.{table} GROUP BY {column_name} """.format(
+                schema=schema,
+                table=table,
+                column_name=column_name)
+            self.categories[key] = [list(row)[0] for row in engine.execute(query)]
+        return self.categories[key]
+
+
 # Super class for feature generation
 class FeaturesBlock():
     def __init__(self, **kwargs):
@@ -38,10 +71,12 @@ class FeaturesBlock():
         self.join_table = None
         self.from_obj_sub = ""
         self.n_jobs = kwargs['n_cpus']
+        # lookup values shared by the blocks of a run, and the aggregations of this block
+        self.lookup_cache = kwargs.get('lookup_cache') or LookupCache()
+        self._aggregations = {}
 
     def _lookup_values_conditions(self, engine, column_code_name, lookup_table, fix_condition='', prefix=''):
-        query = """select code, value from staging.{0}""".format(lookup_table)
-        lookup_values = engine.connect().execute(query)
+        lookup_values = self.lookup_cache.lookup_values(engine, lookup_table)
         dict_temp = {}
         for code, value in lookup_values:
             if fix_condition:
@@ -54,8 +89,7 @@ class FeaturesBlock():
 
     def _lookup_values_conditions_multiplier(self, engine, column_code_name, lookup_table, multiplier='',
                                              fix_condition='', prefix=''):
-        query = """select code, value from staging.{0}""".format(lookup_table)
-        lookup_values = engine.connect().execute(query)
+        lookup_values = self.lookup_cache.lookup_values(engine, lookup_table)
         dict_temp = {}
         for code, value in lookup_values:
             if fix_condition:
@@ -68,15 +102,9 @@ class FeaturesBlock():
         return dict_temp
 
     def _group_category_conditions_str(self, engine, column_name, table, fix_condition='', prefix='', schema='staging'):
-        query = """select {column_name} from {schema}.{table} GROUP BY {column_name} """.format(
-            schema=schema,
-            table=table,
-            column_name=column_name)
-        group_categories = engine.connect().execute(query)
+        group_categories = self.lookup_cache.group_categories(engine, column_name, table, schema=schema)
         dict_temp = {}
-        for row in group_categories:
-            value = list(row)[0]
-
+        for value in group_categories:
             name = value.strip().replace(' ', '_').replace('-', '_').lower()
             if fix_condition:
                 dict_temp[prefix + '_' + name] = "({0} = '{1}' AND {2})::int".format(column_name,
@@ -97,6 +125,15 @@ class FeaturesBlock():
                 sys.exit(1)
         return feature_aggregations_to_use
 
+    def _aggregations_of(self, engine, feature_aggregations):
+        """
+        Returns the aggregations of the method feature_aggregations, built once per block
+        """
+        name = feature_aggregations.__name__
+        if name not in self._aggregations:
+            self._aggregations[name] = feature_aggregations(engine)
+        return self._aggregations[name]
+
     def _feature_aggregations(self, engine):
         return {}
 
@@ -117,9 +154,8 @@ class FeaturesBlock():
 
     # time based aggregation with time intervals
     def build_space_time_aggregation_lookback(self, engine, as_of_dates, feature_list, schema):
-        feature_aggregations_list = self.feature_aggregations_to_use(feature_list,
-                                                                     self._feature_aggregations_space_time_lookback(
-                                                                         engine))
+        feature_aggregations = self._aggregations_of(engine, self._feature_aggregations_space_time_lookback)
+        feature_aggregations_list = self.feature_aggregations_to_use(feature_list, feature_aggregations)
         st = collate.SpacetimeAggregation(feature_aggregations_list,
                                           from_obj=self.from_obj,
                                           groups={'id': self.unit_id},
@@ -134,9 +170,8 @@ class FeaturesBlock():
 
     # time based aggregation without time intervals
     def build_space_time_aggregation(self, engine, as_of_dates, feature_list, schema):
-        feature_aggregations_list = self.feature_aggregations_to_use(feature_list,
-                                                                     self._feature_aggregations_space_time(
-                                                                         engine))
+        feature_aggregations = self._aggregations_of(engine, self._feature_aggregations_space_time)
+        feature_aggregations_list = self.feature_aggregations_to_use(feature_list, feature_aggregations)
         st = collate.SpacetimeAggregation(feature_aggregations_list,
                                           from_obj=self.from_obj,
                                           groups={'id': self.unit_id},
@@ -150,8 +185,8 @@ class FeaturesBlock():
 
     # time based aggregation with time intervals and a sub query
     def build_space_time_sub_query_aggregation(self, engine, as_of_dates, feature_list, schema):
-        feature_aggregations_list = self.feature_aggregations_to_use(feature_list,
-                                                                     self._feature_aggregations_sub(engine))
+        feature_aggregations = self._aggregations_of(engine, self._feature_aggregations_sub)
+        feature_aggregations_list = self.feature_aggregations_to_use(feature_list, feature_aggregations)
         st = collate.SpacetimeSubQueryAggregation(feature_aggregations_list,
                                                   from_obj=self.from_obj_sub,
                                                   groups={'id': self.unit_id},
@@ -168,7 +203,8 @@ class FeaturesBlock():
 
     # time based aggregation with time intervals and a sub query
     def build_aggregation(self, engine, feature_list, schema):
-        feature_aggregations_list = self.feature_aggregations_to_use(feature_list, self._feature_aggregations(engine))
+        feature_aggregations = self._aggregations_of(engine, self._feature_aggregations)
+        feature_aggregations_list = self.feature_aggregations_to_use(feature_list, feature_aggregations)
         st = collate.Aggregation(feature_aggregations_list,
                                  from_obj=self.from_obj,
                                  groups={'id': self.unit_id},
@@ -176,37 +212,52 @@ class FeaturesBlock():
                                  schema=schema)
         st.execute_par(setup_environment.get_database, self.n_jobs)
 
-    def build_collate(self, engine, as_of_dates, feature_list, schema):
+    def collate_steps(self, engine, as_of_dates, feature_list, schema):
+        """
+        Returns (prefix, features, build function) of every collate table with a feature of feature_list,
+        the functions are independent of each other
+        """
+        steps = []
         # check if a space-time feature was selected with lookback
-        list_space_time_lookback = [x for x in feature_list if
-                                    x in set(self._feature_aggregations_space_time_lookback(engine).keys())]
+        space_time_lookback = self._aggregations_of(engine, self._feature_aggregations_space_time_lookback)
+        list_space_time_lookback = [x for x in feature_list if x in space_time_lookback]
         if list_space_time_lookback:
-            self.build_space_time_aggregation_lookback(engine, as_of_dates, list_space_time_lookback, schema)
-            self.prefix.append(self.prefix_space_time_lookback)
+            steps.append((self.prefix_space_time_lookback, list_space_time_lookback,
+                          functools.partial(self.build_space_time_aggregation_lookback,
+                                            engine, as_of_dates, list_space_time_lookback, schema)))
 
         # check if a sub-query feature was selected
-        list_space_time_sub = [x for x in feature_list if
-                               x in set(self._feature_aggregations_sub(engine).keys())]
+        space_time_sub = self._aggregations_of(engine, self._feature_aggregations_sub)
+        list_space_time_sub = [x for x in feature_list if x in space_time_sub]
         if list_space_time_sub:
-            self.build_space_time_sub_query_aggregation(engine, as_of_dates, list_space_time_sub, schema)
-            self.prefix.append(self.prefix_sub)
+            steps.append((self.prefix_sub, list_space_time_sub,
+                          functools.partial(self.build_space_time_sub_query_aggregation,
+                                            engine, as_of_dates, list_space_time_sub, schema)))
 
         # check if an  aggregate feature was selected
-        list_agg = [x for x in feature_list if x in set(self._feature_aggregations(engine).keys())]
+        aggregations = self._aggregations_of(engine, self._feature_aggregations)
+        list_agg = [x for x in feature_list if x in aggregations]
         if list_agg:
-            self.build_aggregation(engine, list_agg, schema)
-            self.prefix.append(self.prefix_agg)
+            steps.append((self.prefix_agg, list_agg,
+                          functools.partial(self.build_aggregation, engine, list_agg, schema)))
 
         # check if a space-time feature was selected
-        list_space_time = [x for x in feature_list if
-                           x in set(self._feature_aggregations_space_time(engine).keys())]
+        space_time = self._aggregations_of(engine, self._feature_aggregations_space_time)
+        list_space_time = [x for x in feature_list if x in space_time]
         if list_space_time:
-            self.build_space_time_aggregation(engine, as_of_dates, list_space_time, schema)
-            self.prefix.append(self.prefix_space_time)
+            steps.append((self.prefix_space_time, list_space_time,
+                          functools.partial(self.build_space_time_aggregation,
+                                            engine, as_of_dates, list_space_time, schema)))
 
-        if not self.prefix:
+        if not steps:
             log.info("WARNING: no feature aggregation for features: {}".format(feature_list))
             sys.exit(1)
+        return steps
+
+    def build_collate(self, engine, as_of_dates, feature_list, schema):
+        for prefix, _, build in self.collate_steps(engine, as_of_dates, feature_list, schema):
+            build()
+            self.prefix.append(prefix)
 
 
 # --------------------------
@@ -657,10 +708,12 @@ class Dispatches(FeaturesBlock):
                                                               '{feature}')""".format(schema=schema,
                                                                                      prefix=self.prefix_space_time_lookback,
                                                                                      feature=feature))
-            cur = db_conn.cursor()
-            cur.execute(window_columns_query)
-            columns_by_windows = cur.fetchall()
-            db_conn.close()
+            try:
+                cur = db_conn.cursor()
+                cur.execute(window_columns_query)
+                columns_by_windows = cur.fetchall()
+            finally:
+                db_conn.close()
 
             # calculate dispatch movement rate (sum_all - greatest) / greatest for every time window
             rates = {}
@@ -691,11 +744,13 @@ class Dispatches(FeaturesBlock):
                                                                                               rates.items()])))
             self.prefix.append(self.prefix_post)
             db_conn = engine.raw_connection()
-            cur = db_conn.cursor()
-            cur.execute(drop_query)
-            cur.execute(query_create_rates)
-            db_conn.commit()
-            db_conn.close()
+            try:
+                cur = db_conn.cursor()
+                cur.execute(drop_query)
+                cur.execute(query_create_rates)
+                db_conn.commit()
+            finally:
+                db_conn.close()
             log.debug('Build post {schema}.{prefix}_aggregation  features table'.format(schema=schema,
                                                                                         prefix=self.prefix_post))
 
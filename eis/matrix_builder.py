@@ -0,0 +1,111 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+
+def column_name(feature):
+    """
+    Name of a feature in the matrix. The block table queries alias the
+    coalesced features without quotes, so postgres folds them to lower case
+    """
+    return feature.lower()
+
+
+def align_features(df, feature_names):
+    """
+    Returns the matrix with its features in the order of feature_names, e.g. the feature_names of
+    its metadata. Matrices stored by an older version may have another column order than the ones
+    built now, and the models use the columns by position
+    Args:
+        df (DataFrame): matrix with the index columns first and the label (outcome) last
+        feature_names (list): features of the matrix
+    """
+    features = [column_name(feature) for feature in feature_names]
+    feature_set = set(features)
+    columns = [col for col in df.columns if col not in feature_set and col != 'outcome'] + features + ['outcome']
+    if df.columns.tolist() == columns:
+        return df
+    log.debug('Reordering the columns of the matrix to its metadata')
+    return df[columns]
+
+
+class MatrixBuilder():
+    def __init__(self, labels, feature_names):
+        '''
+        Preallocates the float32 matrix for the master list of labels, the
+        shape is known up front so each block table is written in place
+        instead of merging a growing DataFrame
+        Args:
+            labels (DataFrame): master list of labels with officer_id, as_of_date and outcome
+            feature_names (list): names of the feature columns of the matrix, in order
+        '''
+        self.labels = labels.reset_index(drop=True)
+        self.feature_names = list(feature_names)
+        self.column_index = {name: i for i, name in enumerate(self.feature_names)}
+
+        # (officer_id, as_of_date) -> row index map
+        self.row_index = pd.MultiIndex.from_arrays([self.labels['officer_id'].values,
+                                                    self.labels['as_of_date'].values],
+                                                   names=['officer_id', 'as_of_date'])
+        self.officer_index = pd.Index(self.labels['officer_id'].values)
+
+        # zero imputation: every officer missing in a block table keeps 0
+        self.matrix = np.zeros((len(self.labels), len(self.feature_names)), dtype=np.float32)
+        log.debug('Allocated matrix of shape {}, memory consumption: {}'.format(self.matrix.shape,
+                                                                                self.matrix.nbytes))
+
+    def _columns(self, names):
+        """
+        Returns a slice if the columns are contiguous in the matrix, else the list of positions
+        """
+        positions = [self.column_index[name] for name in names]
+        if positions == list(range(positions[0], positions[0] + len(positions))):
+            return slice(positions[0], positions[0] + len(positions))
+        return positions
+
+    def fill_block(self, table):
+        """
+        Writes the features of a block table into the matrix
+        Args:
+            table (DataFrame): officer_id, as_of_date (if the table has a date) and the features of the block
+        """
+        feature_columns = [col for col in table.columns if col not in ('officer_id', 'as_of_date')]
+        if not feature_columns or table.empty:
+            return None
+        columns = self._columns(feature_columns)
+        values = table[feature_columns].values
+
+        if 'as_of_date' in table.columns:
+            # row of the matrix for every row of the block table
+            rows = self.row_index.get_indexer(pd.MultiIndex.from_arrays([table['officer_id'].values,
+                                                                         table['as_of_date'].values]))
+            found = rows >= 0
+            target_rows = rows[found]
+            values = values[found]
+        else:
+            # tables without date hold one row per officer, used for every as_of_date
+            block_rows = pd.Index(table['officer_id'].values).get_indexer(self.officer_index)
+            found = block_rows >= 0
+            target_rows = np.flatnonzero(found)
+            values = values[block_rows[found]]
+
+        if isinstance(columns, slice):
+            self.matrix[target_rows, columns] = values
+        else:
+            self.matrix[np.ix_(target_rows, columns)] = values
+        return None
+
+    def to_dataframe(self):
+        """
+        Returns the matrix as a DataFrame indexed by officer_id with as_of_date as first column
+        and the label (outcome) as last column, wrapping the float32 array without copying it
+        """
+        df = pd.DataFrame(self.matrix, columns=self.feature_names, index=self.labels['officer_id'].values,
+                          copy=False)
+        df.index.name = 'officer_id'
+        df.insert(0, 'as_of_date', self.labels['as_of_date'].values)
+        df['outcome'] = self.labels['outcome'].values
+        return df
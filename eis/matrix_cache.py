@@ -0,0 +1,297 @@
+"""
+Content addressed cache of the train/test matrices stored in project_path/matrices.
+
+Matrices are keyed by the metta uuid of their metadata. A sqlite manifest in the
+matrices directory records the format, size, build time, last access and number of
+hits of every matrix so the directory can be capped in size by evicting the least
+recently used matrices.
+
+Concurrent workers coordinate with a flock per uuid: a worker building a matrix holds
+it exclusively, workers that want the same matrix block on it until the build is done
+and then read the stored matrix instead of building it again.
+
+A matrix whose columns are a subset of another matrix with the same rows (e.g. a leave-one-out
+block set of the matrix of all the blocks) can be stored as a projection: only its metadata
+and the uuid of its parent are recorded, and it is read by dropping columns of the parent.
+"""
+import argparse
+import fcntl
+import glob
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import metta.metta_io
+import yaml
+from . import npy_matrix
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.sqlite'
+# file extension of the data file of every format, 'hd5' and 'csv' are written by metta
+MATRIX_FORMATS = {'hd5': '.h5', 'csv': '.csv', 'npy': npy_matrix.FEATURES_SUFFIX}
+# format of the manifest entries of the projections, which have no data file
+PROJECTION_FORMAT = 'projection'
+
+
+class MatrixCache():
+    def __init__(self, directory, matrix_format='hd5', max_size_gb=None):
+        '''
+        Args:
+            directory (str): directory where the matrices and the manifest are stored
+            matrix_format (str): format of the new matrices, one of MATRIX_FORMATS
+            max_size_gb (float): size cap of the directory, the least recently used matrices
+                                 are evicted after a build when it is exceeded. None disables eviction
+        '''
+        if matrix_format not in MATRIX_FORMATS:
+            raise ValueError('Unknown matrix format {}, expected one of {}'.format(matrix_format,
+                                                                                 sorted(MATRIX_FORMATS)))
+        self.directory = directory
+        self.matrix_format = matrix_format
+        self.max_size_bytes = int(max_size_gb * 1024 ** 3) if max_size_gb else None
+        self.manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+
+        # counters of this process, the manifest keeps the totals of every entry
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._manifest() as manifest:
+            manifest.execute(""" CREATE TABLE IF NOT EXISTS matrices (
+                                     uuid            TEXT PRIMARY KEY,
+                                     format          TEXT,
+                                     size_bytes      INTEGER,
+                                     build_seconds   REAL,
+                                     created_at      REAL,
+                                     last_access     REAL,
+                                     hits            INTEGER DEFAULT 0) """)
+            manifest.execute(""" CREATE TABLE IF NOT EXISTS projections (
+                                     uuid            TEXT PRIMARY KEY,
+                                     parent          TEXT) """)
+
+    @contextmanager
+    def _manifest(self):
+        # every worker writes to the manifest, wait for the other writers instead of failing
+        manifest = sqlite3.connect(self.manifest_path, timeout=300)
+        try:
+            with manifest:
+                yield manifest
+        finally:
+            manifest.close()
+
+    @contextmanager
+    def _lock(self, uuid, exclusive):
+        with open(os.path.join(self.directory, uuid + '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _files(self, uuid):
+        return [filename for filename in glob.glob(os.path.join(self.directory, uuid + '.*'))
+                if not filename.endswith('.lock')]
+
+    def _entry(self, uuid):
+        with self._manifest() as manifest:
+            return manifest.execute("SELECT format FROM matrices WHERE uuid = ?", (uuid,)).fetchone()
+
+    def _stored_format(self, uuid):
+        """
+        Returns the format of a stored matrix or None if it is not stored. Matrices written
+        before the manifest existed are added to it the first time they are found
+        """
+        entry = self._entry(uuid)
+        if entry:
+            return entry[0]
+
+        for matrix_format, extension in MATRIX_FORMATS.items():
+            filename = os.path.join(self.directory, uuid + extension)
+            if os.path.isfile(filename):
+                log.debug('Adding matrix {} stored without manifest entry'.format(uuid))
+                self._record(uuid, matrix_format, build_seconds=None)
+                return matrix_format
+        return None
+
+    def _record(self, uuid, matrix_format, build_seconds, parent=None):
+        size_bytes = sum(os.path.getsize(filename) for filename in self._files(uuid))
+        now = time.time()
+        with self._manifest() as manifest:
+            manifest.execute(""" INSERT OR REPLACE INTO matrices
+                                     (uuid, format, size_bytes, build_seconds, created_at, last_access, hits)
+                                 VALUES (?, ?, ?, ?, ?, ?, 0) """,
+                             (uuid, matrix_format, size_bytes, build_seconds, now, now))
+            manifest.execute("DELETE FROM projections WHERE uuid = ?", (uuid,))
+            if parent:
+                manifest.execute("INSERT INTO projections (uuid, parent) VALUES (?, ?)", (uuid, parent))
+
+    def _parent(self, uuid):
+        with self._manifest() as manifest:
+            row = manifest.execute("SELECT parent FROM projections WHERE uuid = ?", (uuid,)).fetchone()
+        return row[0] if row else None
+
+    def _touch(self, uuid):
+        with self._manifest() as manifest:
+            manifest.execute("UPDATE matrices SET last_access = ?, hits = hits + 1 WHERE uuid = ?",
+                             (time.time(), uuid))
+
+    def _remove(self, uuid):
+        npy_matrix.close_matrix(uuid)
+        for filename in self._files(uuid):
+            os.remove(filename)
+        with self._manifest() as manifest:
+            manifest.execute("DELETE FROM matrices WHERE uuid = ?", (uuid,))
+            manifest.execute("DELETE FROM projections WHERE uuid = ?", (uuid,))
+
+    def _read(self, uuid, metadata, matrix_format):
+        if matrix_format == 'npy':
+            return npy_matrix.read_matrix(self.directory, uuid)
+        return metta.metta_io.recover_matrix(metadata, self.directory)
+
+    def _write(self, uuid, metadata, df):
+        if self.matrix_format == 'npy':
+            return npy_matrix.write_matrix(self.directory, uuid, metadata, df)
+        metta.metta_io.archive_matrix(matrix_config=metadata,
+                                      df_matrix=df,
+                                      directory=self.directory,
+                                      format=self.matrix_format)
+
+    def get_or_build(self, uuid, metadata, build_matrix, return_matrix=True):
+        """
+        Returns the stored matrix of uuid, or builds and stores it when it is not stored
+        Args:
+            uuid (str): metta uuid of the metadata
+            metadata (dict): metadata of the matrix
+            build_matrix (function): returns the matrix DataFrame when it is not stored
+            return_matrix (bool): if False the stored matrix is not read and None is returned
+        Returns:
+            matrix: DataFrame with the features and the last column as the label
+        """
+        # a projection has no data of its own, here it is replaced by the whole matrix
+        with self._lock(uuid, exclusive=False):
+            matrix_format = self._stored_format(uuid)
+            if matrix_format and matrix_format != PROJECTION_FORMAT:
+                return self._hit(uuid, metadata, matrix_format, return_matrix)
+
+        # build holding the lock exclusively, workers asking for the same matrix wait here
+        with self._lock(uuid, exclusive=True):
+            matrix_format = self._stored_format(uuid)
+            if matrix_format and matrix_format != PROJECTION_FORMAT:
+                return self._hit(uuid, metadata, matrix_format, return_matrix)
+
+            self.misses += 1
+            start = time.time()
+            df = build_matrix()
+            log.debug('Start storing matrix {}, memory consumption: {}'.format(uuid,
+                                                                              df.memory_usage(index=True).sum()))
+            self._write(uuid, metadata, df)
+            build_seconds = time.time() - start
+            self._record(uuid, self.matrix_format, build_seconds)
+            log.debug('Done storing matrix {} in {:.1f} seconds'.format(uuid, build_seconds))
+
+        self.evict(keep=uuid)
+        return df if return_matrix else None
+
+    def get_or_project(self, uuid, metadata, parent_uuid, parent_metadata, build_parent, drop_columns,
+                       return_matrix=True):
+        """
+        Returns the matrix of uuid as the matrix of parent_uuid without drop_columns. Only the parent
+        is stored, built with build_parent when it is not, and uuid is recorded as a projection of it
+        Args:
+            uuid (str): metta uuid of the metadata
+            metadata (dict): metadata of the matrix
+            parent_uuid (str): metta uuid of parent_metadata
+            parent_metadata (dict): metadata of a matrix with the same rows and a superset of the columns
+            build_parent (function): returns the parent matrix DataFrame when it is not stored
+            drop_columns (list): columns of the parent that are not in the matrix
+            return_matrix (bool): if False the parent is not read and None is returned
+        Returns:
+            matrix: DataFrame with the features and the last column as the label
+        """
+        parent_df = self.get_or_build(parent_uuid, parent_metadata, build_parent, return_matrix=return_matrix)
+
+        with self._lock(uuid, exclusive=True):
+            if self._entry(uuid) and self._parent(uuid) == parent_uuid:
+                self._touch(uuid)
+            else:
+                with open(os.path.join(self.directory, uuid + '.yaml'), 'w') as f:
+                    yaml.dump(metadata, f)
+                self._record(uuid, PROJECTION_FORMAT, build_seconds=0, parent=parent_uuid)
+                log.debug('Recorded matrix {} as a projection of {}'.format(uuid, parent_uuid))
+
+        if return_matrix:
+            return parent_df.drop(drop_columns, axis=1)
+        return None
+
+    def _hit(self, uuid, metadata, matrix_format, return_matrix):
+        log.debug('Matrix {} already stored'.format(uuid))
+        self.hits += 1
+        self._touch(uuid)
+        if return_matrix:
+            return self._read(uuid, metadata, matrix_format)
+        return None
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used matrices until the directory is below max_size_bytes.
+        Matrices being read or built by another worker are skipped
+        Args:
+            keep (str): uuid that is never evicted, e.g. the matrix that was just built
+        """
+        if not self.max_size_bytes:
+            return None
+
+        with self._manifest() as manifest:
+            entries = manifest.execute("SELECT uuid, size_bytes FROM matrices ORDER BY last_access").fetchall()
+        total_bytes = sum(size_bytes for _, size_bytes in entries)
+
+        for uuid, size_bytes in entries:
+            if total_bytes <= self.max_size_bytes:
+                break
+            if uuid == keep:
+                continue
+            with open(os.path.join(self.directory, uuid + '.lock'), 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                try:
+                    self._remove(uuid)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            total_bytes -= size_bytes
+            self.evictions += 1
+            log.info('Evicted matrix {} ({} bytes)'.format(uuid, size_bytes))
+        return None
+
+    def stats(self):
+        """
+        Returns the hit/miss counters of this process and the totals of the manifest
+        """
+        with self._manifest() as manifest:
+            entries, size_bytes, hits, build_seconds = manifest.execute(
+                "SELECT count(*), sum(size_bytes), sum(hits), sum(build_seconds) FROM matrices").fetchone()
+        requests = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else None,
+                'evictions': self.evictions,
+                'entries': entries,
+                'size_bytes': size_bytes or 0,
+                'total_hits': hits or 0,
+                'total_build_seconds': build_seconds or 0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report on or evict the matrix cache')
+    parser.add_argument("directory", type=str, help="matrices directory, e.g. project_path/matrices")
+    parser.add_argument("--max_size_gb", type=float, help="evict least recently used matrices down to this size")
+    args = parser.parse_args()
+
+    cache = MatrixCache(args.directory, max_size_gb=args.max_size_gb)
+    cache.evict()
+    for key, value in sorted(cache.stats().items()):
+        print('{:<20} {}'.format(key, value))
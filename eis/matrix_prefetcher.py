@@ -0,0 +1,93 @@
+"""
+Loads the next test matrices in a background thread while the current one is scored.
+
+Loading a matrix mostly waits on the database or on the disk, which releases the GIL, so a
+thread overlaps it with the predictions and evaluations of the models. At most depth matrices
+are loaded ahead of the one being scored, and none while the matrices waiting already take
+max_bytes of memory.
+"""
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+
+def matrix_bytes(value):
+    """
+    Returns the memory used by the DataFrames of a loaded value, e.g. (metadata, matrix, uuid)
+    """
+    values = value if isinstance(value, tuple) else (value,)
+    return sum(int(df.memory_usage(index=True).sum()) for df in values if isinstance(df, pd.DataFrame))
+
+
+class MatrixPrefetcher():
+    def __init__(self, load, keys, depth=1, max_size_gb=None, size=matrix_bytes):
+        '''
+        Args:
+            load (function): returns the matrix of a key, e.g. RunModels._load_test_matrix of a test date
+            keys (list): keys of the matrices, in the order they are used
+            depth (int): matrices loaded ahead of the one in use, 0 loads every matrix when it is needed
+            max_size_gb (float): no matrix is loaded ahead while the matrices loaded and not used yet
+                                 take this memory. None for no limit
+            size (function): returns the bytes of a loaded matrix
+        '''
+        self.load = load
+        self.keys = list(keys)
+        self.depth = max(0, depth)
+        self.max_bytes = int(max_size_gb * 1024 ** 3) if max_size_gb else None
+        self.size = size
+        # time spent loading the matrices, and the part of it the consumer waited for
+        self.load_seconds = 0
+        self.wait_seconds = 0
+
+    def _timed_load(self, key):
+        start = time.time()
+        value = self.load(key)
+        return value, self.size(value), time.time() - start
+
+    def _room(self, loading, last_bytes):
+        if self.max_bytes is None:
+            return True
+        # the size of the matrices still loading is estimated with the last matrix loaded
+        queued_bytes = sum(future.result()[1] if future.done() and not future.exception() else last_bytes
+                           for _, future in loading)
+        return queued_bytes + last_bytes <= self.max_bytes
+
+    def __iter__(self):
+        """
+        Yields (key, matrix) in the order of keys
+        """
+        if self.depth == 0:
+            for key in self.keys:
+                start = time.time()
+                value = self.load(key)
+                self.load_seconds += time.time() - start
+                self.wait_seconds += time.time() - start
+                yield key, value
+            return
+
+        pending = collections.deque(self.keys)
+        loading = collections.deque()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while pending or loading:
+                if not loading:
+                    key = pending.popleft()
+                    loading.append((key, executor.submit(self._timed_load, key)))
+                key, future = loading.popleft()
+                start = time.time()
+                value, last_bytes, seconds = future.result()
+                self.wait_seconds += time.time() - start
+                self.load_seconds += seconds
+
+                # the next matrices load while this one is used
+                while pending and len(loading) < self.depth and self._room(loading, last_bytes):
+                    next_key = pending.popleft()
+                    loading.append((next_key, executor.submit(self._timed_load, next_key)))
+                yield key, value
+
+        log.debug('Prefetched {} matrices: {:.1f} seconds loading, {:.1f} seconds waited'
+                  .format(len(self.keys), self.load_seconds, self.wait_seconds))
@@ -0,0 +1,74 @@
+"""
+Canonical form of the matrix metadata hashed by metta into the matrix uuids.
+
+The canonical form must never change: the uuids name the matrices already stored in
+project_path/matrices. sort_multiple_types therefore reproduces the original selection
+sort of RunModels, using sorted() only where both give the same order.
+"""
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def _selection_sort(list_to_sort):
+    # original ordering, compares tuples and dicts by their smallest element
+    for i in range(0, len(list_to_sort)):
+        min = i
+        for j in range(i + 1, len(list_to_sort)):
+            if isinstance(list_to_sort[j], (tuple, dict)):
+                if sorted(list_to_sort[j])[0] < list_to_sort[min]:
+                    min = j
+            elif isinstance(list_to_sort[min], (tuple, dict)):
+                if list_to_sort[j] < sorted(list_to_sort[min])[0]:
+                    min = j
+            else:
+                if list_to_sort[j] < list_to_sort[min]:
+                    min = j
+        list_to_sort[i], list_to_sort[min] = list_to_sort[min], list_to_sort[i]
+
+    return list_to_sort
+
+
+def sort_multiple_types(list_to_sort):
+    """
+    Sorts a list in place as the original selection sort does
+    Args:
+        list_to_sort (list): elements made hashable by make_hashable
+    Returns:
+        the sorted list
+    """
+    # Strings that compare equal are identical, so for lists of strings (feature names,
+    # as of dates, blocks) any correct sort gives the order of the selection sort
+    if all(isinstance(e, str) for e in list_to_sort):
+        list_to_sort.sort()
+        return list_to_sort
+    return _selection_sort(list_to_sort)
+
+
+def make_hashable(o):
+    """
+    Returns the canonical form of o: numbers and strings in lists as strings,
+    lists sorted and dictionaries with sorted keys
+    """
+    if isinstance(o, (tuple, list)):
+        l = []
+        for e in o:
+
+            if isinstance(e, (str, int)):
+                l.append(str(e))
+
+            elif isinstance(e, (dict)):
+                l.append(make_hashable(e))
+
+            else:
+                l.append(e)
+
+        return sort_multiple_types(l)
+
+    if isinstance(o, dict):
+        return {k: make_hashable(o[k]) for k in sorted(o)}
+
+    if isinstance(o, (set, frozenset)):
+        return list(sorted(make_hashable(e) for e in o))
+
+    return o
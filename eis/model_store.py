@@ -0,0 +1,125 @@
+"""
+Trained models stored on disk, keyed by the triage model hash.
+
+Every model is a joblib file in project_path/trained_models, so a model trained by one run is
+found by the next one with the same train matrix, model class and parameters: the trainer skips
+training it when replace=False, e.g. when production scores a new day with a model group
+already trained. A model is read from disk the first time it is used and kept in memory until
+the Predictor deletes it, which only drops the loaded copy. The directory is capped in size by
+removing the models used least recently.
+"""
+import glob
+import logging
+import os
+import time
+
+import joblib
+from triage.storage import ModelStorageEngine, Store, InMemoryModelStorageEngine
+
+log = logging.getLogger(__name__)
+
+MODELS_DIRECTORY = 'trained_models'
+MODEL_SUFFIX = '.joblib'
+
+
+class ModelArtifact(Store):
+    def __init__(self, engine, model_hash):
+        super(ModelArtifact, self).__init__(engine.path(model_hash))
+        self.engine = engine
+        self.model_hash = model_hash
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def write(self, obj):
+        # written under a temporary name so another worker never loads a partial file
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        joblib.dump(obj, tmp_path, compress=self.engine.compress)
+        os.rename(tmp_path, self.path)
+        self.engine.loaded[self.model_hash] = obj
+        self.engine.evict(keep=self.model_hash)
+
+    def load(self):
+        if self.model_hash not in self.engine.loaded:
+            start = time.time()
+            # uncompressed models map their arrays instead of reading them
+            self.engine.loaded[self.model_hash] = joblib.load(self.path,
+                                                              mmap_mode=None if self.engine.compress else 'r')
+            log.debug('Loaded model {} in {:.1f} seconds'.format(self.model_hash, time.time() - start))
+        # the access time orders the eviction
+        os.utime(self.path, None)
+        return self.engine.loaded[self.model_hash]
+
+    def delete(self):
+        # the Predictor deletes a model once it is scored, the file is kept for the next runs
+        self.engine.loaded.pop(self.model_hash, None)
+
+
+class ModelStore(ModelStorageEngine):
+    def __init__(self, project_path, max_size_gb=None, compress=3):
+        '''
+        Args:
+            project_path (str): the models are stored in project_path/trained_models
+            max_size_gb (float): size cap of the directory, the least recently used models are removed
+                                 after a model is written when it is exceeded. None keeps every model
+            compress (int): joblib compression level, 0 stores the arrays uncompressed and maps them when loaded
+        '''
+        super(ModelStore, self).__init__(project_path)
+        self.directory = os.path.join(project_path, MODELS_DIRECTORY)
+        self.max_size_bytes = int(max_size_gb * 1024 ** 3) if max_size_gb else None
+        self.compress = compress
+        # model hash -> model loaded or trained by this process
+        self.loaded = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, model_hash):
+        return os.path.join(self.directory, model_hash + MODEL_SUFFIX)
+
+    def get_store(self, model_hash):
+        return ModelArtifact(self, model_hash)
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used models until the directory is below max_size_bytes,
+        the models loaded by this process are kept
+        Args:
+            keep (str): model hash that is never removed, e.g. the model that was just written
+        """
+        if not self.max_size_bytes:
+            return None
+
+        entries = []
+        for filename in glob.glob(os.path.join(self.directory, '*' + MODEL_SUFFIX)):
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                # removed by another worker
+                continue
+            entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, filename))
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, filename in sorted(entries):
+            if total_bytes <= self.max_size_bytes:
+                break
+            model_hash = os.path.basename(filename)[:-len(MODEL_SUFFIX)]
+            if model_hash == keep or model_hash in self.loaded:
+                continue
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            log.info('Evicted model {} ({} bytes)'.format(model_hash, size))
+        return None
+
+
+def storage_engine(project_path, options):
+    """
+    Returns the ModelStore configured by options (model_store of the config file),
+    the in memory storage of triage when it is not enabled
+    """
+    options = dict(options or {})
+    if not options.pop('enabled', False):
+        return InMemoryModelStorageEngine('empty')
+    options.pop('replace', None)
+    return ModelStore(project_path, **options)
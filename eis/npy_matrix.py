@@ -0,0 +1,108 @@
+"""
+Memory mapped storage of the train/test matrices.
+
+A matrix is stored as raw .npy files next to each other in the matrices directory:
+    <uuid>.features.npy     float32 features, column major so every feature is contiguous
+    <uuid>.officer_id.npy   index of the matrix
+    <uuid>.as_of_date.npy
+    <uuid>.outcome.npy      label
+    <uuid>.columns.json     names of the features
+    <uuid>.yaml             metadata of the matrix
+
+read_matrix maps the features file instead of decoding it, so every model scored on a
+matrix, in this process or in another worker, shares the same page cached copy.
+"""
+import collections
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+log = logging.getLogger(__name__)
+
+FEATURES_SUFFIX = '.features.npy'
+
+# open memory maps of this process by uuid, the least recently read is closed past MAX_OPEN_MATRICES
+MAX_OPEN_MATRICES = 16
+_open_matrices = collections.OrderedDict()
+
+
+def _path(directory, uuid, suffix):
+    return os.path.join(directory, uuid + suffix)
+
+
+def _save(filename, array):
+    # written under a temporary name so a reader never maps a partial file
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.save(f, array)
+    os.rename(tmp_filename, filename)
+
+
+def write_matrix(directory, uuid, metadata, df):
+    """
+    Stores a matrix as returned by FeatureLoader.get_dataset
+    Args:
+        directory (str): matrices directory
+        uuid (str): metta uuid of the metadata
+        metadata (dict): metadata of the matrix
+        df (DataFrame): officer_id as index, as_of_date as first column and outcome as last column
+    """
+    feature_names = [col for col in df.columns if col not in ('as_of_date', 'outcome')]
+    # the 'merge' assembly leaves decimal objects from postgres, the MatrixBuilder matrices are already float32
+    features = np.asfortranarray(df[feature_names].values, dtype=np.float32)
+
+    with open(_path(directory, uuid, '.yaml'), 'w') as f:
+        yaml.dump(metadata, f)
+    with open(_path(directory, uuid, '.columns.json'), 'w') as f:
+        json.dump(feature_names, f)
+    _save(_path(directory, uuid, '.officer_id.npy'), df.index.values.astype(np.int64))
+    _save(_path(directory, uuid, '.as_of_date.npy'), pd.to_datetime(df['as_of_date']).values)
+    _save(_path(directory, uuid, '.outcome.npy'), df['outcome'].values.astype(np.int64))
+    # last, the features file marks the matrix as complete
+    _save(_path(directory, uuid, FEATURES_SUFFIX), features)
+    log.debug('Stored matrix {} of shape {}'.format(uuid, features.shape))
+    return None
+
+
+def _open_matrix(directory, uuid):
+    if uuid in _open_matrices:
+        _open_matrices.move_to_end(uuid)
+    else:
+        with open(_path(directory, uuid, '.columns.json')) as f:
+            feature_names = json.load(f)
+        _open_matrices[uuid] = {
+            'feature_names': feature_names,
+            'features': np.load(_path(directory, uuid, FEATURES_SUFFIX), mmap_mode='r'),
+            'officer_id': np.load(_path(directory, uuid, '.officer_id.npy')),
+            'as_of_date': np.load(_path(directory, uuid, '.as_of_date.npy')),
+            'outcome': np.load(_path(directory, uuid, '.outcome.npy'))}
+        # a DataFrame still using a closed matrix keeps its map until it is released
+        while len(_open_matrices) > MAX_OPEN_MATRICES:
+            _open_matrices.popitem(last=False)
+    return _open_matrices[uuid]
+
+
+def read_matrix(directory, uuid):
+    """
+    Returns the matrix with the layout of FeatureLoader.get_dataset. The features are a
+    read only view of the memory mapped file, they are not copied into the DataFrame
+    """
+    matrix = _open_matrix(directory, uuid)
+    df = pd.DataFrame(matrix['features'], columns=matrix['feature_names'],
+                      index=pd.Index(matrix['officer_id'], name='officer_id'), copy=False)
+    # the label keeps its own dtype so pandas never consolidates it with the mapped features
+    df.insert(0, 'as_of_date', matrix['as_of_date'])
+    df['outcome'] = matrix['outcome']
+    return df
+
+
+def close_matrix(uuid):
+    """
+    Drops the memory map of a matrix, e.g. before its files are removed
+    """
+    _open_matrices.pop(uuid, None)
+    return None
@@ -0,0 +1,107 @@
+"""
+Two stage pipeline of the experiment jobs: matrices are built while models are trained.
+
+The producer stage runs in threads of the main process and builds the matrices of a job into
+the matrix cache, it mostly waits on the database. The consumer stage runs in worker processes
+and trains and tests the models of a job, reading its matrices back from the cache. At most
+max_queued jobs are produced ahead of the consumers, which bounds the matrices waiting on disk.
+"""
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+log = logging.getLogger(__name__)
+
+
+def _timed(function, item):
+    # runs in the worker of the stage, so the time does not include waiting for the worker
+    start = time.time()
+    result = function(*item)
+    return time.time() - start, result
+
+
+class Pipeline():
+    def __init__(self, produce, consume, producers=1, consumers=1, max_queued=1):
+        '''
+        Args:
+            produce (function): called with the arguments of a job in a thread, e.g. builds its matrices
+            consume (function): called with the arguments of a job in a worker process once it is produced,
+                                its return value is the result of the job. It has to be picklable
+            producers (int): jobs produced at the same time
+            consumers (int): jobs consumed at the same time
+            max_queued (int): jobs produced or being produced that no consumer has started yet
+        '''
+        self.produce = produce
+        self.consume = consume
+        self.producers = max(1, producers)
+        self.consumers = max(1, consumers)
+        self.max_queued = max(1, max_queued)
+
+    def run(self, items):
+        """
+        Produces the items in order and consumes them as they are produced, stops starting new jobs
+        after one fails and raises its error once the running jobs finish
+        Args:
+            items (list): tuples of the arguments of every job
+        Returns:
+            list of the results of consume, in the order of items
+        """
+        pending = collections.deque(enumerate(items))
+        ready = collections.deque()
+        producing = {}
+        consuming = {}
+        results = [None] * len(pending)
+        busy = {'producers': 0, 'consumers': 0}
+        # time with a free consumer and no job ready for it
+        starved_seconds = 0
+        error = None
+
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=self.consumers) as consumer_pool:
+            # fork every worker before the producer threads start, so no child inherits a lock held by them
+            wait([consumer_pool.submit(time.sleep, 0) for _ in range(self.consumers)])
+
+            with ThreadPoolExecutor(max_workers=self.producers) as producer_pool:
+                while pending or ready or producing or consuming:
+                    if error is None:
+                        while pending and len(producing) < self.producers and \
+                                len(producing) + len(ready) < self.max_queued:
+                            index, item = pending.popleft()
+                            producing[producer_pool.submit(_timed, self.produce, item)] = (index, item)
+                        while ready and len(consuming) < self.consumers:
+                            index, item = ready.popleft()
+                            consuming[consumer_pool.submit(_timed, self.consume, item)] = (index, item)
+                    elif not producing and not consuming:
+                        break
+
+                    idle_consumers = self.consumers - len(consuming)
+                    waited = time.time()
+                    done, _ = wait(list(producing) + list(consuming), return_when=FIRST_COMPLETED)
+                    if pending or producing:
+                        starved_seconds += idle_consumers * (time.time() - waited)
+
+                    for future in done:
+                        stage = 'producers' if future in producing else 'consumers'
+                        index, item = producing.pop(future) if future in producing else consuming.pop(future)
+                        if future.exception() is not None:
+                            log.error('{} failed in the {}: {}'.format(item, stage, future.exception()))
+                            error = error or future.exception()
+                            continue
+                        seconds, result = future.result()
+                        busy[stage] += seconds
+                        if stage == 'producers':
+                            ready.append((index, item))
+                        else:
+                            results[index] = result
+
+        if error is not None:
+            raise error
+        wall_seconds = time.time() - start
+        log.info('Pipelined {} jobs in {:.1f} seconds: producers busy {:.0%}, consumers busy {:.0%}, '
+                 'consumers waited {:.1f} seconds for matrices'
+                 .format(len(results), wall_seconds,
+                         busy['producers'] / (self.producers * wall_seconds) if wall_seconds else 0,
+                         busy['consumers'] / (self.consumers * wall_seconds) if wall_seconds else 0,
+                         starved_seconds))
+        return results
@@ -1,13 +1,19 @@
 import pdb
 import copy
-import threading
 from itertools import product
 import datetime
+import functools
 import logging
+import time
 
+from . import feature_builds
+from . import feature_catalog
+from . import feature_scheduler
+from .feature_scheduler import FeatureScheduler
 from . import setup_environment
 from . import utils
 from .features import class_map
+from .features import dispatch_groups
 from .features import officers_collate
 
 log = logging.getLogger(__name__)
@@ -23,7 +29,13 @@ def populate_features_table(config, schema):
 
 
 def populate_dispatch_features_table(config, table_name, engine):
-    """Calculate all the feature values and store them in the features table in the database"""
+    """Calculate all the feature values and store them in the features table in the database
+
+    The features of a group (see eis/features/dispatch_groups.py) are computed together, the other
+    features with the query of their class, and features.table_name is recreated with one
+    CREATE TABLE AS joining all the queries on dispatch_id
+    """
+    start = time.time()
 
     # Get a list of all the features that are set to true.
     feature_list = [feat for feat, is_set_true in config['dispatch_features'].items() if is_set_true]
@@ -32,56 +44,53 @@ def populate_dispatch_features_table(config, table_name, engine):
     # make sure we have at least 1 feature
     assert num_features > 0, 'List of features to build is empty'
 
-    feature_threads = []
-
-    # run the build_and_insert of a set of features
-    def run_thread(feature_sublist, engine):
-
-        db_conn = engine.connect()
-
-        for feature_name in feature_sublist:
+    db_conn = engine.raw_connection()
+    try:
+        groups, ungrouped = dispatch_groups.group_features(feature_list)
+        feature_queries = [query(db_conn, features, config['raw_data_from_date'], config['raw_data_to_date'])
+                           for query, features in groups]
+        for feature_name in ungrouped:
             log.debug('... building feature {}'.format(feature_name))
-
             feature_obj = class_map.lookup(feature_name,
                                            unit='dispatch',
                                            from_date=config['raw_data_from_date'],
                                            to_date=config['raw_data_to_date'],
                                            fake_today=datetime.datetime.today(),
                                            table_name=table_name)
-            feature_obj.build_and_insert(db_conn)
-
-        db_conn.close()
-
-    def chunks(l, n):
-        """Yield successive n-sized chunks from l."""
-        for i in range(0, len(l), n):
-            yield l[i:i + n]
-
-    # build each feature and store it in its own table in features_prejoin
-    # start a new thread for each set of 5 features
-    for feature_sublist in chunks(feature_list, 5):
-        t = threading.Thread(target=run_thread, args=(feature_sublist, engine,))
-        feature_threads.append(t)
-        t.start()
-
-    # join each thread and wait for it to be done to make sure we're done building them all
-    # before we move on to joining them
-    for i, thread in enumerate(feature_threads):
-        log.debug('Waiting for feature thread: {}/{})'.format(i, (num_features / 5)))
-        thread.join()
-
-    # join each single-feature to the main table one at a time
-    for i, feature_name in enumerate(feature_list):
-        log.debug("Adding feature {}/{} ({})".format(i, len(feature_list), feature_name))
-
-        update_query = ("UPDATE features.{table_name} AS feature_table "
-                        "SET {feature} = prejoin_table.{feature} "
-                        "FROM features_prejoin.{feature} AS prejoin_table "
-                        "WHERE feature_table.dispatch_id = prejoin_table.dispatch_id "
-                        .format(table_name=table_name,
-                                feature=feature_name))
-
-        engine.execute(update_query)
+            feature_queries.append(feature_obj.query)
+
+        # columns of the table that are not rebuilt are kept
+        built_columns = {feature.lower() for feature in feature_list}
+        existing_columns = engine.execute(""" SELECT column_name FROM information_schema.columns
+                                              WHERE table_schema = 'features' AND table_name = '{}'
+                                              ORDER BY ordinal_position """.format(table_name))
+        kept_columns = [column for column, in existing_columns if column not in built_columns]
+
+        joins = " ".join(""" LEFT JOIN ({query}) AS feature_{i} USING (dispatch_id) """.format(query=query, i=i)
+                         for i, query in enumerate(feature_queries))
+        create_table_query = (""" DROP TABLE IF EXISTS features."{table_name}_new";
+                                  CREATE TABLE features."{table_name}_new" AS
+                                  SELECT * FROM (SELECT {kept_columns} FROM features."{table_name}") AS feature_table
+                                  {joins};
+                                  DROP TABLE features."{table_name}";
+                                  ALTER TABLE features."{table_name}_new" RENAME TO "{table_name}"; """
+                              .format(table_name=table_name,
+                                      kept_columns=", ".join('"{}"'.format(column) for column in kept_columns),
+                                      joins=joins))
+
+        # on the connection of the groups, their temporary tables are joined
+        cur = db_conn.cursor()
+        cur.execute(create_table_query)
+        db_conn.commit()
+    finally:
+        try:
+            dispatch_groups.drop_tables(db_conn)
+        finally:
+            db_conn.close()
+
+    log.info('Built {} dispatch features with {} queries in {:.1f} seconds'.format(num_features,
+                                                                                 len(feature_queries),
+                                                                                 time.time() - start))
 
 
 def join_feature_table(engine, list_prefixes, schema, features_table_name):
@@ -172,7 +181,14 @@ def populate_officer_features_table(config, schema, engine):
     as_of_dates = utils.generate_feature_dates(temporal_info)
     log.debug(as_of_dates)
 
-    list_prefixes = []
+    # blocks are built at the same time, the collate steps of every block share the database connections
+    scheduler_config = config.get('feature_scheduler') or {}
+    scheduler = FeatureScheduler(max_connections=scheduler_config.get('max_connections', config['n_cpus']),
+                                 workers=scheduler_config.get('workers', 1))
+
+    # lookup tables are queried once for all the blocks
+    lookup_cache = officers_collate.LookupCache()
+    blocks = []
     # get a list of all features that are set to true.
     for block_name in config["officer_features"]:
         log.debug('block_name: {}'.format(block_name))
@@ -183,15 +199,38 @@ def populate_officer_features_table(config, schema, engine):
         block_class = class_map.lookup_block(block_name,
                                              module=officers_collate,
                                              lookback_durations=temporal_info['timegated_feature_lookback_duration'],
-                                             n_cpus=config['n_cpus'])
-
-        # Build collate tables and returns table name
-        block_class.build_collate(engine, as_of_dates, feature_list, schema)
-        block_class.build_post_features(engine, feature_list, schema)
-        list_prefixes.extend(block_class.prefix)
+                                             n_cpus=config['n_cpus'],
+                                             lookup_cache=lookup_cache)
+
+        if config.get('incremental_features', False):
+            # only the as_of_dates missing or with changed staging data, returns the tables created
+            block_class.n_jobs = scheduler.job_connections(block_class.n_jobs)
+            scheduler.add_job(block_name,
+                              functools.partial(feature_builds.build_block, engine, block_class, block_name,
+                                                as_of_dates, feature_list, schema),
+                              cost=len(feature_list) * len(as_of_dates),
+                              connections=block_class.n_jobs)
+        else:
+            # Build collate tables, every job adds the name of its table to the block
+            feature_scheduler.add_block(scheduler, engine, block_class, block_name, as_of_dates, feature_list, schema)
+        blocks.append((block_name, block_class))
+
+    if config.get('incremental_features', False):
+        # the jobs of the blocks run at the same time with feature_scheduler.workers > 1, each one in its
+        # own scratch schema, and share the build log
+        feature_builds.create_tables(engine, schema)
+    results = scheduler.run()
+    list_prefixes = []
+    for block_name, block_class in blocks:
+        if config.get('incremental_features', False):
+            list_prefixes.extend(results[block_name])
+        else:
+            list_prefixes.extend(block_class.prefix)
 
     # Join all tables into one
     log.debug(list_prefixes)
     add_feature_indexes(engine, list_prefixes, schema)
+    # the block tables were rebuilt, their columns have to be resolved again
+    feature_catalog.invalidate(schema)
 
 #    join_feature_table(engine, list_prefixes, schema, table_name)
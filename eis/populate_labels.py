@@ -36,6 +36,9 @@ def create_officer_labels_table(config, table_name, engine):
     # drop the old features table
     log.info("Dropping the old officer labels table: {}".format(table_name))
     engine.execute("DROP TABLE IF EXISTS features.{}".format(table_name) )
+    # the labels materialized by the FeatureLoader are computed from the old table
+    engine.execute('DROP TABLE IF EXISTS features."{0}_materialized", features."{0}_materialized_dates"'
+                   .format(table_name))
 
     # use the appropriate id column, depending on feature types (officer / dispatch)
     id_column = '{}_id'.format(config['unit'])
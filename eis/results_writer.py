@@ -0,0 +1,84 @@
+"""
+Writes rows into the results tables with COPY FROM STDIN instead of INSERT statements.
+
+The rows are sent as CSV, empty fields are stored as NULL. Replacing the existing rows of
+a model is done in the same transaction as the COPY with an explicit DELETE.
+"""
+import csv
+import io
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+def _copy(cur, table, columns, buffer):
+    cur.copy_expert("COPY {table} ({columns}) FROM STDIN WITH CSV"
+                    .format(table=table, columns=", ".join(columns)), buffer)
+
+
+def copy_rows(db_conn, table, columns, rows, delete_query=None):
+    """
+    Writes rows into table in a single transaction and commits it
+    Args:
+        db_conn: raw psycopg2 connection
+        table (str): schema qualified table, e.g. 'results.predictions'
+        columns (list): columns of the table in the order of the values of the rows
+        rows (iterable): tuples of values, None is stored as NULL
+        delete_query (str): executed before the COPY, e.g. to remove the rows of a model
+    Returns:
+        number of rows written
+    """
+    start = time.time()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    n_rows = 0
+    for row in rows:
+        writer.writerow(row)
+        n_rows += 1
+    buffer.seek(0)
+
+    cur = db_conn.cursor()
+    if delete_query:
+        cur.execute(delete_query)
+    _copy(cur, table, columns, buffer)
+    db_conn.commit()
+
+    _log_rate(table, n_rows, time.time() - start)
+    return n_rows
+
+
+def copy_dataframe(db_conn, table, df, delete_query=None):
+    """
+    Writes the columns of df into table, the index is not written. Missing values are stored as NULL
+    Args: see copy_rows
+    """
+    start = time.time()
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    cur = db_conn.cursor()
+    if delete_query:
+        cur.execute(delete_query)
+    _copy(cur, table, df.columns, buffer)
+    db_conn.commit()
+
+    _log_rate(table, len(df), time.time() - start)
+    return len(df)
+
+
+def write_dataframe(db_engine, table, df, delete_query=None):
+    """
+    Same as copy_dataframe on a new connection of db_engine
+    """
+    db_conn = db_engine.raw_connection()
+    try:
+        return copy_dataframe(db_conn, table, df, delete_query=delete_query)
+    finally:
+        db_conn.close()
+
+
+def _log_rate(table, n_rows, seconds):
+    log.info('Wrote {} rows into {} in {:.2f} seconds ({:.0f} rows/sec)'
+             .format(n_rows, table, seconds, n_rows / seconds if seconds else float('inf')))
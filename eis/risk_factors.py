@@ -0,0 +1,62 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+
+def rank_distances(features):
+    """
+    Distance of the rank of every value to the rank of the median value of its feature
+    Args:
+        features (array): float32 matrix, one column per feature
+    Returns:
+        float64 matrix of the absolute rank distances, average ranks are used for ties
+    """
+    features = np.asarray(features, dtype=np.float32)
+    ranks = pd.DataFrame(features).rank().values
+    medians = np.nanmedian(features, axis=0)
+    # row of the value closest to the median of every feature, the first one on ties
+    median_rows = np.nanargmin(np.abs(features - medians), axis=0)
+    median_ranks = ranks[median_rows, np.arange(features.shape[1])]
+    return np.abs(ranks - median_ranks)
+
+
+def top_risk_factors(test_matrix, n_risks=5):
+    """
+    Returns for every officer the features whose rank is the furthest from the median rank,
+    in the order of pandas nlargest: largest distance first, ties in the order of the columns
+    Args:
+        test_matrix (DataFrame): one column per feature, one row per officer
+        n_risks (int): number of risk factors per officer
+    Returns:
+        DataFrame with the columns risk_1..risk_<n_risks>, padded with None when there are fewer features
+    """
+    feature_names = np.array(test_matrix.columns.tolist() + [None], dtype=object)
+    n_rows, n_features = test_matrix.shape
+    risk_columns = ['risk_{}'.format(i + 1) for i in range(n_risks)]
+    if n_rows == 0 or n_features == 0:
+        return pd.DataFrame(np.full((n_rows, n_risks), None, dtype=object), columns=risk_columns)
+
+    distances = rank_distances(test_matrix.values)
+
+    # average ranks are multiples of 0.5, so twice the distance is an exact integer. The key orders by
+    # distance and then by column position, it is unique within a row so a partition gives the exact top
+    missing = np.isnan(distances)
+    keys = np.where(missing, 0, distances * 2).astype(np.int64) * n_features + (n_features - 1 - np.arange(n_features))
+    keys[missing] = -1
+
+    rows = np.arange(n_rows)[:, None]
+    if n_features > n_risks:
+        top = np.argpartition(-keys, n_risks - 1, axis=1)[:, :n_risks]
+    else:
+        top = np.tile(np.arange(n_features), (n_rows, 1))
+    top = top[rows, np.argsort(-keys[rows, top], axis=1)]
+
+    # nlargest skips missing values
+    top[keys[rows, top] < 0] = n_features
+    if top.shape[1] < n_risks:
+        top = np.hstack([top, np.full((n_rows, n_risks - top.shape[1]), n_features, dtype=top.dtype)])
+
+    return pd.DataFrame(feature_names[top], columns=risk_columns)
@@ -10,15 +10,19 @@ import datetime
 import time
 import os
 import pdb
+import functools
 from itertools import product
 from joblib import Parallel, delayed
 import json
 
-from triage.storage import InMemoryModelStorageEngine
 from . import setup_environment
 from . import populate_features, populate_labels
+from . import cohort
+from . import model_store
 from . import utils
+from .pipeline import Pipeline
 from .run_models import RunModels
+from .shared_matrix import SharedMatrix, superset_blocks
 from triage.utils import save_experiment_and_get_hash
 from dateutil.relativedelta import relativedelta
 
@@ -121,6 +125,10 @@ def main(config_file_name, labels_config_file, args):
                        # config['officer_label_table_name'],
                        'grid_config': grid_config,
                        'project_path': config['project_path'],
+                       'matrix_options': config.get('matrix_options', {}),
+                       'matrix_cache': config.get('matrix_cache', {}),
+                       'prefetch': config.get('prefetch', {}),
+                       'model_store': config.get('model_store', {}),
                        'misc_db_parameters': misc_db_parameters}
 
         populate_features.populate_features_table(prod_config, config['production_schema_feature_blocks'])
@@ -128,6 +136,9 @@ def main(config_file_name, labels_config_file, args):
         # Create labels table-> Right now the labels configuration is read from the command line and not from the database
         populate_labels.create_labels_table(config,  config['production_officer_label_table_name'])
         populate_labels.populate_labels_table(config, labels_config, config['production_officer_label_table_name'])
+        if config.get('matrix_options', {}).get('cohort_intervals'):
+            cohort.build_cohort_tables(setup_environment.get_database(),
+                                       prod_config['temporal_info']['officer_past_activity_window'])
 
         log.info("Done building the features required for production use")
 
@@ -158,6 +169,9 @@ def main(config_file_name, labels_config_file, args):
         # Populate the featuress  and labels table
         populate_features.populate_features_table(config, config["schema_feature_blocks"])
         populate_labels.populate_labels_table(config, labels_config, config['officer_label_table_name'])
+        if config.get('matrix_options', {}).get('cohort_intervals'):
+            cohort.build_cohort_tables(setup_environment.get_database(),
+                                       config['temporal_info']['officer_past_activity_window'])
 
         log.info('Done creating features table')
         sys.exit()
@@ -185,14 +199,34 @@ def main(config_file_name, labels_config_file, args):
                    'labels_table_name': config['officer_label_table_name'],
                    'grid_config': grid_config,
                    'project_path': config['project_path'],
+                   'matrix_options': config.get('matrix_options', {}),
+                   'matrix_cache': config.get('matrix_cache', {}),
+                   'prefetch': config.get('prefetch', {}),
+                   'model_store': config.get('model_store', {}),
+                   'batch_scoring': config.get('batch_scoring', False),
+                   'evaluation_flush_size': config.get('evaluation_flush_size', 1),
+                   'all_blocks': superset_blocks(block_sets),
+                   'matrix_projections': config.get('matrix_projections', False),
+                   'shared_matrices_max_size_gb': config.get('shared_matrices_max_size_gb'),
                    'misc_db_parameters': misc_db_parameters}
 
     n_cups = config['n_cpus']
+    # every block set of a temporal split runs in the same worker, on column subsets of one matrix
+    shared_matrices = config.get('shared_matrices', False)
+    pipeline_options = config.get('pipeline') or {}
+
+    if shared_matrices:
+        jobs = [(temporal_set, block_sets) for temporal_set in temporal_sets]
+        generate = functools.partial(sweep_temporal_set, generate_all_matrices)
+        train_test = functools.partial(sweep_temporal_set, apply_train_test)
+    else:
+        jobs = list(product(temporal_sets, block_sets))
+        generate = generate_all_matrices
+        train_test = apply_train_test
 
     if args.generatematrices:
         # Parallelization
-        Parallel(n_jobs=n_cups, verbose=51)(delayed(generate_all_matrices)(temporal_set, blocks, **models_args)
-                                            for temporal_set, blocks in product(temporal_sets, block_sets))
+        Parallel(n_jobs=n_cups, verbose=51)(delayed(generate)(*job, **models_args) for job in jobs)
 
         log.info('Done creating all matrices')
         sys.exit()
@@ -203,13 +237,76 @@ def main(config_file_name, labels_config_file, args):
     experiment_hash = save_experiment_and_get_hash(config, db_engine)
     models_args['experiment_hash'] = experiment_hash
 
-    Parallel(n_jobs=n_cups, verbose=5)(delayed(apply_train_test)(temporal_set, blocks, **models_args)
-                                       for temporal_set, blocks in product(temporal_sets, block_sets))
+    if pipeline_options.get('enabled'):
+        # the matrices of the next jobs are built while the workers train on the jobs already built
+        Pipeline(functools.partial(generate, **models_args),
+                 functools.partial(train_test, **models_args),
+                 producers=pipeline_options.get('producers', 1),
+                 consumers=n_cups,
+                 max_queued=pipeline_options.get('max_queued', n_cups)).run(jobs)
+    else:
+        Parallel(n_jobs=n_cups, verbose=5)(delayed(train_test)(*job, **models_args) for job in jobs)
 
     log.info("Done!")
     return None
 
 
+def sweep_temporal_set(run_blocks, temporal_set, block_sets, **kwargs):
+    """
+    Runs run_blocks (generate_all_matrices or apply_train_test) for every block set of temporal_set
+    in this worker, the matrices of the block sets are taken from one SharedMatrix of all their blocks
+    """
+    try:
+        db_engine = setup_environment.get_database()
+    except:
+        log.warning('Could not connect to the database')
+        raise
+
+    shared_matrix = SharedMatrix(all_blocks_models(temporal_set, db_engine, **kwargs).feature_loader,
+                                 max_size_gb=kwargs.get('shared_matrices_max_size_gb'))
+
+    for blocks in block_sets:
+        run_blocks(temporal_set, blocks, shared_matrix=shared_matrix, **kwargs)
+
+    log.info('Loaded {} superset matrices for {} block sets of temporal set: {}'.format(shared_matrix.loads,
+                                                                                      len(block_sets),
+                                                                                      temporal_set))
+    shared_matrix.clear()
+    return None
+
+
+def all_blocks_models(temporal_set, db_engine, **kwargs):
+    """
+    Returns the RunModels of all the blocks of the experiment for temporal_set, whose matrices
+    hold the columns of every block set
+    """
+    return RunModels(labels=kwargs['labels'],
+                     features=kwargs['features'],
+                     schema_name=kwargs['schema_name'],
+                     blocks=kwargs['all_blocks'],
+                     feature_lookback_duration=kwargs['feature_lookback_duration'],
+                     labels_config=kwargs['labels_config'],
+                     labels_table_name=kwargs['labels_table_name'],
+                     temporal_split=temporal_set,
+                     grid_config=kwargs['grid_config'],
+                     project_path=kwargs['project_path'],
+                     misc_db_parameters=kwargs['misc_db_parameters'],
+                     matrix_options=kwargs['matrix_options'],
+                     matrix_cache=kwargs['matrix_cache'],
+                     shared_matrix=kwargs.get('shared_matrix'),
+                     db_engine=db_engine)
+
+
+def projection_models(temporal_set, db_engine, **kwargs):
+    """
+    Returns the RunModels whose matrices the matrices of a block set are projected from, None
+    when the matrices of every block set are stored on their own
+    """
+    if not kwargs.get('matrix_projections'):
+        return None
+    return all_blocks_models(temporal_set, db_engine, **kwargs)
+
+
 def generate_all_matrices(temporal_set, blocks, **kwargs):
     # Connect to db
     try:
@@ -229,12 +326,17 @@ def generate_all_matrices(temporal_set, blocks, **kwargs):
                           grid_config=kwargs['grid_config'],
                           project_path=kwargs['project_path'],
                           misc_db_parameters=kwargs['misc_db_parameters'],
+                          matrix_options=kwargs['matrix_options'],
+                          matrix_cache=kwargs['matrix_cache'],
+                          shared_matrix=kwargs.get('shared_matrix'),
+                          projection_of=projection_models(temporal_set, db_engine, **kwargs),
                           db_engine=db_engine)
 
     log.info('Run models for temporal set: {}'.format(temporal_set))
     log.info('Run models for feature blocks: {}'.format(blocks))
     run_model.generate_matrices()
-    db_engine.dispose()
+    log.info('Matrix cache stats: {}'.format(run_model.matrix_cache.stats()))
+    log.debug('Connection pool stats: {}'.format(setup_environment.pool_stats()))
     return None
 
 
@@ -257,20 +359,31 @@ def apply_train_test(temporal_set, blocks, **kwargs):
                           grid_config=kwargs['grid_config'],
                           project_path=kwargs['project_path'],
                           misc_db_parameters=kwargs['misc_db_parameters'],
+                          matrix_options=kwargs['matrix_options'],
+                          matrix_cache=kwargs['matrix_cache'],
+                          batch_scoring=kwargs['batch_scoring'],
+                          evaluation_flush_size=kwargs['evaluation_flush_size'],
                           experiment_hash=kwargs['experiment_hash'],
+                          shared_matrix=kwargs.get('shared_matrix'),
+                          projection_of=projection_models(temporal_set, db_engine, **kwargs),
+                          prefetch=kwargs.get('prefetch'),
                           db_engine=db_engine)
 
     log.info('Run models for temporal set: {}'.format(temporal_set))
     log.info('Run models for feature blocks: {}'.format(blocks))
 
-    model_storage = InMemoryModelStorageEngine('empty')
-    train_matrix_uuid, model_ids_generator = run_model.setup_train_models(model_storage)
+    store_options = kwargs.get('model_store') or {}
+    model_storage = model_store.storage_engine(kwargs['project_path'], store_options)
+    # the models stored by an earlier run are only retrained when asked to
+    replace = not store_options.get('enabled') or store_options.get('replace', False)
+    train_matrix_uuid, model_ids_generator = run_model.setup_train_models(model_storage, replace=replace)
     if train_matrix_uuid is None:
         return None
 
     log.info('Run tests')
     run_model.train_test_models(train_matrix_uuid, model_ids_generator, model_storage)
-    db_engine.dispose()
+    log.info('Matrix cache stats: {}'.format(run_model.matrix_cache.stats()))
+    log.debug('Connection pool stats: {}'.format(setup_environment.pool_stats()))
     return None
 
 
@@ -293,13 +406,19 @@ def apply_score_day(temporal_set, blocks, chosen_model_group_id, date, **kwargs)
                           grid_config=kwargs['grid_config'],
                           project_path=kwargs['project_path'],
                           misc_db_parameters=kwargs['misc_db_parameters'],
+                          matrix_options=kwargs['matrix_options'],
+                          matrix_cache=kwargs['matrix_cache'],
+                          prefetch=kwargs.get('prefetch'),
                           db_engine=db_engine)
 
     log.info('Run models for temporal set: {}'.format(temporal_set))
     log.info('Run models for feature blocks: {}'.format(blocks))
 
-    model_storage = InMemoryModelStorageEngine('empty')
-    train_matrix_uuid, model_ids_generator = run_model.setup_train_models(model_storage)
+    store_options = kwargs.get('model_store') or {}
+    model_storage = model_store.storage_engine(kwargs['project_path'], store_options)
+    # a model group already trained by an earlier day is scored without training it again
+    train_matrix_uuid, model_ids_generator = run_model.setup_train_models(model_storage,
+                                                                          replace=not store_options.get('enabled'))
     if train_matrix_uuid is None:
         return None
 
@@ -310,10 +429,13 @@ def apply_score_day(temporal_set, blocks, chosen_model_group_id, date, **kwargs)
     # time delta
     query = "select production.populate_time_delta();"
     conn = db_engine.raw_connection()
-    conn.cursor().execute(query)
-    conn.commit()
+    try:
+        conn.cursor().execute(query)
+        conn.commit()
+    finally:
+        conn.close()
 
-    db_engine.dispose()
+    log.debug('Connection pool stats: {}'.format(setup_environment.pool_stats()))
     return None
 
 
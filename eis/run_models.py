@@ -1,11 +1,9 @@
 import datetime
 import json
 import logging
-import os
 
 import numpy as np
 import pandas as pd
-from flufl.lock import Lock
 from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.ensemble import RandomForestClassifier
 
@@ -14,10 +12,16 @@ from triage.model_trainers import ModelTrainer
 from triage.predictors import Predictor
 from triage.storage import InMemoryMatrixStore
 from . import dataset
+from . import results_writer
+from . import risk_factors
 from . import scoring
 from . import setup_environment
 from . import utils
 from .feature_loader import FeatureLoader
+from .matrix_builder import align_features, column_name
+from .matrix_cache import MatrixCache
+from .matrix_prefetcher import MatrixPrefetcher
+from .metadata import make_hashable
 
 log = logging.getLogger(__name__)
 
@@ -37,7 +41,14 @@ class RunModels():
             project_path,
             misc_db_parameters,
             experiment_hash=None,
-            db_engine=None
+            db_engine=None,
+            matrix_options=None,
+            matrix_cache=None,
+            batch_scoring=False,
+            evaluation_flush_size=1,
+            shared_matrix=None,
+            projection_of=None,
+            prefetch=None
     ):
 
         self.labels = labels
@@ -53,7 +64,19 @@ class RunModels():
         self.misc_db_parameters = misc_db_parameters
         self.experiment_hash = experiment_hash
         self.db_engine = db_engine
+        self.matrix_options = matrix_options or {}
+        self.batch_scoring = batch_scoring
+        # SharedMatrix of the temporal split, the matrices are column subsets of it instead of loaded from the db
+        self.shared_matrix = shared_matrix
+        # RunModels of all the blocks, the matrices of this block set are stored as column projections of its matrices
+        self.projection_of = projection_of
+        # depth and max_size_gb of the MatrixPrefetcher of the test matrices
+        self.prefetch = prefetch or {}
+        self.evaluation_sink = dataset.EvaluationSink(self.db_engine, flush_size=evaluation_flush_size)
+        # (start_time, end_time, matrix_id) -> (metadata, uuid)
+        self._metadata_cache = {}
         self.matrices_path = self.project_path + '/matrices'
+        self.matrix_cache = MatrixCache(self.matrices_path, **(matrix_cache or {}))
 
         # Save only used labels in labels_config
         self.labels_config = {}
@@ -71,7 +94,8 @@ class RunModels():
                                             self.temporal_split['prediction_window'],
                                             self.temporal_split['officer_past_activity_window'],
                                             self.feature_lookback_duration,
-                                            self.db_engine
+                                            self.db_engine,
+                                            **self.matrix_options
                                             )
         self.features_list = self.feature_loader.features_list()
 
@@ -88,31 +112,54 @@ class RunModels():
         Returns:
            matrix: dataframe with the features and the last column as the label (called: outcome)
         """
-        uuid = metta.metta_io.generate_uuid(metadata)
-        matrix_filename = self.matrices_path + '/' + uuid
-
-        with Lock(matrix_filename + '.lock', lifetime=datetime.timedelta(minutes=20)):
-            if os.path.isfile(matrix_filename + '.h5'):
-                log.debug(' Matrix {} already stored'.format(uuid))
-                if return_matrix:
-                    df = metta.metta_io.recover_matrix(metadata, self.matrices_path)
-                    return df, uuid
-
-            else:
-
-                df = self.feature_loader.get_dataset(as_of_dates)
-                log.debug(
-                    'Start storing matrix {}, memory consumption: {}'.format(uuid, df.memory_usage(index=True).sum()))
-                metta.metta_io.archive_matrix(matrix_config=metadata,
-                                              df_matrix=df,
-                                              directory=self.matrices_path,
-                                              format='hd5')
-                log.debug('Done storing matrix {}'.format(uuid))
-
-                if return_matrix:
-                    return df, uuid
+        uuid = self._matrix_uuid(metadata)
+        parent = self.projection_of
+        if parent is None or sorted(parent.blocks) == sorted(self.blocks):
+            df = self.matrix_cache.get_or_build(uuid, metadata, self._matrix_builder(as_of_dates),
+                                                return_matrix=return_matrix)
+        else:
+            # same rows as the matrix of all the blocks, without the columns of the blocks left out
+            parent_metadata = parent._make_metadata(metadata['start_time'], metadata['end_time'],
+                                                    metadata['matrix_id'], as_of_dates)
+            features = set(self.features_list)
+            df = self.matrix_cache.get_or_project(uuid,
+                                                  metadata,
+                                                  parent._matrix_uuid(parent_metadata),
+                                                  parent_metadata,
+                                                  parent._matrix_builder(as_of_dates),
+                                                  [column_name(feature) for feature in parent.features_list
+                                                   if feature not in features],
+                                                  return_matrix=return_matrix)
+        if return_matrix:
+            # train and test matrices have the same feature_names, in the same order
+            return align_features(df, metadata['feature_names']), uuid
+
+    def _matrix_builder(self, as_of_dates):
+        """
+        Returns the function that builds the matrix of as_of_dates when it is not stored
+        """
+        if self.shared_matrix is not None:
+            return lambda: self.shared_matrix.get_dataset(as_of_dates, self.features_list)
+        return lambda: self.feature_loader.get_dataset(as_of_dates)
+
+    def _matrix_uuid(self, metadata):
+        """
+        Returns the metta uuid of metadata, memoized for the metadata returned by _make_metadata
+        """
+        key = (metadata['start_time'], metadata['end_time'], metadata['matrix_id'])
+        if key in self._metadata_cache and self._metadata_cache[key][0] is metadata:
+            return self._metadata_cache[key][1]
+        return metta.metta_io.generate_uuid(metadata)
 
     def _make_metadata(self, start_time, end_time, matrix_id, as_of_dates):
+        # the metadata of a matrix only changes with its dates within a temporal split and block set
+        key = (start_time, end_time, matrix_id)
+        if key not in self._metadata_cache:
+            metadata = self._build_metadata(start_time, end_time, matrix_id, as_of_dates)
+            self._metadata_cache[key] = (metadata, metta.metta_io.generate_uuid(metadata))
+        return self._metadata_cache[key][0]
+
+    def _build_metadata(self, start_time, end_time, matrix_id, as_of_dates):
 
         model_config = {
             'labels_config': self.labels_config,
@@ -144,46 +191,8 @@ class RunModels():
 
         return self._make_hashable(matrix_metadata)
 
-    def __sorting_multiple_types(self, list_to_sort):
-        for i in range(0, len(list_to_sort)):
-            min = i
-            for j in range(i + 1, len(list_to_sort)):
-                if isinstance(list_to_sort[j], (tuple, dict)):
-                    if sorted(list_to_sort[j])[0] < list_to_sort[min]:
-                        min = j
-                elif isinstance(list_to_sort[min], (tuple, dict)):
-                    if list_to_sort[j] < sorted(list_to_sort[min])[0]:
-                        min = j
-                else:
-                    if list_to_sort[j] < list_to_sort[min]:
-                        min = j
-            list_to_sort[i], list_to_sort[min] = list_to_sort[min], list_to_sort[i]
-
-        return list_to_sort
-
     def _make_hashable(self, o):
-        if isinstance(o, (tuple, list)):
-            l = []
-            for e in o:
-
-                if isinstance(e, (str, int)):
-                    l.append(str(e))
-
-                elif isinstance(e, (dict)):
-                    l.append(self._make_hashable(e))
-
-                else:
-                    l.append(e)
-
-            return self.__sorting_multiple_types(l)
-
-        if isinstance(o, dict):
-            return {k: self._make_hashable(o[k]) for k in sorted(o)}
-
-        if isinstance(o, (set, frozenset)):
-            return list(sorted(self._make_hashable(e) for e in o))
-
-        return o
+        return make_hashable(o)
 
     def generate_matrices(self):
 
@@ -217,7 +226,14 @@ class RunModels():
 
             self.load_store_matrix(test_metadata, [test_date], return_matrix=False)
 
-    def setup_train_models(self, model_storage):
+    def setup_train_models(self, model_storage, replace=True):
+        """
+        Loads the train matrix and returns its uuid and the generator of the ids of the trained models,
+        None, None when the matrix has a single label
+        Args:
+            model_storage: triage ModelStorageEngine of the trained models
+            replace (bool): retrain the models already in model_storage
+        """
         train_matrix_id = str([sorted(self.temporal_split['train_as_of_dates']),
                                self.labels,
                                self.temporal_split['prediction_window']])
@@ -266,74 +282,120 @@ class RunModels():
         log.info('Train Models')
         model_ids_generator = trainer.generate_trained_models(grid_config=self.grid_config,
                                                               misc_db_parameters=self.misc_db_parameters,
-                                                              replace=True)
+                                                              replace=replace)
 
         return train_matrix_uuid, model_ids_generator
 
+    def _load_test_matrix(self, test_date):
+        """
+        Returns the metadata, the matrix without the index columns and the uuid of the test matrix of test_date
+        """
+        test_matrix_id = str([test_date,
+                              self.labels,
+                              self.temporal_split['prediction_window']])
+
+        test_metadata = self._make_metadata(
+            datetime.datetime.strptime(test_date, "%Y-%m-%d"),
+            datetime.datetime.strptime(test_date, "%Y-%m-%d"),
+            test_matrix_id,
+            [test_date]
+        )
+
+        test_df, test_uuid = self.load_store_matrix(test_metadata, [test_date])
+
+        # remove the index from the data-frame
+        for column in test_metadata['indices']:
+            if column in test_df.columns:
+                del test_df[column]
+
+        return test_metadata, test_df, test_uuid
+
+    def _test_matrices(self):
+        """
+        Yields test_date, (metadata, matrix, uuid) of every test date, loading the next ones while one is scored
+        """
+        return MatrixPrefetcher(self._load_test_matrix,
+                                self.temporal_split['test_as_of_dates'],
+                                depth=self.prefetch.get('depth', 0),
+                                max_size_gb=self.prefetch.get('max_size_gb'))
+
+    def _test_model(self, predictor, trained_model_id, test_date, test_metadata, test_df, test_uuid):
+        misc_db_parameters = {'matrix_uuid': test_uuid}
+
+        # Store matrix
+        test_matrix_store = InMemoryMatrixStore(test_df.iloc[:, :-1], test_metadata, test_df.iloc[:, -1])
+
+        predictions_binary, predictions_proba = predictor.predict(trained_model_id, test_matrix_store,
+                                                                  misc_db_parameters)
+        ## Evaluation
+
+        if len(test_df.iloc[:, -1].unique()) == 1:
+            log.warning('''Test Matrix %s had only one
+                        unique value, no point in testing this matrix. Skipping
+                        ''', test_uuid)
+        else:
+            log.info('Generate Evaluations for model_id: {}'.format(trained_model_id))
+            self.evaluations(predictions_proba, predictions_binary, test_df.iloc[:, -1], trained_model_id,
+                             test_date)
+        self.individual_feature_ranking(
+            fitted_model=predictor.load_model(trained_model_id),
+            test_matrix=test_df.iloc[:, :-1],
+            model_id=trained_model_id,
+            test_date=test_date,
+            n_ranks=200)
+        return None
+
     def train_test_models(self, train_matrix_uuid, model_ids_generator, model_storage):
 
         predictor = Predictor(project_path=self.project_path,
                               model_storage_engine=model_storage,
                               db_engine=self.db_engine)
 
+        if self.batch_scoring:
+            return self.batch_test_models(predictor, model_ids_generator)
+
         for trained_model_id in model_ids_generator:
             ## Prediction
             log.info('Predict for model_id: {}'.format(trained_model_id))
 
             # Loop over testing as of dates
-            for test_date in self.temporal_split['test_as_of_dates']:
-                # Load matrixes
-                log.info('Load test matrix for as of date: {}'.format(test_date))
-                test_matrix_id = str([test_date,
-                                      self.labels,
-                                      self.temporal_split['prediction_window']])
-
-                test_metadata = self._make_metadata(
-                    datetime.datetime.strptime(test_date, "%Y-%m-%d"),
-                    datetime.datetime.strptime(test_date, "%Y-%m-%d"),
-                    test_matrix_id,
-                    [test_date]
-                )
-
-                test_df, test_uuid = self.load_store_matrix(test_metadata, [test_date])
-                misc_db_parameters = {'matrix_uuid': test_uuid}
-
-                # remove the index from the data-frame
-                for column in test_metadata['indices']:
-                    if column in test_df.columns:
-                        del test_df[column]
-
-                # Store matrix
-                test_matrix_store = InMemoryMatrixStore(test_df.iloc[:, :-1], test_metadata, test_df.iloc[:, -1])
-
-                predictions_binary, predictions_proba = predictor.predict(trained_model_id, test_matrix_store,
-                                                                          misc_db_parameters)
-                ## Evaluation
-
-                if len(test_df.iloc[:, -1].unique()) == 1:
-                    log.warning('''Test Matrix %s had only one
-                                unique value, no point in testing this matrix. Skipping
-                                ''', test_uuid)
-                    self.individual_feature_ranking(
-                        fitted_model=predictor.load_model(trained_model_id),
-                        test_matrix=test_df.iloc[:, :-1],
-                        model_id=trained_model_id,
-                        test_date=test_date,
-                        n_ranks=200)
-                else:
-                    log.info('Generate Evaluations for model_id: {}'.format(trained_model_id))
-                    self.evaluations(predictions_proba, predictions_binary, test_df.iloc[:, -1], trained_model_id,
-                                     test_date)
-                    self.individual_feature_ranking(
-                        fitted_model=predictor.load_model(trained_model_id),
-                        test_matrix=test_df.iloc[:, :-1],
-                        model_id=trained_model_id,
-                        test_date=test_date,
-                        n_ranks=200)
+            for test_date, (test_metadata, test_df, test_uuid) in self._test_matrices():
+                log.info('Test matrix loaded for as of date: {}'.format(test_date))
+                self._test_model(predictor, trained_model_id, test_date, test_metadata, test_df, test_uuid)
 
             # remove trained model from memory
             predictor.delete_model(trained_model_id)
 
+        self.evaluation_sink.flush()
+        return None
+
+    def batch_test_models(self, predictor, model_ids_generator):
+        """
+        Scores every trained model on a test matrix before loading the next one, so each test
+        matrix is loaded once per temporal split instead of once per model and test date.
+        The trained models are kept in the model storage until every test date is scored
+        """
+        # train every model of the grid
+        trained_model_ids = list(model_ids_generator)
+
+        test_matrices = self._test_matrices()
+        for test_date, (test_metadata, test_df, test_uuid) in test_matrices:
+            log.info('Test matrix loaded for as of date: {}'.format(test_date))
+            for trained_model_id in trained_model_ids:
+                log.info('Predict for model_id: {}'.format(trained_model_id))
+                self._test_model(predictor, trained_model_id, test_date, test_metadata, test_df, test_uuid)
+
+        # remove trained models from memory
+        for trained_model_id in trained_model_ids:
+            predictor.delete_model(trained_model_id)
+        self.evaluation_sink.flush()
+
+        # the loop over models loads every test matrix once per model
+        load_seconds = test_matrices.load_seconds
+        log.info('Loaded {} test matrices once for {} models in {:.1f} seconds ({:.1f} seconds waited for them), '
+                 '{:.1f} seconds saved compared to loading them for every model'
+                 .format(len(self.temporal_split['test_as_of_dates']), len(trained_model_ids), load_seconds,
+                         test_matrices.wait_seconds, load_seconds * max(len(trained_model_ids) - 1, 0)))
         return None
 
     # this function is used for training and scoring a day
@@ -348,28 +410,10 @@ class RunModels():
             log.info('Predict for model_id: {}'.format(trained_model_id))
 
             # Loop over testing as of dates
-            for test_date in self.temporal_split['test_as_of_dates']:
-                # Load matrixes
-                log.info('Load production matrix for as of date: {}'.format(test_date))
-                test_matrix_id = str([test_date,
-                                      self.labels,
-                                      self.temporal_split['prediction_window']])
-
-                test_metadata = self._make_metadata(
-                    datetime.datetime.strptime(test_date, "%Y-%m-%d"),
-                    datetime.datetime.strptime(test_date, "%Y-%m-%d"),
-                    test_matrix_id,
-                    [test_date]
-                )
-
-                test_df, test_uuid = self.load_store_matrix(test_metadata, [test_date])
+            for test_date, (test_metadata, test_df, test_uuid) in self._test_matrices():
+                log.info('Production matrix loaded for as of date: {}'.format(test_date))
                 misc_db_parameters = {'matrix_uuid': test_uuid}
 
-                # remove the index from the data-frame
-                for column in test_metadata['indices']:
-                    if column in test_df.columns:
-                        del test_df[column]
-
                 # Store matrix
                 test_matrix_store = InMemoryMatrixStore(test_df.iloc[:, :-1], test_metadata, test_df.iloc[:, -1])
 
@@ -392,34 +436,7 @@ class RunModels():
         all_metrics = scoring.calculate_all_evaluation_metrics(test_y.tolist(),
                                                                predictions_proba.tolist(),
                                                                predictions_binary.tolist())
-        db_conn = self.db_engine.raw_connection()
-
-        # remove all existing evaluations before re-writing
-        query = "DELETE FROM results.evaluations where model_id = {} and evaluation_start_time = '{}'::TIMESTAMP ".format(
-            model_id, test_date)
-        db_conn.cursor().execute(query)
-        db_conn.commit()
-
-        for key in all_metrics:
-            evaluation = all_metrics[key]
-            metric = key.split('|')[0]
-            try:
-                metric_parameter = key.split('|')[1]
-                if metric_parameter == '':
-                    metric_parameter.replace('', None)
-                else:
-                    pass
-            except:
-                metric_parameter = None
-
-            try:
-                comment = str(key.split('|')[2])
-            except:
-                comment = None
-
-            dataset.store_evaluation_metrics(model_id, evaluation, metric, test_date, db_conn, metric_parameter,
-                                             comment)
-        db_conn.close()
+        self.evaluation_sink.add(model_id, test_date, all_metrics)
         return None
 
     def individual_feature_ranking(self, fitted_model, test_matrix, model_id, test_date, n_ranks):
@@ -446,52 +463,30 @@ class RunModels():
         importance_dict_filtered = {k: v for k, v in importance_dict.items() if not 'dummy' in k}
 
         rftree_feature_list = sorted(importance_dict_filtered, key=importance_dict_filtered.get, reverse=True)
+        if not rftree_feature_list:
+            log.info('No feature with importance in model {}, skipping individual feature ranking'.format(model_id))
+            return None
 
-        # create a new text matrix with float conversion (panda stores some columns from postgres as decimal object)
-        tmp_test = test_matrix.applymap(lambda x: float(x))
-        test_matrix_reduced = pd.DataFrame()
-
+        # matrices built with the 'merge' assembly store columns from postgres as decimal objects,
+        # the ones built by the MatrixBuilder are already float32 and are not converted again
         # add the top n_ranks features from the RandomForest used without dummies
-        for feature in rftree_feature_list[:n_ranks]:
-            test_matrix_reduced[feature] = tmp_test[feature]
-
-        test_matrix_rank_distance = pd.DataFrame()
-
-        for feature in test_matrix_reduced.columns:
-            feature_median = test_matrix_reduced[feature].median()
-            test_matrix_reduced[feature + '_rank'] = test_matrix_reduced[feature].rank()
-            # the index of the median value
-            idx = np.nanargmin(np.abs(test_matrix_reduced[feature] - feature_median))
-            median_rank = test_matrix_reduced[feature + '_rank'].iloc[idx]
-            test_matrix_rank_distance[feature] = np.abs(test_matrix_reduced[feature + '_rank'] - median_rank)
-
-        test_matrix_rank_distance = test_matrix_rank_distance.reset_index(drop=True)
+        test_matrix_reduced = test_matrix[rftree_feature_list[:n_ranks]].astype(np.float32, copy=False)
 
         # find the top 5 features where the distance to the median rank value (for standardisation) is the highest
-        # across the top 30 features
-        matrix_transposed = test_matrix_rank_distance.T
-        result = pd.DataFrame(np.zeros((0, 5)), columns=['risk_1', 'risk_2', 'risk_3', 'risk_4', 'risk_5'])
-        for i in matrix_transposed.columns:
-            df1row = pd.DataFrame(matrix_transposed.nlargest(5, i).index.tolist(),
-                                  index=['risk_1', 'risk_2', 'risk_3', 'risk_4', 'risk_5']).T
-            result = pd.concat([result, df1row], axis=0)
-        result = result.reset_index(drop=True)
+        # across the top n_ranks features
+        result = risk_factors.top_risk_factors(test_matrix_reduced, n_risks=5)
 
         # prepare table insert
         result['entity_id'] = test_matrix_reduced.index.values
         result['model_id'] = model_id
         result['as_of_date'] = test_date
 
-        db_conn = self.db_engine.raw_connection()
-
         # remove all existing evaluations before re-writing
         query = "DELETE FROM results.individual_importances where model_id = {} and as_of_date = '{}'::TIMESTAMP ".format(
             model_id, test_date)
-        db_conn.cursor().execute(query)
-        db_conn.commit()
 
-        # write new entries
-        result.to_sql("individual_importances", self.db_engine, if_exists="append", schema="results", index=False)
+        # write new entries, missing risk factors are written as NULL
+        results_writer.write_dataframe(self.db_engine, "results.individual_importances", result, delete_query=query)
 
         return None
 
@@ -5,6 +5,7 @@ import pandas as pd
 import statistics
 from sklearn import metrics
 from . import dataset
+from .threshold_metrics import ThresholdMetrics
 
 
 def compute_AUC(test_labels, test_predictions):
@@ -110,26 +111,13 @@ def calculate_all_evaluation_metrics( test_label, test_predictions, test_predict
     all_metrics["recall@|default"] = metrics.recall_score(test_label, test_predictions_binary)
     # all_metrics["time|seconds"] = time_for_model_in_seconds
 
-    #sort
-    test_predictions_sorted, test_label_sorted = zip(*sorted(zip(test_predictions, test_label),key=lambda pair: pair[0], reverse=True))
-
     # Threshold Metrics by Percentage
     parameters = {'pct': [0.01, 0.10, 0.25, 0.50, 1.0, 5.0, 10.0, 25.0, 50.0, 75.0, 100.0],
                'abs': [10, 50, 100, 200, 500, 1000]}
-    for x_type, x_values in parameters.items():
-        for x_value in x_values:
-            test_predictions_binary_at_x = generate_binary_at_x(test_predictions_sorted, x_value, unit= x_type)
-            # Precision
-            all_metrics["precision@|{}_{}".format(str(x_value), x_type)] = precision_at_x(test_label_sorted, test_predictions_binary_at_x)
-            # Recall
-            all_metrics["recall@|{}_{}".format(str(x_value), x_type)] = recall_at_x(test_label_sorted, test_predictions_binary_at_x)
-            # Raw counts of officers we are flagging correctly and incorrectly at various fractions of the test set.
-            TP, TN, FP, FN = confusion_matrix_at_x(test_label_sorted,  test_predictions_binary_at_x)
-            all_metrics["true positives@|{}_{}".format(str(x_value), x_type)] = TP
-            all_metrics["true negatives@|{}_{}".format(str(x_value), x_type)] = TN
-            all_metrics["false positives@|{}_{}".format(str(x_value), x_type)] = FP
-            all_metrics["false negatives@|{}_{}".format(str(x_value), x_type)] = FN
-            
+    # precision, recall and raw counts of officers we are flagging correctly and incorrectly
+    # at various fractions of the test set, from one sort of the predictions
+    all_metrics.update(ThresholdMetrics(test_label, test_predictions).metrics(parameters))
+
     return all_metrics
 
 # Comment: Not used right now needs to be checked as it contains cut-off errors
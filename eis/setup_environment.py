@@ -1,12 +1,78 @@
 #!/usr/bin/env python
 import os
+import threading
+import time
 import yaml
-from sqlalchemy import create_engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool
 import logging
 
 log = logging.getLogger(__name__)
 
+# engines of this process by (url, production, pid), every caller shares the pool of its process
+_engines = {}
+_engines_lock = threading.Lock()
+
+# optional pool settings of the profile and the create_engine argument they set
+POOL_OPTIONS = {'POOL_SIZE': 'pool_size',
+                'MAX_OVERFLOW': 'max_overflow',
+                'POOL_TIMEOUT': 'pool_timeout',
+                'POOL_RECYCLE': 'pool_recycle'}
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that keeps how long the checkouts waited for a free connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.time()
+        connection = super()._do_get()
+        wait_seconds = time.time() - start
+        self.checkouts += 1
+        self.wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+        return connection
+
+
+def _add_fork_protection(engine):
+    # connections inherited from the parent process after a fork are discarded, not shared
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                "Connection record belongs to pid {}, attempting to check out in pid {}"
+                .format(connection_record.info['pid'], pid))
+
+
+def pool_stats():
+    """
+    Returns the pool usage of every engine of this process
+    """
+    stats = []
+    for (url, production, pid), engine in _engines.items():
+        pool = engine.pool
+        stats.append({'database': engine.url.database,
+                      'production': bool(production),
+                      'size': pool.size(),
+                      'checked_out': pool.checkedout(),
+                      'checkouts': pool.checkouts,
+                      'wait_seconds': pool.wait_seconds,
+                      'max_wait_seconds': pool.max_wait_seconds})
+    return stats
+
 
 def get_experiment_config(exp_config_file_name='experiment.yaml'):
     """Get the experiment configuration variables from the config file
@@ -56,14 +122,18 @@ def get_connection_from_profile(config_file_name="default_profile.yaml", product
             'PGPORT' in vals.keys()):
         raise Exception('Bad config file: ' + config_file_name)
 
+    pool_options = {argument: vals[key] for key, argument in POOL_OPTIONS.items() if vals.get(key) is not None}
+
     return get_engine(vals['PGDATABASE'], vals['PGUSER'],
                       vals['PGHOST'], vals['PGPORT'],
-                      vals['PGPASSWORD'], production)
+                      vals['PGPASSWORD'], production, **pool_options)
 
 
-def get_engine(db, user, host, port, passwd, production=None):
+def get_engine(db, user, host, port, passwd, production=None, **pool_options):
     """
-    Get SQLalchemy engine using credentials.
+    Get SQLalchemy engine using credentials. The engine is created once per process
+    and its connections are pooled, so the callers reuse connections instead of
+    connecting for every query.
 
     Input:
     db: database name
@@ -71,20 +141,27 @@ def get_engine(db, user, host, port, passwd, production=None):
     host: Hostname of the database server
     port: Port number
     passwd: Password for the database
+    pool_options: pool_size, max_overflow, pool_timeout, pool_recycle of create_engine
     """
 
     url = 'postgresql://{user}:{passwd}@{host}:{port}/{db}'.format(
         user=user, passwd=passwd, host=host, port=port, db=db)
-    if not production:
-        engine = create_engine(url, poolclass=NullPool)
-    else:
-        engine = create_engine(
-                url,
-                execution_options={'schema_translate_map': {
-                    'results': 'production'
-                }},
-                poolclass=NullPool
-        )
-
-    return engine
-
+    key = (url, bool(production), os.getpid())
+
+    with _engines_lock:
+        if key not in _engines:
+            if not production:
+                engine = create_engine(url, poolclass=TimedQueuePool, **pool_options)
+            else:
+                engine = create_engine(
+                        url,
+                        execution_options={'schema_translate_map': {
+                            'results': 'production'
+                        }},
+                        poolclass=TimedQueuePool,
+                        **pool_options
+                )
+            _add_fork_protection(engine)
+            _engines[key] = engine
+
+    return _engines[key]
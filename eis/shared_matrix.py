@@ -0,0 +1,112 @@
+"""
+One matrix with the features of every block set of a temporal split.
+
+The block sets of the experiment (the full list and the leave-one-out sets) share almost all
+their columns, and the rows of a matrix only depend on its as_of_dates and labels. The superset
+matrix of the split is loaded once for every list of as_of_dates, and the matrix of a block set
+is a column subset of it: every run of contiguous columns is a view of the superset, not a copy,
+so the worker running all the block sets of a split holds the features about once. The superset
+matrices are kept by that worker only, until clear() or until they take max_size_gb of memory.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .matrix_builder import column_name
+
+log = logging.getLogger(__name__)
+
+
+def superset_blocks(block_sets):
+    """
+    Returns the blocks of all the block sets, in the order they first appear
+    """
+    blocks = []
+    for block_set in block_sets:
+        blocks.extend(block for block in block_set if block not in blocks)
+    return blocks
+
+
+def column_runs(positions):
+    """
+    Splits a list of column positions into slices of contiguous columns
+    """
+    runs = []
+    for position in positions:
+        if runs and runs[-1].stop == position:
+            runs[-1] = slice(runs[-1].start, position + 1)
+        else:
+            runs.append(slice(position, position + 1))
+    return runs
+
+
+class SharedMatrix():
+    def __init__(self, feature_loader, max_size_gb=None):
+        '''
+        Args:
+            feature_loader (FeatureLoader): loader of the superset blocks of the temporal split
+            max_size_gb (float): memory of the superset matrices kept, a matrix loaded once they take it
+                                 is only used for the block set that asked for it. None for no limit
+        '''
+        self.feature_loader = feature_loader
+        self.max_bytes = int(max_size_gb * 1024 ** 3) if max_size_gb else None
+        # tuple of as_of_dates -> features (rows x columns, column major), column names and labels
+        self._matrices = {}
+        self.loads = 0
+
+    def _size(self, matrix):
+        return sum(value.nbytes for value in matrix.values() if isinstance(value, np.ndarray))
+
+    def _matrix(self, as_of_dates_to_use):
+        key = tuple(as_of_dates_to_use)
+        if key in self._matrices:
+            return self._matrices[key]
+
+        df = self.feature_loader.get_dataset(as_of_dates_to_use)
+        feature_names = [col for col in df.columns if col not in ('as_of_date', 'outcome')]
+        matrix = {'features': np.asfortranarray(df[feature_names].values, dtype=np.float32),
+                  'column_index': {name: i for i, name in enumerate(feature_names)},
+                  'officer_id': df.index.values,
+                  'as_of_date': df['as_of_date'].values,
+                  'outcome': df['outcome'].values}
+        self.loads += 1
+        log.debug('Loaded superset matrix of shape {} for {} as_of_dates'.format(matrix['features'].shape,
+                                                                                 len(key)))
+
+        # every block set reads the matrices in the same order, evicting the least recently used one
+        # would drop each matrix right before it is read again, so the matrices kept stay kept
+        kept_bytes = sum(self._size(kept) for kept in self._matrices.values())
+        if self.max_bytes is None or kept_bytes + self._size(matrix) <= self.max_bytes:
+            self._matrices[key] = matrix
+        return matrix
+
+    def get_dataset(self, as_of_dates_to_use, features):
+        """
+        Returns the matrix of a block set with the layout of FeatureLoader.get_dataset
+        Args:
+            as_of_dates_to_use (list): as_of_dates of the matrix
+            features (list): features of the block set, as returned by FeatureLoader.features_list
+        """
+        matrix = self._matrix(as_of_dates_to_use)
+        names = [column_name(feature) for feature in features]
+        positions = [matrix['column_index'][name] for name in names]
+        index = pd.Index(matrix['officer_id'], name='officer_id')
+
+        # the block sets keep the order of the superset, so most columns come in a few long runs
+        parts = [pd.DataFrame(matrix['features'][:, run], index=index, copy=False)
+                 for run in column_runs(positions)]
+        if len(parts) == 1:
+            df = parts[0]
+        elif parts:
+            df = pd.concat(parts, axis=1)
+        else:
+            df = pd.DataFrame(index=index)
+        df.columns = names
+        df.insert(0, 'as_of_date', matrix['as_of_date'])
+        df['outcome'] = matrix['outcome']
+        return df
+
+    def clear(self):
+        self._matrices = {}
+        return None
@@ -0,0 +1,80 @@
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class ThresholdMetrics():
+    def __init__(self, test_labels, test_predictions):
+        '''
+        Sorts the predictions once and keeps the cumulative number of true positives,
+        so the metrics of the top k predictions at any cutoff are lookups
+        Args:
+            test_labels (list): true labels, 1 for the positive class
+            test_predictions (list): risk scores of the same rows
+        '''
+        test_labels = np.asarray(test_labels)
+        test_predictions = np.asarray(test_predictions, dtype=np.float64)
+
+        # highest score first, ties keep their original order as sorted(..., reverse=True) does
+        order = np.argsort(-test_predictions, kind='mergesort')
+        positives = (test_labels[order] == 1).astype(np.int64)
+
+        self.n_rows = len(positives)
+        self.n_positives = positives.sum()
+        # true positives among the top k predictions, for k = 0..n_rows
+        self.cumulative_true_positives = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(positives)])
+
+    def cutoff(self, x_value, unit='abs'):
+        """
+        Number of predictions labeled positive at x_value, pct is a percentage of the rows
+        """
+        if unit == 'pct':
+            cutoff_index = int(self.n_rows * (x_value / 100.00))
+        else:
+            cutoff_index = x_value
+        return min(max(cutoff_index, 0), self.n_rows)
+
+    def confusion_matrix_at(self, k):
+        """
+        Returns TP, TN, FP, FN when the top k predictions are labeled positive
+        """
+        TP = self.cumulative_true_positives[k]
+        FP = k - TP
+        FN = self.n_positives - TP
+        TN = self.n_rows - k - FN
+        return TP, TN, FP, FN
+
+    def precision_at(self, k):
+        # 0 when nothing is labeled positive, as sklearn does
+        if k == 0:
+            return 0.0
+        return self.cumulative_true_positives[k] / k
+
+    def recall_at(self, k):
+        if self.n_positives == 0:
+            return 0.0
+        return self.cumulative_true_positives[k] / self.n_positives
+
+    def metrics(self, parameters):
+        """
+        Returns the precision, recall and confusion matrix counts at every cutoff
+        Args:
+            parameters (dict): units ('pct' or 'abs') to list of cutoffs
+        Returns:
+            dict with the keys of scoring.calculate_all_evaluation_metrics, e.g. 'precision@|10_abs'
+        """
+        all_metrics = dict()
+        for x_type, x_values in parameters.items():
+            for x_value in x_values:
+                k = self.cutoff(x_value, unit=x_type)
+                suffix = "{}_{}".format(str(x_value), x_type)
+                all_metrics["precision@|" + suffix] = self.precision_at(k)
+                all_metrics["recall@|" + suffix] = self.recall_at(k)
+                TP, TN, FP, FN = self.confusion_matrix_at(k)
+                all_metrics["true positives@|" + suffix] = TP
+                all_metrics["true negatives@|" + suffix] = TN
+                all_metrics["false positives@|" + suffix] = FP
+                all_metrics["false negatives@|" + suffix] = FN
+        return all_metrics
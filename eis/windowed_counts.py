@@ -0,0 +1,39 @@
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def windowed_counts(times, event_times, windows, event_weights=None):
+    '''
+    Counts the events preceding every time for several window lengths and event filters in one pass,
+    the events are sorted once and every window is two binary searches over their cumulative counts
+    Args:
+        times (array): datetime64 of the end of the windows, e.g. the dispatch times
+        event_times (array): datetime64 of the events
+        windows (list): np.timedelta64 length of every window, an event is counted when
+                        time - window <= event_time <= time
+        event_weights (array): events x filters, what every event counts for each filter,
+                               e.g. its number of felony arrests; 1 per event when None
+    Returns:
+        np.ndarray of int64, times x windows x filters
+    '''
+    times = np.asarray(times, dtype='datetime64[ns]')
+    event_times = np.asarray(event_times, dtype='datetime64[ns]')
+    if event_weights is None:
+        event_weights = np.ones((len(event_times), 1), dtype=np.int64)
+    event_weights = np.asarray(event_weights, dtype=np.int64).reshape(len(event_times), -1)
+
+    order = np.argsort(event_times, kind='mergesort')
+    sorted_times = event_times[order]
+    # events before position i of sorted_times, by filter
+    cumulative = np.zeros((len(event_times) + 1, event_weights.shape[1]), dtype=np.int64)
+    np.cumsum(event_weights[order], axis=0, out=cumulative[1:])
+
+    end = np.searchsorted(sorted_times, times, side='right')
+    counts = np.empty((len(times), len(windows), event_weights.shape[1]), dtype=np.int64)
+    for i, window in enumerate(windows):
+        start = np.searchsorted(sorted_times, times - np.timedelta64(window, 'ns'), side='left')
+        counts[:, i, :] = cumulative[end] - cumulative[start]
+    return counts
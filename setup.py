@@ -37,7 +37,7 @@ setup(
 
     keywords='police analytics machine learning misconduct prediction',
 
-    packages=find_packages(exclude=['images', 'docs', 'tests*']),
+    packages=find_packages(exclude=['images', 'docs', 'tests*', 'benchmarks*']),
 
     setup_requires=['numpy', 'scipy'],
     install_requires=['numpy', 'pyyaml', 'pandas', 'scikit-learn',
@@ -22,3 +22,22 @@ class TestFeatureFunctions:
 
         df, featurenames = dataset.convert_categorical(df)
         assert sum(df['is_highschool']) == 1
+
+
+class TestEvaluationSink:
+    def test_rows_keep_store_evaluation_metrics_values(self):
+        sink = dataset.EvaluationSink(db_engine=None, flush_size=10)
+        sink.add(1, '2015-01-01', {'auc|roc': 0.5, 'accuracy': 1, 'precision@|10_abs': 0.123456789012})
+
+        rows = {row[1]: row for row in sink.evaluations[(1, '2015-01-01')]}
+        assert_equals(rows['auc'], (1, 'auc', 'roc', 0.5, None, '2015-01-01', '2015-01-01'))
+        assert_equals(rows['accuracy'][2], 'Null')
+        assert_equals(rows['precision@'][3], 0.123456789)
+
+    def test_new_evaluation_replaces_pending_one(self):
+        sink = dataset.EvaluationSink(db_engine=None, flush_size=10)
+        sink.add(1, '2015-01-01', {'accuracy': 0.1})
+        sink.add(1, '2015-01-01', {'accuracy': 0.2})
+
+        assert_equals(len(sink.evaluations), 1)
+        assert_equals(sink.evaluations[(1, '2015-01-01')][0][3], 0.2)
@@ -0,0 +1,86 @@
+import datetime
+
+from eis.features import dispatch_groups
+
+
+class TestGroupFeatures:
+    def test_arrests_in_past_variants_share_one_query(self):
+        feature_list = ['DispatchHour', 'ArrestsInPast1Hour', 'FelonyArrestsInPastWeek',
+                        'ArrestsWithinQuarterMileRadiusInPast1Hour', 'DrugsArrestsInPast24Hours']
+
+        groups, ungrouped = dispatch_groups.group_features(feature_list)
+
+        assert [features for _, features in groups] == [['ArrestsInPast1Hour', 'FelonyArrestsInPastWeek',
+                                                         'DrugsArrestsInPast24Hours']]
+        assert ungrouped == ['DispatchHour', 'ArrestsWithinQuarterMileRadiusInPast1Hour']
+
+    def test_windows_and_flags(self):
+        assert dispatch_groups.arrests_in_past_window('ArrestsInPast1Hour') == (None, 1, '1 hours')
+        assert dispatch_groups.arrests_in_past_window('StolenVehicleArrestsInPast48Hours') == \
+            ('stolen_vehicle_flag', 48, '48 hours')
+        assert dispatch_groups.arrests_in_past_window('FelonyArrestsInPastWeek') == ('felony_flag', 168, '1 week')
+        assert dispatch_groups.arrests_in_past_window('OfficersDispatchedInPast1Hour') is None
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query):
+        self.connection.statements.append(query)
+        if 'FROM staging.earliest_dispatch_time\n' in query:
+            self.rows = self.connection.dispatches
+        elif 'FROM staging.events_hub' in query:
+            self.rows = self.connection.events
+
+    def fetchall(self):
+        return self.rows
+
+    def copy_expert(self, query, buffer):
+        self.connection.copied.append(buffer.read())
+
+
+class FakeConnection:
+    def __init__(self, dispatches, events):
+        self.dispatches = dispatches
+        self.events = events
+        self.statements = []
+        self.copied = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class TestArrestsInPastTable:
+    def test_counts_by_window_and_flag(self):
+        dispatches = [('d1', datetime.datetime(2016, 1, 2, 12)),
+                      ('d2', datetime.datetime(2016, 1, 9, 12)),
+                      ('d3', datetime.datetime(2016, 3, 1))]
+        # event_datetime, felony arrests of the event
+        events = [(datetime.datetime(2016, 1, 2, 11, 30), 1),
+                  (datetime.datetime(2016, 1, 2, 6), 0),
+                  (datetime.datetime(2016, 1, 2, 12), 2),
+                  (datetime.datetime(2016, 1, 3), 1)]
+        db_conn = FakeConnection(dispatches, events)
+
+        query = dispatch_groups.arrests_in_past_table(db_conn, ['ArrestsInPast1Hour', 'FelonyArrestsInPastWeek'],
+                                                      '2016-01-01', '2016-12-31')
+
+        assert query == 'SELECT * FROM arrests_in_past'
+        assert 'NULL::bigint AS arrestsinpast1hour, NULL::bigint AS felonyarrestsinpastweek' in db_conn.statements[-1]
+        # the week before d2 starts at the event of 2016-01-02 12:00, no arrests precede d3
+        assert db_conn.copied == ['d1,2,3\nd2,,3\n']
+
+    def test_drop_tables(self):
+        db_conn = FakeConnection([], [])
+
+        dispatch_groups.drop_tables(db_conn)
+
+        assert db_conn.statements == ['DROP TABLE IF EXISTS arrests_in_past;']
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from eis import feature_builds
+
+
+def make_block():
+    return SimpleNamespace(lookback_durations=['1m', '1y'],
+                           prefix_space_time='irAG',
+                           prefix_post='',
+                           prefix=['ir', 'irAG'])
+
+
+class TestDatesBuilt:
+    def test_dates_need_every_prefix_and_lookback(self):
+        rows = [('ir', '2016-01-01', '1m'), ('ir', '2016-01-01', '1y'), ('irAG', '2016-01-01', 'all'),
+                # missing the 1y lookback
+                ('ir', '2016-02-01', '1m'), ('irAG', '2016-02-01', 'all'),
+                # missing the space-time table
+                ('ir', '2016-03-01', '1m'), ('ir', '2016-03-01', '1y')]
+
+        assert feature_builds.dates_built(make_block(), rows) == {'2016-01-01'}
+
+    def test_nothing_recorded(self):
+        assert feature_builds.dates_built(make_block(), []) == set()
+
+
+class TestFirstChangedMonth:
+    def test_changed_new_and_removed_months(self):
+        stored = {'2016-01-01': 'a', '2016-02-01': 'b', '2016-03-01': 'c'}
+
+        assert feature_builds.first_changed_month(stored, dict(stored)) is None
+        assert feature_builds.first_changed_month(stored, dict(stored, **{'2016-02-01': 'x'})) == '2016-02-01'
+        assert feature_builds.first_changed_month(stored, dict(stored, **{'2016-04-01': 'd'})) == '2016-04-01'
+        assert feature_builds.first_changed_month(stored, {'2016-02-01': 'b', '2016-03-01': 'c'}) == '2016-01-01'
+
+
+class TestScratchSchema:
+    def test_one_schema_per_block(self):
+        assert feature_builds.scratch_schema('features', 'IncidentsReported') == 'features_incremental_incidentsreported'
+        assert feature_builds.scratch_schema('features', 'OfficerArrests') != \
+            feature_builds.scratch_schema('features', 'IncidentsReported')
@@ -0,0 +1,68 @@
+from eis import feature_catalog
+
+
+COLUMNS = ['officer_id',
+           'as_of_date',
+           'ar_officer_id_P1Y_ArrestsOfType_felony_sum',
+           'ar_officer_id_P5Y_ArrestsOfType_felony_sum',
+           'ar_officer_id_P1Y_Suspensions_count',
+           'ar_officer_id_all_Arrests_count',
+           'ar_officer_id_Age_max']
+
+
+class CountingEngine:
+    def __init__(self, table_columns):
+        self.table_columns = table_columns
+        self.queries = []
+
+    def execute(self, query):
+        self.queries.append(query)
+        return [(table, column) for table, columns in self.table_columns.items() for column in columns]
+
+
+class TestResolveTableFeatures:
+    def test_time_window_all_and_non_time_window_features(self):
+        col_available, col_missing = feature_catalog.resolve_table_features(
+            COLUMNS, ['ArrestsOfType', 'Arrests', 'Age', 'Missing'], ['P1Y', 'P5Y'])
+
+        assert col_available == ['ar_officer_id_Age_max',
+                                 'ar_officer_id_P1Y_ArrestsOfType_felony_sum',
+                                 'ar_officer_id_P5Y_ArrestsOfType_felony_sum',
+                                 'ar_officer_id_all_Arrests_count']
+        assert col_missing == ['Missing']
+
+    def test_only_requested_lookbacks(self):
+        col_available, col_missing = feature_catalog.resolve_table_features(
+            COLUMNS, ['ArrestsOfType'], ['P1Y'])
+
+        assert col_available == ['ar_officer_id_P1Y_ArrestsOfType_felony_sum']
+        assert col_missing == []
+
+
+class TestFeaturesInBlocks:
+    def setup_method(self):
+        feature_catalog.invalidate()
+
+    def test_missing_features_go_to_the_next_table_of_the_block(self):
+        engine = CountingEngine({'first_aggregation': COLUMNS[:3],
+                                 'second_aggregation': ['officer_id', 'ar_officer_id_Age_max']})
+        blocks = [('ArrestsBlock', ['first_aggregation', 'second_aggregation'], ['ArrestsOfType', 'Age'])]
+
+        result = feature_catalog.features_in_blocks(engine, 'features', blocks, ['P1Y'])
+
+        assert list(result.items()) == [('first_aggregation', ['ar_officer_id_P1Y_ArrestsOfType_felony_sum']),
+                                        ('second_aggregation', ['ar_officer_id_Age_max'])]
+        assert len(engine.queries) == 1
+
+    def test_cached_until_invalidated(self):
+        engine = CountingEngine({'first_aggregation': COLUMNS})
+        blocks = [('ArrestsBlock', ['first_aggregation'], ['ArrestsOfType'])]
+
+        first = feature_catalog.features_in_blocks(engine, 'features', blocks, ['P1Y'])
+        second = feature_catalog.features_in_blocks(engine, 'features', blocks, ['P1Y'])
+        assert first == second
+        assert len(engine.queries) == 1
+
+        feature_catalog.invalidate('features')
+        feature_catalog.features_in_blocks(engine, 'features', blocks, ['P1Y'])
+        assert len(engine.queries) == 2
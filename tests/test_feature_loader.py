@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from eis.feature_loader import FeatureLoader
+
+
+class CsvCursor:
+    def __init__(self, csv_text):
+        self.csv_text = csv_text
+
+    def copy_expert(self, query, buffer):
+        buffer.write(self.csv_text.encode())
+
+
+class TestCopyInto:
+    def test_columns_are_written_from_first_column(self):
+        matrix = np.zeros((2, 3), dtype=np.float32)
+
+        col_names = FeatureLoader._copy_into(None, CsvCursor('a,b\n1,2\n3,4\n'), 'SELECT 1', matrix, 1)
+
+        assert col_names == ['a', 'b']
+        assert matrix.tolist() == [[0, 1, 2], [0, 3, 4]]
+
+    def test_rows_must_match_the_master_labels(self):
+        with pytest.raises(ValueError):
+            FeatureLoader._copy_into(None, CsvCursor('a\n1\n'), 'SELECT 1', np.zeros((2, 1), dtype=np.float32), 0)
+        with pytest.raises(ValueError):
+            FeatureLoader._copy_into(None, CsvCursor('a\n1\n2\n3\n'), 'SELECT 1', np.zeros((2, 1), dtype=np.float32), 0)
@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+from eis.feature_scheduler import FeatureScheduler
+
+
+class TestFeatureScheduler:
+    def test_dependencies_finish_first(self):
+        scheduler = FeatureScheduler(max_connections=4, workers=4)
+        finished = []
+
+        def job(name, seconds=0):
+            def run():
+                time.sleep(seconds)
+                finished.append(name)
+                return name
+            return run
+
+        scheduler.add_job('lookback', job('lookback', 0.05), cost=10)
+        scheduler.add_job('space_time', job('space_time'), cost=1)
+        scheduler.add_job('post', job('post'), cost=1, depends_on=['lookback'])
+
+        results = scheduler.run()
+
+        assert results == {'lookback': 'lookback', 'space_time': 'space_time', 'post': 'post'}
+        assert finished.index('post') > finished.index('lookback')
+
+    def test_longest_path_first_under_connection_cap(self):
+        scheduler = FeatureScheduler(max_connections=2, workers=2)
+        started = []
+        lock = threading.Lock()
+
+        def job(name):
+            def run():
+                with lock:
+                    started.append(name)
+                time.sleep(0.01)
+            return run
+
+        scheduler.add_job('small', job('small'), cost=1, connections=1)
+        scheduler.add_job('large', job('large'), cost=5, connections=2)
+        scheduler.add_job('chain', job('chain'), cost=1, connections=1)
+        scheduler.add_job('after_chain', job('after_chain'), cost=10, connections=1, depends_on=['chain'])
+
+        scheduler.run()
+
+        # chain leads to the longest path, large needs every connection so it runs alone
+        assert started[0] == 'chain'
+        assert started.index('large') > started.index('small')
+
+    def test_failed_job_raises(self):
+        scheduler = FeatureScheduler(max_connections=1)
+
+        def fail():
+            raise ValueError('collate failed')
+
+        scheduler.add_job('fail', fail)
+        scheduler.add_job('post', lambda: None, depends_on=['fail'])
+
+        with pytest.raises(ValueError):
+            scheduler.run()
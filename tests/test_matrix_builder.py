@@ -0,0 +1,44 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from eis.matrix_builder import MatrixBuilder
+
+
+def master_labels():
+    dates = [datetime.datetime(2015, 1, 1), datetime.datetime(2015, 2, 1)]
+    return pd.DataFrame({'officer_id': [1, 2, 1, 3],
+                         'as_of_date': [dates[0], dates[0], dates[1], dates[1]],
+                         'outcome': [0, 1, 0, 0]})
+
+
+class TestMatrixBuilder:
+    def test_fill_block_with_date(self):
+        builder = MatrixBuilder(master_labels(), ['a', 'b'])
+        table = pd.DataFrame({'officer_id': [3, 1, 4],
+                              'as_of_date': [datetime.datetime(2015, 2, 1), datetime.datetime(2015, 1, 1),
+                                             datetime.datetime(2015, 1, 1)],
+                              'a': np.array([5, 6, 7], dtype=np.float32),
+                              'b': np.array([8, 9, 10], dtype=np.float32)})
+        builder.fill_block(table)
+
+        expected = np.array([[6, 9], [0, 0], [0, 0], [5, 8]], dtype=np.float32)
+        assert np.array_equal(builder.matrix, expected)
+
+    def test_fill_block_without_date(self):
+        builder = MatrixBuilder(master_labels(), ['a', 'nd'])
+        table = pd.DataFrame({'officer_id': [1, 3], 'nd': np.array([2, 4], dtype=np.float32)})
+        builder.fill_block(table)
+
+        assert np.array_equal(builder.matrix[:, 1], np.array([2, 0, 2, 4], dtype=np.float32))
+        assert not builder.matrix[:, 0].any()
+
+    def test_to_dataframe_layout(self):
+        builder = MatrixBuilder(master_labels(), ['a', 'b'])
+        df = builder.to_dataframe()
+
+        assert df.columns.tolist() == ['as_of_date', 'a', 'b', 'outcome']
+        assert df.index.name == 'officer_id'
+        assert df['a'].dtype == np.float32
+        assert df['outcome'].sum() == 1
@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+import pandas as pd
+
+from eis.matrix_builder import align_features
+from eis.matrix_cache import MatrixCache
+
+
+class CsvMatrixCache(MatrixCache):
+    # stores the matrices with pandas so the tests do not depend on the metta file layout
+    def _write(self, uuid, metadata, df):
+        df.to_csv(os.path.join(self.directory, uuid + '.csv'))
+
+    def _read(self, uuid, metadata, matrix_format):
+        return pd.read_csv(os.path.join(self.directory, uuid + '.csv'), index_col=0)
+
+
+def matrix(n_rows=10):
+    return pd.DataFrame({'a': range(n_rows), 'outcome': [0] * n_rows})
+
+
+class TestMatrixCache:
+    def test_build_once_then_hit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CsvMatrixCache(directory, matrix_format='csv')
+            builds = []
+
+            def build():
+                builds.append(1)
+                return matrix()
+
+            first = cache.get_or_build('uuid1', {}, build)
+            second = cache.get_or_build('uuid1', {}, build)
+
+            assert len(builds) == 1
+            assert second['a'].tolist() == first['a'].tolist()
+            stats = cache.stats()
+            assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+            assert stats['total_hits'] == 1
+
+    def test_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CsvMatrixCache(directory, matrix_format='csv')
+            for uuid in ['old', 'recent']:
+                cache.get_or_build(uuid, {}, matrix, return_matrix=False)
+            cache.get_or_build('old', {}, matrix, return_matrix=False)
+
+            # room for two matrices only
+            cache.max_size_bytes = 2 * os.path.getsize(os.path.join(directory, 'old.csv'))
+            cache.get_or_build('new', {}, matrix, return_matrix=False)
+
+            assert not os.path.isfile(os.path.join(directory, 'recent.csv'))
+            assert os.path.isfile(os.path.join(directory, 'old.csv'))
+            assert os.path.isfile(os.path.join(directory, 'new.csv'))
+            assert cache.stats()['evictions'] == 1
+
+    def test_projection_stores_only_the_parent(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CsvMatrixCache(directory, matrix_format='csv')
+            parent = pd.DataFrame({'a': range(3), 'b': range(3, 6), 'c': range(6, 9), 'outcome': [0, 1, 0]},
+                                  columns=['a', 'b', 'c', 'outcome'])
+            builds = []
+
+            def build():
+                builds.append(1)
+                return parent
+
+            first = cache.get_or_project('leave_b', {'blocks': ['A', 'C']}, 'all', {}, build, ['b'])
+            second = cache.get_or_project('leave_c', {'blocks': ['A', 'B']}, 'all', {}, build, ['c'])
+            again = cache.get_or_project('leave_b', {'blocks': ['A', 'C']}, 'all', {}, build, ['b'])
+
+            assert len(builds) == 1
+            # same layout as a matrix built for the block set
+            assert first.columns.tolist() == ['a', 'c', 'outcome']
+            assert second.columns.tolist() == ['a', 'b', 'outcome']
+            assert again.equals(parent[['a', 'c', 'outcome']])
+            assert not os.path.isfile(os.path.join(directory, 'leave_b.csv'))
+            assert os.path.isfile(os.path.join(directory, 'leave_b.yaml'))
+            assert cache._parent('leave_b') == 'all'
+            assert cache.stats()['entries'] == 3
+
+    def test_cached_and_new_matrices_have_the_same_column_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CsvMatrixCache(directory, matrix_format='csv')
+            feature_names = ['ir_P1Y_Arrests', 'ir_P1Y_Age']
+            # stored before the block tables were resolved in sorted order
+            cache.get_or_build('train', {}, lambda: pd.DataFrame({'ir_p1y_arrests': [1, 2],
+                                                                  'ir_p1y_age': [30, 40],
+                                                                  'outcome': [0, 1]},
+                                                                 columns=['ir_p1y_arrests', 'ir_p1y_age', 'outcome']),
+                               return_matrix=False)
+            cached = cache.get_or_build('train', {}, None)
+            fresh = cache.get_or_build('test', {}, lambda: pd.DataFrame({'ir_p1y_age': [50],
+                                                                         'ir_p1y_arrests': [3],
+                                                                         'outcome': [1]},
+                                                                        columns=['ir_p1y_age', 'ir_p1y_arrests',
+                                                                                 'outcome']))
+
+            train = align_features(cached, feature_names)
+            test = align_features(fresh, feature_names)
+
+            assert train.columns.tolist() == test.columns.tolist() == ['ir_p1y_arrests', 'ir_p1y_age', 'outcome']
+            assert test.iloc[0].tolist() == [3, 50, 1]
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pandas as pd
+
+from eis.matrix_prefetcher import MatrixPrefetcher, matrix_bytes
+
+
+class RecordingLoader:
+    def __init__(self, seconds=0):
+        self.seconds = seconds
+        self.loaded = []
+        self.threads = set()
+
+    def __call__(self, key):
+        time.sleep(self.seconds)
+        self.loaded.append(key)
+        self.threads.add(threading.current_thread().name)
+        return {}, pd.DataFrame({'a': [key] * 4}), 'uuid_{}'.format(key)
+
+
+class TestMatrixPrefetcher:
+    def test_yields_in_order(self):
+        loader = RecordingLoader()
+        prefetcher = MatrixPrefetcher(loader, [1, 2, 3], depth=2)
+
+        assert [(key, value[2]) for key, value in prefetcher] == [(1, 'uuid_1'), (2, 'uuid_2'), (3, 'uuid_3')]
+        assert threading.current_thread().name not in loader.threads
+
+    def test_next_matrix_loads_while_one_is_scored(self):
+        loader = RecordingLoader(seconds=0.05)
+        prefetcher = MatrixPrefetcher(loader, [1, 2], depth=1)
+
+        for key, _ in prefetcher:
+            if key == 1:
+                time.sleep(0.1)
+                assert loader.loaded == [1, 2]
+        # only the first matrix was waited for, both were loaded
+        assert prefetcher.wait_seconds < 0.1
+        assert prefetcher.load_seconds >= 0.1
+
+    def test_memory_ceiling_stops_loading_ahead(self):
+        loader = RecordingLoader()
+        one_matrix = matrix_bytes(loader(0))
+        loader.loaded = []
+        prefetcher = MatrixPrefetcher(loader, [1, 2, 3], depth=2, max_size_gb=1.5 * one_matrix / 1024 ** 3)
+
+        for key, _ in prefetcher:
+            time.sleep(0.02)
+            if key == 1:
+                # room for the next matrix only
+                assert loader.loaded == [1, 2]
+
+    def test_depth_zero_loads_in_the_caller(self):
+        loader = RecordingLoader()
+        list(MatrixPrefetcher(loader, [1, 2], depth=0))
+
+        assert loader.threads == {threading.current_thread().name}
@@ -0,0 +1,39 @@
+import datetime
+import random
+
+from eis.metadata import _selection_sort, make_hashable, sort_multiple_types
+
+
+def feature_names(n):
+    names = ['ft_{}_{}'.format(random.choice('ABCD'), i % 97) for i in range(n)]
+    random.shuffle(names)
+    return names
+
+
+class TestSortMultipleTypes:
+    def test_strings_sorted_as_selection_sort(self):
+        names = feature_names(500)
+        assert sort_multiple_types(list(names)) == _selection_sort(list(names))
+
+    def test_mixed_types_sorted_as_selection_sort(self):
+        mixed = ['b', {'z': '1', 'aa': '2'}, 'a', 'ab']
+        assert sort_multiple_types(list(mixed)) == _selection_sort(list(mixed))
+
+
+class TestMakeHashable:
+    def test_metadata_canonical_form(self):
+        metadata = {'feature_names': feature_names(200),
+                    'feature_as_of_dates': ['2015-02-01', '2015-01-01'],
+                    'start_time': datetime.datetime(2015, 1, 1),
+                    'labels': [['ForceAllegation', 'Complaint'], ['Arrest']],
+                    'labels_config': {'Arrest': {'table': 'arrests'}},
+                    'blocks': {'b', 'a'},
+                    'train_size': 1}
+        hashable = make_hashable(metadata)
+
+        assert list(hashable) == sorted(metadata)
+        assert hashable['feature_names'] == sorted(metadata['feature_names'])
+        assert hashable['feature_as_of_dates'] == ['2015-01-01', '2015-02-01']
+        assert hashable['labels'] == [['Arrest'], ['ForceAllegation', 'Complaint']]
+        assert hashable['blocks'] == ['a', 'b']
+        assert hashable['start_time'] == datetime.datetime(2015, 1, 1)
@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+import numpy as np
+
+from eis.model_store import ModelStore, storage_engine
+
+
+class TestModelStore:
+    def test_stored_model_is_found_by_a_new_store(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            store = ModelStore(project_path).get_store('hash1')
+            assert not store.exists()
+            store.write({'coef': np.arange(3)})
+
+            # e.g. the next production run
+            reloaded = ModelStore(project_path).get_store('hash1')
+            assert reloaded.exists()
+            assert reloaded.load()['coef'].tolist() == [0, 1, 2]
+
+    def test_delete_only_drops_the_loaded_model(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            engine = ModelStore(project_path, compress=0)
+            store = engine.get_store('hash1')
+            store.write({'coef': np.arange(3)})
+            store.delete()
+
+            assert 'hash1' not in engine.loaded
+            assert store.exists()
+            assert store.load()['coef'].tolist() == [0, 1, 2]
+
+    def test_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            engine = ModelStore(project_path, compress=0)
+            for model_hash in ['old', 'recent']:
+                engine.get_store(model_hash).write(np.zeros(1000))
+                engine.get_store(model_hash).delete()
+            os.utime(engine.path('old'), (1, 1))
+
+            # room for two models only
+            engine.max_size_bytes = 2 * os.path.getsize(engine.path('old'))
+            engine.get_store('new').write(np.zeros(1000))
+
+            assert not os.path.isfile(engine.path('old'))
+            assert os.path.isfile(engine.path('recent'))
+            assert os.path.isfile(engine.path('new'))
+
+    def test_disabled_store_keeps_the_models_in_memory(self):
+        with tempfile.TemporaryDirectory() as project_path:
+            assert not isinstance(storage_engine(project_path, {'enabled': False}), ModelStore)
+            assert isinstance(storage_engine(project_path, {'enabled': True, 'replace': True}), ModelStore)
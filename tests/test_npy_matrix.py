@@ -0,0 +1,60 @@
+import datetime
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from eis import npy_matrix
+
+
+def matrix():
+    df = pd.DataFrame({'as_of_date': [datetime.datetime(2015, 1, 1)] * 3,
+                       'a': np.array([1, 2, 3], dtype=np.float32),
+                       'b': np.array([4, 5, 6], dtype=np.float32),
+                       'outcome': [0, 1, 0]},
+                      columns=['as_of_date', 'a', 'b', 'outcome'],
+                      index=pd.Index([10, 11, 12], name='officer_id'))
+    return df
+
+
+class TestNpyMatrix:
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            npy_matrix.write_matrix(directory, 'uuid1', {'matrix_id': 'test'}, matrix())
+            df = npy_matrix.read_matrix(directory, 'uuid1')
+            npy_matrix.close_matrix('uuid1')
+
+            assert df.columns.tolist() == ['as_of_date', 'a', 'b', 'outcome']
+            assert df.index.name == 'officer_id'
+            assert df.index.tolist() == [10, 11, 12]
+            assert df['b'].tolist() == [4, 5, 6]
+            assert df['outcome'].tolist() == [0, 1, 0]
+            assert (df['as_of_date'] == datetime.datetime(2015, 1, 1)).all()
+
+    def test_features_are_mapped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            npy_matrix.write_matrix(directory, 'uuid2', {}, matrix())
+            first = npy_matrix.read_matrix(directory, 'uuid2')
+            second = npy_matrix.read_matrix(directory, 'uuid2')
+            mapped = npy_matrix._open_matrices['uuid2']['features']
+            npy_matrix.close_matrix('uuid2')
+
+            assert isinstance(mapped, np.memmap)
+            assert np.shares_memory(first['a'].values, mapped)
+            assert np.shares_memory(second['a'].values, mapped)
+
+    def test_least_recently_read_matrix_is_closed(self, monkeypatch):
+        monkeypatch.setattr(npy_matrix, 'MAX_OPEN_MATRICES', 2)
+        with tempfile.TemporaryDirectory() as directory:
+            for uuid in ('lru1', 'lru2', 'lru3'):
+                npy_matrix.write_matrix(directory, uuid, {}, matrix())
+            npy_matrix.read_matrix(directory, 'lru1')
+            npy_matrix.read_matrix(directory, 'lru2')
+            npy_matrix.read_matrix(directory, 'lru1')
+            df = npy_matrix.read_matrix(directory, 'lru3')
+            open_uuids = list(npy_matrix._open_matrices)
+            for uuid in ('lru1', 'lru2', 'lru3'):
+                npy_matrix.close_matrix(uuid)
+
+            assert open_uuids == ['lru1', 'lru3']
+            assert df['a'].tolist() == [1, 2, 3]
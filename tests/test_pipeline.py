@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+import pytest
+
+from eis.pipeline import Pipeline
+
+
+def produce(directory, name):
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write(name.upper())
+
+
+def consume(directory, name):
+    # runs in a worker process, reads what the producer stored
+    with open(os.path.join(directory, name)) as f:
+        return f.read()
+
+
+def fail(directory, name):
+    raise ValueError(name)
+
+
+class TestPipeline:
+    def test_consumes_what_was_produced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jobs = [(directory, name) for name in ['a', 'b', 'c', 'd']]
+            pipeline = Pipeline(produce, consume, producers=2, consumers=2, max_queued=1)
+
+            assert pipeline.run(jobs) == ['A', 'B', 'C', 'D']
+
+    def test_raises_the_error_of_a_stage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pipeline = Pipeline(produce, fail, consumers=1)
+
+            with pytest.raises(ValueError):
+                pipeline.run([(directory, 'a'), (directory, 'b')])
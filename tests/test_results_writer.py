@@ -0,0 +1,54 @@
+import pandas as pd
+
+from eis import results_writer
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query):
+        self.connection.statements.append(query)
+
+    def copy_expert(self, query, buffer):
+        self.connection.statements.append(query)
+        self.connection.copied.append(buffer.read())
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+        self.copied = []
+        self.commits = 0
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+class TestResultsWriter:
+    def test_copy_dataframe_writes_nulls_after_delete(self):
+        db_conn = RecordingConnection()
+        df = pd.DataFrame({'model_id': [1, 1], 'risk_1': ['a', None]}, columns=['model_id', 'risk_1'])
+
+        n_rows = results_writer.copy_dataframe(db_conn, 'results.individual_importances', df,
+                                               delete_query='DELETE FROM results.individual_importances')
+
+        assert n_rows == 2
+        assert db_conn.statements[0] == 'DELETE FROM results.individual_importances'
+        assert db_conn.statements[1] == 'COPY results.individual_importances (model_id, risk_1) FROM STDIN WITH CSV'
+        assert db_conn.copied == ['1,a\n1,\n']
+        assert db_conn.commits == 1
+
+    def test_copy_rows_without_delete(self):
+        db_conn = RecordingConnection()
+
+        n_rows = results_writer.copy_rows(db_conn, 'results.evaluations', ['model_id', 'metric'],
+                                          [(1, 'auc'), (2, None)])
+
+        assert n_rows == 2
+        assert db_conn.statements == ['COPY results.evaluations (model_id, metric) FROM STDIN WITH CSV']
+        assert db_conn.copied == ['1,auc\n2,\n']
+        assert db_conn.commits == 1
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from eis.risk_factors import top_risk_factors
+
+
+def nlargest_risk_factors(test_matrix):
+    # original implementation of RunModels.individual_feature_ranking
+    test_matrix_reduced = test_matrix.copy()
+    test_matrix_rank_distance = pd.DataFrame()
+    for feature in test_matrix.columns:
+        feature_median = test_matrix_reduced[feature].median()
+        ranks = test_matrix_reduced[feature].rank()
+        idx = np.nanargmin(np.abs(test_matrix_reduced[feature] - feature_median))
+        test_matrix_rank_distance[feature] = np.abs(ranks - ranks.iloc[idx])
+    matrix_transposed = test_matrix_rank_distance.reset_index(drop=True).T
+    rows = [matrix_transposed.nlargest(5, i).index.tolist() for i in matrix_transposed.columns]
+    return pd.DataFrame(rows, columns=['risk_1', 'risk_2', 'risk_3', 'risk_4', 'risk_5'])
+
+
+class TestTopRiskFactors:
+    def test_matches_nlargest_with_ties(self):
+        np.random.seed(0)
+        # few distinct values so ranks and distances tie often
+        test_matrix = pd.DataFrame(np.random.randint(0, 4, size=(300, 12)).astype(np.float32),
+                                   columns=['f{}'.format(i) for i in range(12)])
+
+        result = top_risk_factors(test_matrix)
+
+        assert result.equals(nlargest_risk_factors(test_matrix))
+
+    def test_pads_when_fewer_features(self):
+        test_matrix = pd.DataFrame({'a': np.array([1, 2, 3], dtype=np.float32),
+                                    'b': np.array([3, 3, 1], dtype=np.float32)},
+                                   columns=['a', 'b'])
+
+        result = top_risk_factors(test_matrix)
+
+        assert result.columns.tolist() == ['risk_1', 'risk_2', 'risk_3', 'risk_4', 'risk_5']
+        assert result.iloc[0].tolist() == ['a', 'b', None, None, None]
+        assert result['risk_3'].isnull().all()
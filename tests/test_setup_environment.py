@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+from sqlalchemy import create_engine
+
+from eis import setup_environment
+from eis.setup_environment import TimedQueuePool
+
+
+def pooled_engine(directory, pool_size):
+    # a checkout that is never returned makes the next one fail after pool_timeout
+    return create_engine('sqlite:///' + os.path.join(directory, 'test.db'), poolclass=TimedQueuePool,
+                         pool_size=pool_size, max_overflow=0, pool_timeout=1)
+
+
+class TestConnectionPool:
+    def test_more_checkouts_than_pool_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = pooled_engine(directory, pool_size=2)
+            engine.execute('CREATE TABLE features (officer_id integer)')
+
+            for officer_id in range(5):
+                engine.execute('INSERT INTO features VALUES ({})'.format(officer_id))
+                assert len(engine.execute('SELECT * FROM features').fetchall()) == officer_id + 1
+
+                db_conn = engine.raw_connection()
+                try:
+                    db_conn.cursor().execute('SELECT count(*) FROM features')
+                finally:
+                    db_conn.close()
+
+                with engine.connect() as conn:
+                    conn.execute('SELECT 1').fetchall()
+
+            assert engine.pool.checkedout() == 0
+            assert engine.pool.checkouts > 2 * 5
+
+    def test_pool_stats_of_the_engines_of_the_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = pooled_engine(directory, pool_size=2)
+            setup_environment._engines[('sqlite', False, os.getpid())] = engine
+            try:
+                engine.execute('SELECT 1').fetchall()
+                stats = [s for s in setup_environment.pool_stats() if s['size'] == 2]
+                assert stats[0]['checked_out'] == 0
+                assert stats[0]['checkouts'] >= 1
+            finally:
+                del setup_environment._engines[('sqlite', False, os.getpid())]
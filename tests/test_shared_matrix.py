@@ -0,0 +1,63 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from eis import shared_matrix
+
+
+class FakeFeatureLoader:
+    def __init__(self):
+        self.calls = []
+
+    def get_dataset(self, as_of_dates_to_use):
+        self.calls.append(list(as_of_dates_to_use))
+        return pd.DataFrame({'as_of_date': [datetime.datetime(2015, 1, 1)] * 3,
+                             'a_x': np.array([1, 2, 3], dtype=np.float32),
+                             'b_y': np.array([4, 5, 6], dtype=np.float32),
+                             'c_z': np.array([7, 8, 9], dtype=np.float32),
+                             'outcome': [0, 1, 0]},
+                            columns=['as_of_date', 'a_x', 'b_y', 'c_z', 'outcome'],
+                            index=pd.Index([10, 11, 12], name='officer_id'))
+
+
+class TestSharedMatrix:
+    def test_superset_blocks_keep_their_order(self):
+        block_sets = [['A', 'B'], ['A', 'C'], ['B', 'C']]
+        assert shared_matrix.superset_blocks(block_sets) == ['A', 'B', 'C']
+
+    def test_column_runs(self):
+        assert shared_matrix.column_runs([0, 1, 3, 4, 5]) == [slice(0, 2), slice(3, 6)]
+
+    def test_block_sets_are_subsets_of_one_load(self):
+        loader = FakeFeatureLoader()
+        matrix = shared_matrix.SharedMatrix(loader)
+
+        first = matrix.get_dataset(['2015-01-01'], ['A_x', 'C_z'])
+        second = matrix.get_dataset(['2015-01-01'], ['A_x', 'B_y'])
+
+        assert loader.calls == [['2015-01-01']]
+        assert first.columns.tolist() == ['as_of_date', 'a_x', 'c_z', 'outcome']
+        assert first.index.name == 'officer_id'
+        assert first['c_z'].tolist() == [7, 8, 9]
+        assert first['outcome'].tolist() == [0, 1, 0]
+        assert second['b_y'].tolist() == [4, 5, 6]
+
+    def test_contiguous_columns_are_not_copied(self):
+        matrix = shared_matrix.SharedMatrix(FakeFeatureLoader())
+        df = matrix.get_dataset(['2015-01-01'], ['B_y', 'C_z'])
+
+        superset = matrix._matrices[('2015-01-01',)]['features']
+        assert np.shares_memory(df['b_y'].values, superset)
+
+    def test_matrices_past_the_size_cap_are_not_kept(self):
+        unbounded = shared_matrix.SharedMatrix(FakeFeatureLoader())
+        one_matrix = unbounded._size(unbounded._matrix(['2015-01-01']))
+        matrix = shared_matrix.SharedMatrix(FakeFeatureLoader(), max_size_gb=1.5 * one_matrix / 1024 ** 3)
+
+        matrix.get_dataset(['2015-01-01'], ['A_x'])
+        matrix.get_dataset(['2016-01-01'], ['A_x'])
+        matrix.get_dataset(['2015-01-01'], ['B_y'])
+
+        assert list(matrix._matrices) == [('2015-01-01',)]
+        assert matrix.loads == 2
@@ -0,0 +1,44 @@
+import numpy as np
+
+from eis.threshold_metrics import ThresholdMetrics
+
+
+def sorted_confusion_matrix(test_labels, test_predictions, cutoff_index):
+    # original computation of scoring.calculate_all_evaluation_metrics
+    _, labels_sorted = zip(*sorted(zip(test_predictions, test_labels), key=lambda pair: pair[0], reverse=True))
+    binary = [1 if x < cutoff_index else 0 for x in range(len(labels_sorted))]
+    TP = sum(1 for (x, y) in zip(binary, labels_sorted) if x == 1 and y == 1)
+    TN = sum(1 for (x, y) in zip(binary, labels_sorted) if x == 0 and y == 0)
+    FP = sum(1 for (x, y) in zip(binary, labels_sorted) if x == 1 and y == 0)
+    FN = sum(1 for (x, y) in zip(binary, labels_sorted) if x == 0 and y == 1)
+    return TP, TN, FP, FN
+
+
+class TestThresholdMetrics:
+    def test_confusion_matrix_matches_sorted_lists(self):
+        np.random.seed(0)
+        test_labels = np.random.randint(0, 2, 500).tolist()
+        # rounded scores so there are ties in the ordering
+        test_predictions = np.random.rand(500).round(2).tolist()
+        threshold_metrics = ThresholdMetrics(test_labels, test_predictions)
+
+        for x_value, unit in [(10, 'abs'), (1000, 'abs'), (0.01, 'pct'), (25.0, 'pct'), (100.0, 'pct')]:
+            k = threshold_metrics.cutoff(x_value, unit)
+            cutoff_index = int(500 * (x_value / 100.00)) if unit == 'pct' else x_value
+            assert threshold_metrics.confusion_matrix_at(k) == sorted_confusion_matrix(test_labels,
+                                                                                      test_predictions,
+                                                                                      cutoff_index)
+
+    def test_metric_keys_and_values(self):
+        test_labels = [1, 0, 1, 0]
+        test_predictions = [0.9, 0.8, 0.1, 0.5]
+
+        all_metrics = ThresholdMetrics(test_labels, test_predictions).metrics({'pct': [50.0], 'abs': [0, 10]})
+
+        assert all_metrics['precision@|50.0_pct'] == 0.5
+        assert all_metrics['recall@|50.0_pct'] == 0.5
+        assert all_metrics['precision@|0_abs'] == 0
+        assert all_metrics['true negatives@|0_abs'] == 2
+        assert all_metrics['recall@|10_abs'] == 1.0
+        assert all_metrics['false positives@|10_abs'] == 2
+        assert len(all_metrics) == 3 * 6
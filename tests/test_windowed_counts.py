@@ -0,0 +1,39 @@
+import numpy as np
+
+from eis.windowed_counts import windowed_counts
+
+
+def range_join_counts(times, event_times, windows, event_weights):
+    # one range join per window, as the query of every ArrestsInPast feature class
+    counts = np.zeros((len(times), len(windows), event_weights.shape[1]), dtype=np.int64)
+    for i, time in enumerate(times):
+        for j, window in enumerate(windows):
+            in_window = (event_times >= time - window) & (event_times <= time)
+            counts[i, j] = event_weights[in_window].sum(axis=0)
+    return counts
+
+
+class TestWindowedCounts:
+    def test_matches_range_joins(self):
+        np.random.seed(0)
+        start = np.datetime64('2016-01-01T00:00')
+        # minutes, so many events fall on the bounds of the windows
+        event_times = start + np.random.randint(0, 60 * 24 * 30, size=2000).astype('timedelta64[m]')
+        times = np.concatenate([start + np.random.randint(0, 60 * 24 * 30, size=300).astype('timedelta64[m]'),
+                                event_times[:50] + np.timedelta64(1, 'h')])
+        windows = [np.timedelta64(1, 'h'), np.timedelta64(24, 'h'), np.timedelta64(7, 'D')]
+        event_weights = np.column_stack([np.ones(2000, dtype=np.int64), np.random.randint(0, 3, size=2000)])
+
+        result = windowed_counts(times, event_times, windows, event_weights)
+
+        expected = range_join_counts(times.astype('datetime64[ns]'), event_times.astype('datetime64[ns]'),
+                                     windows, event_weights)
+        assert np.array_equal(result, expected)
+
+    def test_one_count_per_event_without_weights(self):
+        times = np.array(['2016-01-01T10:00'], dtype='datetime64[m]')
+        event_times = np.array(['2016-01-01T09:00', '2016-01-01T09:30', '2016-01-01T10:01'], dtype='datetime64[m]')
+
+        result = windowed_counts(times, event_times, [np.timedelta64(1, 'h'), np.timedelta64(10, 'm')])
+
+        assert result[:, :, 0].tolist() == [[2, 0]]